@@ -0,0 +1,8 @@
+"""Benchmarks for dicomgenerator hot paths
+
+Run all benchmarks and save results as a baseline, then compare a later run:
+
+    $ python -m benchmarks run --output baseline.json
+    $ python -m benchmarks run --output current.json
+    $ python -m benchmarks compare baseline.json current.json --threshold 0.2
+"""
@@ -0,0 +1,81 @@
+"""Command line entry point, see benchmarks/__init__.py"""
+import sys
+from pathlib import Path
+
+import click
+
+from benchmarks.runner import (
+    find_regressions,
+    iter_results,
+    load_results,
+    save_results,
+)
+
+
+def format_seconds(seconds: float) -> str:
+    for unit, factor in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= factor:
+            return f"{seconds / factor:.3g}{unit}"
+    return f"{seconds / 1e-9:.3g}ns"
+
+
+@click.group()
+def main():
+    """Benchmark dicomgenerator"""
+
+
+@main.command()
+@click.option("--output", "-o", type=click.Path(path_type=Path), help="Save as JSON")
+@click.option("--keyword", "-k", help="Only run benchmarks with this in their name")
+@click.option("--repeat", type=int, default=5, show_default=True)
+@click.option(
+    "--min-time",
+    type=float,
+    default=0.05,
+    show_default=True,
+    help="Minimum seconds per repeat",
+)
+def run(output, keyword, repeat, min_time):
+    """Run benchmarks and print seconds per call"""
+    results = {}
+    for name, result in iter_results(keyword=keyword, repeat=repeat, min_time=min_time):
+        click.echo(
+            f"{name:<45} {format_seconds(result.best):>10} "
+            f"(median {format_seconds(result.median)})"
+        )
+        results[name] = result
+    if output:
+        save_results(results, output)
+        click.echo(f"Saved {len(results)} results to {output}")
+
+
+@main.command()
+@click.argument("baseline", type=click.Path(exists=True, path_type=Path))
+@click.argument("current", type=click.Path(exists=True, path_type=Path))
+@click.option(
+    "--threshold",
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="Fail if any benchmark is this much slower. 0.2 is 20%",
+)
+def compare(baseline, current, threshold):
+    """Compare two saved runs. Exits with 1 if CURRENT is slower than BASELINE"""
+    before, after = load_results(baseline), load_results(current)
+    for name in sorted(before.keys() & after.keys()):
+        ratio = after[name].best / before[name].best
+        click.echo(
+            f"{name:<45} {format_seconds(before[name].best):>10} -> "
+            f"{format_seconds(after[name].best):>10} ({ratio:.2f}x)"
+        )
+    regressions = find_regressions(before, after, threshold=threshold)
+    if regressions:
+        click.echo(f"\n{len(regressions)} regressions beyond {threshold:.0%}:")
+        for regression in regressions:
+            click.echo(f"  {regression.name}: {regression.ratio:.2f}x slower")
+        sys.exit(1)
+    click.echo(f"\nNo regressions beyond {threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
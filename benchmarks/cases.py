@@ -0,0 +1,196 @@
+"""Benchmark cases. Each case is set up once per parameter, then timed"""
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Callable, List, Sequence
+
+import numpy as np
+from pydicom.datadict import DicomDictionary
+from pydicom.dataset import Dataset
+
+from dicomgenerator.binary_templates import compile_template, load_template
+from dicomgenerator.export import export
+from dicomgenerator.generators import DataElementFactory, ElementPlan, quick_dataset
+from dicomgenerator.persistence import JSONDataset
+from dicomgenerator.pixeldata import (
+    Block,
+    _image_pixels_cache,
+    add_blocks,
+    add_blocks_array,
+    add_pixel_data_2d,
+    draw_noise,
+    replace_pixel_data,
+)
+from dicomgenerator.resources import RESOURCE_PATH, TEMPLATE_PATH
+from dicomgenerator.templates import CTDatasetFactory
+from dicomgenerator.writer import CompiledTemplate
+
+
+@dataclass
+class Case:
+    """Something to time for each of params
+
+    setup is called with a single param and returns the function to time
+    """
+
+    name: str
+    setup: Callable[[Any], Callable[[], Any]]
+    params: Sequence[Any]
+
+    def ids(self) -> List[str]:
+        return [f"{self.name}[{x}]" for x in self.params]
+
+
+CASES: List[Case] = []
+
+
+def case(*params):
+    """Register decorated setup function as a benchmark case"""
+
+    def register(setup):
+        CASES.append(Case(name=setup.__name__, setup=setup, params=params))
+        return setup
+
+    return register
+
+
+def string_keywords(count: int) -> List[str]:
+    """Keywords of count current (not retired) elements with a text VR"""
+    keywords = [
+        keyword
+        for vr, _, _, retired, keyword in DicomDictionary.values()
+        if vr in ("LO", "SH", "CS") and not retired and keyword
+    ]
+    return keywords[:count]
+
+
+def pixel_dataset(size: int) -> Dataset:
+    dataset: Dataset = CTDatasetFactory.create()
+    if size:
+        pixels = draw_noise(size, size, "uint16", seed="benchmark")
+        add_pixel_data_2d(dataset, pixels, dtype="uint16")
+    return dataset
+
+
+def random_blocks(count: int, size: int = 512) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    origins = rng.integers(0, size // 2, (count, 2))
+    sizes = rng.integers(1, size // 2, (count, 2))
+    return np.column_stack([origins, sizes])
+
+
+@case(1, 10, 100)
+def ct_dataset_factory(batch_size):
+    return lambda: list(CTDatasetFactory.iter_batch(batch_size))
+
+
+@case(1, 10, 100)
+def ct_dataset_factory_loop(batch_size):
+    """Same as ct_dataset_factory, without the work shared between items"""
+    return lambda: [CTDatasetFactory() for _ in range(batch_size)]
+
+
+@case(10, 100, 1000)
+def quick_dataset_elements(element_count):
+    values = {x: "value" for x in string_keywords(element_count)}
+    return lambda: quick_dataset(**values)
+
+
+@case(10, 100, 1000)
+def data_element_factory(element_count):
+    keywords = string_keywords(element_count)
+    return lambda: [DataElementFactory(tag=x) for x in keywords]
+
+
+@case(10, 100, 1000)
+def element_plan(element_count):
+    plan = ElementPlan(string_keywords(element_count))
+    return plan.elements
+
+
+@case(64, 512, 2048)
+def draw_noise_uint16(size):
+    return lambda: draw_noise(size, size, "uint16")
+
+
+@case(10, 100, 1000)
+def add_blocks_512(block_count):
+    dataset = pixel_dataset(512)
+    blocks = [Block(*x) for x in random_blocks(block_count).tolist()]
+    return lambda: add_blocks(dataset, blocks, value=0)
+
+
+@case(10, 100, 1000)
+def add_blocks_array_512(block_count):
+    dataset = pixel_dataset(512)
+    blocks = random_blocks(block_count)
+    return lambda: add_blocks_array(dataset, blocks, value=0)
+
+
+@case("uncached", "cached")
+def replace_pixel_data_jpg(caching):
+    dataset = CTDatasetFactory()
+    image_path = RESOURCE_PATH / "skeleton.jpg"
+
+    def replace():
+        if caching == "uncached":
+            _image_pixels_cache.clear()
+        replace_pixel_data(dataset, image_path=image_path)
+
+    return replace
+
+
+@case(10, 100, 1000)
+def json_dataset_save(element_count):
+    dataset = JSONDataset(
+        quick_dataset(**{x: "v" for x in string_keywords(element_count)})
+    )
+    return lambda: dataset.save(io.StringIO())
+
+
+@case(10, 100, 1000)
+def json_dataset_load(element_count):
+    handle = io.StringIO()
+    JSONDataset(quick_dataset(**{x: "v" for x in string_keywords(element_count)})).save(
+        handle
+    )
+    text = handle.getvalue()
+    return lambda: JSONDataset.load(io.StringIO(text))
+
+
+@case(0, 512, 2048)
+def export_ct(size):
+    dataset = pixel_dataset(size)
+    return lambda: export(dataset, path=os.devnull)
+
+
+@case(0, 512, 2048)
+def compiled_template_encode(size):
+    template = CompiledTemplate.compile(pixel_dataset(size))
+    return lambda: template.encode(SOPInstanceUID="1.2.3")
+
+
+@case("json", "binary")
+def load_ct_template(kind):
+    """Load the CT template without caching, as each worker process does"""
+    cache_dir = tempfile.mkdtemp()
+    path = TEMPLATE_PATH / "ct_toshiba_aquilion.json"
+    if kind == "binary":
+        compile_template(path, cache_dir=cache_dir)
+    return lambda: load_template(path, cache_dir=cache_dir)
+
+
+@case(
+    "dicomgenerator.pixeldata",
+    "dicomgenerator.export",
+    "dicomgenerator.parallel",
+    "dicomgenerator.cli",
+    "dicomgenerator.templates",
+)
+def import_module(module):
+    """Time to import module in a fresh interpreter, as worker processes do"""
+    command = [sys.executable, "-c", f"import {module}"]
+    return lambda: subprocess.run(command, check=True)
@@ -0,0 +1,87 @@
+"""Time benchmark cases and compare results between runs"""
+import json
+import platform
+import statistics
+import timeit
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import pydicom
+
+from benchmarks.cases import CASES, Case
+
+
+@dataclass
+class Result:
+    """Seconds per call for a single benchmark"""
+
+    best: float
+    median: float
+    number: int  # calls per repeat
+
+
+@dataclass
+class Regression:
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline
+
+
+def measure(function, repeat: int = 5, min_time: float = 0.05) -> Result:
+    """Time function. Calls it often enough per repeat to take min_time seconds"""
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time and number < 10**6:
+        number *= 2
+    times = [x / number for x in timer.repeat(repeat=repeat, number=number)]
+    return Result(best=min(times), median=statistics.median(times), number=number)
+
+
+def iter_results(
+    cases: Sequence[Case] = CASES,
+    keyword: Optional[str] = None,
+    repeat: int = 5,
+    min_time: float = 0.05,
+) -> Iterator[Tuple[str, Result]]:
+    """(benchmark name, Result) for all cases whose name contains keyword"""
+    for case in cases:
+        for name, param in zip(case.ids(), case.params, strict=True):
+            if keyword and keyword not in name:
+                continue
+            yield name, measure(case.setup(param), repeat=repeat, min_time=min_time)
+
+
+def save_results(results: Dict[str, Result], path: Path):
+    data = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pydicom": pydicom.__version__,
+        },
+        "results": {name: asdict(result) for name, result in results.items()},
+    }
+    path.write_text(json.dumps(data, indent=2))
+
+
+def load_results(path: Path) -> Dict[str, Result]:
+    data = json.loads(path.read_text())
+    return {name: Result(**value) for name, value in data["results"].items()}
+
+
+def find_regressions(
+    baseline: Dict[str, Result], current: Dict[str, Result], threshold: float = 0.2
+) -> List[Regression]:
+    """Benchmarks that got more than threshold (0.2 is 20%) slower than baseline.
+    Benchmarks that are not in both are ignored
+    """
+    regressions = []
+    for name in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[name].best, current[name].best
+        if after > before * (1 + threshold):
+            regressions.append(Regression(name, baseline=before, current=after))
+    return regressions
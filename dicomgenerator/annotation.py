@@ -1,11 +1,61 @@
 """Code for adding annotations to datasets"""
-from typing import Any, Union
+import functools
+import json
+from decimal import Decimal
+from typing import Any, Dict, Iterator, NamedTuple, Tuple, Union
 
 from pydicom.datadict import dictionary_keyword
+from pydicom.dataelem import DataElement
 from pydicom.dataset import Dataset
-from pydicom.tag import Tag
+from pydicom.tag import BaseTag, Tag
+from pydicom.valuerep import PersonName
 
-from dicomgenerator.persistence import FileJSONDataset, JSONDataset
+from dicomgenerator.persistence import (
+    BULK_DATA_THRESHOLD,
+    JSON_INDENT,
+    FileJSONDataset,
+    JSONDataset,
+    iter_json_object,
+)
+
+# Values of these types cannot change without being replaced by another object
+IMMUTABLE_TYPES = (str, int, float, bytes, Decimal, PersonName, type(None))
+
+
+@functools.lru_cache(maxsize=None)
+def tag_name(tag: int) -> str:
+    """DICOM keyword for tag, 'Unknown' if tag is not in the dictionary. Each tag
+    is looked up only once
+    """
+    try:
+        return dictionary_keyword(tag)
+    except KeyError:
+        return "Unknown"
+
+
+class EncodedElement(NamedTuple):
+    """Json text of an element, with what it was encoded from"""
+
+    element: DataElement
+    value: Any
+    vr: str
+    annotation: Any
+    text: str
+
+    def is_current(self, element: DataElement, annotation: Any) -> bool:
+        """True if encoding element and annotation again would give the same text
+
+        Only values that cannot be modified in place are compared, by identity.
+        Sequences and multi-values are always considered changed
+        """
+        return (
+            self.element is element
+            and self.value is element.value
+            and self.annotation is annotation
+            and self.vr == element.VR
+            and isinstance(self.value, IMMUTABLE_TYPES)
+            and isinstance(annotation, IMMUTABLE_TYPES)
+        )
 
 
 class AnnotatedDataset(JSONDataset):
@@ -39,6 +89,8 @@ class AnnotatedDataset(JSONDataset):
             self.annotations = {}
         else:
             self.annotations = {Tag(x): y for x, y in annotations.items()}
+        # Json text of each element from the previous save, see iter_json()
+        self._encoded: Dict[BaseTag, EncodedElement] = {}
 
     def all_tags(self):
         """Returns tuples (DicomElement, Annotation) for all tags"""
@@ -55,38 +107,99 @@ class AnnotatedDataset(JSONDataset):
         else:
             return annotation
 
-    def to_json_dict(self):
-        dataset = self.dataset.to_json_dict()
-        for tag, element_dict in dataset.items():
-            element_dict[self.json_keyword] = self.annotation_to_json_obj(
-                self.get_annotation(tag)
+    def element_to_json_dict(
+        self,
+        element: DataElement,
+        bulk_data_element_handler=None,
+        bulk_data_threshold=BULK_DATA_THRESHOLD,
+    ) -> Dict[str, Any]:
+        """Json dict for a single element, with annotation and tag name"""
+        element_dict = element.to_json_dict(
+            bulk_data_element_handler=bulk_data_element_handler,
+            bulk_data_threshold=bulk_data_threshold,
+        )
+        element_dict[self.json_keyword] = self.annotation_to_json_obj(
+            self.annotations.get(element.tag)
+        )
+        element_dict[self.json_tag_name_keyword] = tag_name(element.tag)
+        return element_dict
+
+    def to_json_dict(
+        self, bulk_data_element_handler=None, bulk_data_threshold=BULK_DATA_THRESHOLD
+    ):
+        dataset = {
+            f"{element.tag:08X}": self.element_to_json_dict(
+                element, bulk_data_element_handler, bulk_data_threshold
             )
-            try:
-                element_dict[self.json_tag_name_keyword] = dictionary_keyword(tag)
-            except KeyError:
-                element_dict[self.json_tag_name_keyword] = "Unknown"
-
+            for element in self.dataset
+        }
         return {"description": self.description, "dataset": dataset}
 
+    def iter_json(
+        self, bulk_data_element_handler=None, bulk_data_threshold=BULK_DATA_THRESHOLD
+    ) -> Iterator[str]:
+        """Json text in chunks, encoding one element at a time
+
+        Elements that have not changed since the previous call are not encoded
+        again, which makes saving repeatedly after small edits fast. Elements
+        written to bulk data files are always encoded again.
+        """
+        yield "{\n" + " " * JSON_INDENT + '"description": '
+        yield json.dumps(self.description) + ",\n" + " " * JSON_INDENT
+        yield '"dataset": '
+        yield from iter_json_object(
+            self._iter_encoded_elements(bulk_data_element_handler, bulk_data_threshold),
+            depth=1,
+        )
+        yield "\n}"
+
+    def _iter_encoded_elements(
+        self, bulk_data_element_handler, bulk_data_threshold
+    ) -> Iterator[Tuple[str, str]]:
+        encoded: Dict[BaseTag, EncodedElement] = {}
+        for element in self.dataset:
+            annotation = self.annotations.get(element.tag)
+            cached = self._encoded.get(element.tag)
+            if (
+                cached is not None
+                and bulk_data_element_handler is None
+                and cached.is_current(element, annotation)
+            ):
+                text = cached.text
+            else:
+                text = json.dumps(
+                    self.element_to_json_dict(
+                        element, bulk_data_element_handler, bulk_data_threshold
+                    ),
+                    indent=JSON_INDENT,
+                )
+            encoded[element.tag] = EncodedElement(
+                element, element.value, element.VR, annotation, text
+            )
+            yield f"{element.tag:08X}", text
+        self._encoded = encoded
+
     @classmethod
     def parse_annotation(cls, annotation_json_obj):
         """Process raw annotation object. For overwriting in child classes"""
         return annotation_json_obj
 
     @classmethod
-    def from_json_dict(cls, dict_in):
+    def from_json_dict(cls, dict_in, bulk_data_uri_handler=None):
+        """Does not modify dict_in. pydicom ignores the annotation and tag name
+        keys, so the dataset can be read from dict_in as is
+        """
         dataset_dict = dict_in["dataset"]
         annotations = {}
         for tag, element_dict in dataset_dict.items():
-            if element_dict.get(cls.json_keyword):
-                annotations[Tag(tag)] = cls.parse_annotation(
-                    element_dict.get(cls.json_keyword)
-                )
-            del element_dict[cls.json_keyword]
-            del element_dict[cls.json_tag_name_keyword]
+            annotation = element_dict.get(cls.json_keyword)
+            if annotation:
+                annotations[Tag(tag)] = cls.parse_annotation(annotation)
 
         return cls(
-            dataset=Dataset.from_json(dataset_dict),
+            dataset=Dataset.from_json(
+                dataset_dict, bulk_data_uri_handler=bulk_data_uri_handler
+            ),
             annotations=annotations,
             description=dict_in["description"],
         )
@@ -0,0 +1,240 @@
+"""Write files in the background while new datasets are being generated
+
+With export(), generating and writing alternate. On slow or network storage
+most time is then spent waiting for the disk. AsyncExportSink writes with
+several concurrent writers while the caller generates the next datasets. Its
+queue is bounded, so generation pauses when storage cannot keep up:
+
+>>> async with AsyncExportSink(writers=8) as sink:
+>>>     for index in range(1000):
+>>>         await sink.put(CTDatasetFactory(), output_dir / f"{index}.dcm")
+
+Files are written to a temporary file next to the target and renamed into place
+when complete, so a target path never holds a partially written file.
+"""
+import asyncio
+import contextvars
+import os
+import tempfile
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from pydicom.dataset import Dataset
+
+from dicomgenerator.exceptions import DICOMGeneratorError
+from dicomgenerator.export import prepare_export
+from dicomgenerator.metrics import stage
+from dicomgenerator.parallel import GenerationProgress
+
+
+class AsyncExportSink:
+    """Writes datasets to disk with concurrent writers, fed by a bounded queue
+
+    Parameters
+    ----------
+    writers:
+        Number of files to write at the same time
+    queue_size:
+        Maximum number of datasets waiting to be written. put() waits while the
+        queue is full
+    fsync_batch:
+        If more than 0, make files durable with fsync before renaming them into
+        place. This is done for batches of this many files at a time, which
+        costs much less than an fsync per file. Defaults to 0, no fsync
+    compress:
+        Write pixel data RLE Lossless compressed, like export(compress=True)
+    executor:
+        Run file writes in this executor. Defaults to a thread pool with a
+        thread for each writer
+    """
+
+    def __init__(
+        self,
+        writers: int = 4,
+        queue_size: int = 16,
+        fsync_batch: int = 0,
+        compress: bool = False,
+        executor: Optional[Executor] = None,
+    ):
+        if writers < 1 or queue_size < 1:
+            raise ValueError("writers and queue_size should be 1 or more")
+        self.writers = writers
+        self.queue_size = queue_size
+        self.fsync_batch = fsync_batch
+        self.compress = compress
+        self.progress = GenerationProgress(total=None)
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._queue: Optional[asyncio.Queue[Optional[Tuple[Dataset, Path]]]] = None
+        self._tasks: List[asyncio.Task[None]] = []
+        self._error: Optional[BaseException] = None
+        self._pending: List[Tuple[str, Path]] = []  # written, not yet renamed
+        self._pending_lock = threading.Lock()
+
+    async def __aenter__(self) -> "AsyncExportSink":
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.writers)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._write_from_queue()) for _ in range(self.writers)
+        ]
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            for _ in self._tasks:
+                await self._queue.put(None)  # tell writers to stop
+            await asyncio.gather(*self._tasks)
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.flush)
+        finally:
+            if self._owns_executor:
+                self._executor.shutdown()
+                self._executor = None
+        if exc_type is None:
+            self._raise_if_failed()
+
+    async def put(self, dataset: Dataset, path):
+        """Queue dataset for writing to path. Waits while the queue is full
+
+        Raises
+        ------
+        AsyncExportError
+            If writing an earlier dataset failed
+        """
+        if self._queue is None:
+            raise AsyncExportError("Use AsyncExportSink as 'async with' context")
+        self._raise_if_failed()
+        await self._queue.put((dataset, Path(path)))
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise AsyncExportError(f"Writing failed: {self._error}") from self._error
+
+    async def _write_from_queue(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # skip remaining work, but keep the queue moving
+            try:
+                nbytes = await loop.run_in_executor(self._executor, self.write, *item)
+            except Exception as e:
+                self._error = e
+                continue
+            self.progress.done += 1
+            self.progress.bytes_written += nbytes
+
+    def write(self, dataset: Dataset, path: Path) -> int:
+        """Write dataset to a temporary file, then rename it to path
+
+        Returns
+        -------
+        int
+            Number of bytes written
+        """
+        dataset = prepare_export(dataset, compress=self.compress)
+        with stage("export.write") as timer:
+            handle, temp_path = tempfile.mkstemp(
+                dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(handle, "wb") as f:
+                    dataset.save_as(f, write_like_original=False)
+                    nbytes = f.tell()
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            timer.add_bytes(nbytes)
+
+        if not self.fsync_batch:
+            os.replace(temp_path, path)
+            return nbytes
+        with self._pending_lock:
+            self._pending.append((temp_path, path))
+            batch_full = len(self._pending) >= self.fsync_batch
+        if batch_full:
+            self.flush()
+        return nbytes
+
+    def flush(self):
+        """Make waiting files durable with fsync, then rename them into place"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        with stage("export.fsync"):
+            for temp_path, _ in pending:
+                fsync_path(temp_path)
+            for temp_path, path in pending:
+                os.replace(temp_path, path)
+            for directory in {path.parent for _, path in pending}:
+                fsync_directory(directory)
+
+
+def fsync_path(path):
+    handle = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(handle)
+    finally:
+        os.close(handle)
+
+
+def fsync_directory(path):
+    """Make renames in directory durable. Not possible on all platforms"""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    handle = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(handle)
+    finally:
+        os.close(handle)
+
+
+async def export_all_async(
+    items: Iterable[Tuple[Dataset, Path]], **sink_kwargs
+) -> GenerationProgress:
+    """Write all (dataset, path) items, generating them in a separate thread
+
+    Generation and writing overlap. items is iterated in a single thread, in a
+    copy of the caller's context, so seeded generation, use_rng() and
+    use_uid_allocator() give the same results as a plain loop would.
+
+    Parameters
+    ----------
+    items:
+        (dataset, path) pairs, typically a generator that creates each dataset
+    sink_kwargs:
+        Passed to AsyncExportSink
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(items)
+    context = contextvars.copy_context()
+
+    def next_item() -> Optional[Tuple[Dataset, Path]]:
+        return next(iterator, None)
+
+    with ThreadPoolExecutor(1) as generator_thread:
+        async with AsyncExportSink(**sink_kwargs) as sink:
+            while True:
+                item = await loop.run_in_executor(
+                    generator_thread, context.run, next_item
+                )
+                if item is None:
+                    break
+                await sink.put(*item)
+    return sink.progress
+
+
+def export_all(
+    items: Iterable[Tuple[Dataset, Path]], **sink_kwargs
+) -> GenerationProgress:
+    """Blocking version of export_all_async(), for use outside of asyncio"""
+    return asyncio.run(export_all_async(items, **sink_kwargs))
+
+
+class AsyncExportError(DICOMGeneratorError):
+    pass
@@ -0,0 +1,210 @@
+"""Json templates compiled to binary DICOM, which loads much faster than json
+
+Parsing a json template and converting all its values takes milliseconds, which
+every new process pays again. Compiling encodes a template once as binary
+DICOM (explicit VR little endian), with tags, VRs and values validated. Loading
+a compiled template only reads the file. pydicom converts an element's value
+when it is first accessed, and writes elements that were never accessed as they
+are. The few elements that DICOM encoding would change, like a PN value of a
+single space or a private element with VR UN, are kept as json, so a compiled
+template loads exactly like its source. This is about loading templates. For
+fast writing of many files from one dataset, see writer.CompiledTemplate.
+
+Compiled templates are kept in a cache directory. Each starts with a hash of
+the json it was compiled from. If the json changes, the compiled template is
+ignored and the json is loaded instead:
+
+>>> compile_template(TEMPLATE_PATH / "ct_toshiba_aquilion.json")
+>>> dataset = load_template(TEMPLATE_PATH / "ct_toshiba_aquilion.json")
+"""
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from pydicom.dataset import Dataset
+from pydicom.filebase import DicomBytesIO
+from pydicom.filereader import read_dataset
+from pydicom.filewriter import write_dataset
+from pydicom.tag import BaseTag
+
+from dicomgenerator.exceptions import DICOMGeneratorError
+from dicomgenerator.logging import get_module_logger
+from dicomgenerator.persistence import BulkDataLoader
+
+logger = get_module_logger("binary_templates")
+
+PathLike = Union[str, Path]
+
+MAGIC = b"DGCT"
+FORMAT_VERSION = 2
+# magic, format version, hash of the json source, length of json elements
+HEADER = struct.Struct("<4sH32sI")
+
+
+def default_cache_dir() -> Path:
+    """Directory for compiled templates. Set DICOMGENERATOR_CACHE_DIR to
+    change. Defaults to 'dicomgenerator/templates' in the user cache directory
+    """
+    if "DICOMGENERATOR_CACHE_DIR" in os.environ:
+        return Path(os.environ["DICOMGENERATOR_CACHE_DIR"])
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "dicomgenerator" / "templates"
+
+
+def source_hash(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+
+def binary_template_path(
+    source: PathLike, cache_dir: Optional[PathLike] = None
+) -> Path:
+    """Where the compiled version of the template at source is kept"""
+    source = os.path.abspath(source)
+    key = hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+    cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+    return cache_dir / f"{Path(source).stem}.{key}.dgct"
+
+
+def compile_template(source: PathLike, cache_dir: Optional[PathLike] = None) -> Path:
+    """Compile json template at source and write it to the cache directory
+
+    Returns
+    -------
+    Path
+        Path of the compiled template
+
+    Raises
+    ------
+    BinaryTemplateError
+        If the template cannot be encoded, or has BulkDataURI values. These
+        are memory mapped when loading json, which is already fast
+    """
+    data = Path(source).read_bytes()
+    try:
+        dataset = Dataset.from_json(
+            json.loads(data), bulk_data_uri_handler=_refuse_bulk_data
+        )
+        changed = changed_by_encoding(dataset)
+        as_json = json.dumps(
+            {f"{x:08X}": dataset[x].to_json_dict(None, 0) for x in changed}
+        ).encode()
+        encoded = _encode(Dataset({x.tag: x for x in dataset if x.tag not in changed}))
+    except (ValueError, TypeError, KeyError, OverflowError) as e:
+        raise BinaryTemplateError(f"Cannot compile '{source}': {e}") from e
+
+    path = binary_template_path(source, cache_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, source_hash(data), len(as_json)))
+            f.write(as_json)
+            f.write(encoded)
+        os.replace(temp_path, path)  # readers never see a partial file
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    logger.debug(f"Compiled '{source}' to '{path}'")
+    return path
+
+
+def _encode(dataset: Dataset) -> bytes:
+    encoded = DicomBytesIO()
+    encoded.is_little_endian = True
+    encoded.is_implicit_VR = False
+    write_dataset(encoded, dataset)
+    return encoded.getvalue()
+
+
+def _decode(encoded: bytes) -> Dataset:
+    return read_dataset(BytesIO(encoded), is_implicit_VR=False, is_little_endian=True)
+
+
+def changed_by_encoding(dataset: Dataset) -> List[BaseTag]:
+    """Tags of top-level elements that do not decode to the same value, VR or
+    encoding as they have in dataset
+    """
+    decoded = _decode(_encode(dataset))
+    changed = []
+    for element in dataset:
+        single = Dataset({element.tag: element})
+        if decoded[element.tag] != element or _encode(
+            Dataset({element.tag: decoded[element.tag]})
+        ) != _encode(single):
+            changed.append(element.tag)
+    return changed
+
+
+def _refuse_bulk_data(tag, vr, uri):
+    raise BinaryTemplateError(f"Element {tag} has BulkDataURI '{uri}'")
+
+
+def ensure_compiled(
+    source: PathLike, cache_dir: Optional[PathLike] = None
+) -> Optional[Path]:
+    """Compile template at source if there is no up to date compiled version
+
+    Does not raise exceptions. Templates that cannot be compiled, for example
+    because the cache directory is not writable, are simply loaded from json
+
+    Returns
+    -------
+    Optional[Path]
+        Path of the compiled template, None if it could not be compiled
+    """
+    path = binary_template_path(source, cache_dir)
+    try:
+        if _read_compiled(path, source_hash(Path(source).read_bytes())):
+            return path
+        return compile_template(source, cache_dir)
+    except (OSError, BinaryTemplateError) as e:
+        logger.debug(f"Not compiling '{source}': {e}")
+        return None
+
+
+def _read_compiled(path: Path, expected_hash: bytes) -> Optional[Tuple[bytes, bytes]]:
+    """Json elements and encoded dataset in compiled template at path. None if
+    it does not exist or was not compiled from json with expected_hash
+    """
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    if len(content) < HEADER.size:
+        return None
+    magic, version, compiled_hash, json_length = HEADER.unpack_from(content)
+    if (magic, version, compiled_hash) != (MAGIC, FORMAT_VERSION, expected_hash):
+        logger.debug(f"Ignoring outdated compiled template '{path}'")
+        return None
+    encoded_start = HEADER.size + json_length
+    return content[HEADER.size : encoded_start], content[encoded_start:]
+
+
+def load_template(path: PathLike, cache_dir: Optional[PathLike] = None) -> Dataset:
+    """Load json template at path, from its compiled version if that is up to date
+
+    Elements of a compiled template are converted when accessed. Values, VRs
+    and written files are the same as when loading the json.
+    """
+    data = Path(path).read_bytes()
+    compiled = _read_compiled(binary_template_path(path, cache_dir), source_hash(data))
+    if compiled is None:
+        return Dataset.from_json(
+            json.loads(data), bulk_data_uri_handler=BulkDataLoader(Path(path).parent)
+        )
+    as_json, encoded = compiled
+    dataset = _decode(encoded)
+    if as_json != b"{}":
+        for element in Dataset.from_json(as_json):
+            dataset[element.tag] = element
+    return dataset
+
+
+class BinaryTemplateError(DICOMGeneratorError):
+    pass
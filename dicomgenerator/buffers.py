@@ -0,0 +1,153 @@
+"""Pass large binary values around without copying them"""
+import io
+import os
+from typing import Any
+
+
+class SeekableReader(io.BufferedIOBase):
+    """Read-only, seekable file-like object of known length
+
+    pydicom accepts file-like objects as value for binary elements like
+    PixelData and streams them when writing. Subclasses only need to provide
+    read_view(), copy() and getbuffer().
+
+    Notes
+    -----
+    DICOM values should have even length. pydicom does not account for the pad
+    byte of odd-length streamed values in the element length, so by default a
+    virtual zero byte is added to odd-length content.
+    """
+
+    def __init__(self, size: int, pad_to_even: bool = True):
+        super().__init__()
+        self.pad_to_even = pad_to_even
+        self._size = size  # without pad byte
+        self._length = size + size % 2 if pad_to_even else size
+        self._position = 0
+
+    def __len__(self):
+        return self._length
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self._length + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self._position = position
+        return position
+
+    def read(self, size=-1):
+        chunk = self.read_view(size)
+        return bytes(chunk)
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def readinto(self, b):
+        chunk = self.read_view(len(b))
+        memoryview(b).cast("B")[: len(chunk)] = chunk
+        return len(chunk)
+
+    def _advance(self, size) -> slice:
+        """Range to read next for read size, moves position past it"""
+        start = min(self._position, self._length)
+        stop = (
+            self._length
+            if size is None or size < 0
+            else min(start + size, self._length)
+        )
+        self._position = stop
+        return slice(start, stop)
+
+    def read_view(self, size=-1) -> memoryview:
+        """Like read(), but returns a view instead of a copy when possible"""
+        raise NotImplementedError()
+
+    def iter_views(self, chunk_size: int = 2**20):
+        """Views on consecutive parts of the remaining content, for writing"""
+        while chunk := self.read_view(chunk_size):
+            yield chunk
+
+    def copy(self) -> "SeekableReader":
+        """New reader on the same content, with its own position. Reading from
+        a reader moves its position, so readers should not be shared between
+        threads
+        """
+        raise NotImplementedError()
+
+    def getbuffer(self) -> Any:
+        """All content as an object supporting the buffer protocol, without
+        pad byte
+        """
+        raise NotImplementedError()
+
+
+class BufferReader(SeekableReader):
+    """Read-only file-like view on any object supporting the buffer protocol,
+    like bytes, numpy arrays and numpy memmaps. Does not copy the buffer.
+
+    Wrapping a memmap in a BufferReader lets pixel data go from one file to
+    another without being loaded in memory.
+    """
+
+    def __init__(self, buffer: Any, pad_to_even: bool = True):
+        self.buffer = buffer
+        self._view = memoryview(buffer).cast("B")
+        super().__init__(len(self._view), pad_to_even=pad_to_even)
+
+    def copy(self) -> "BufferReader":
+        return BufferReader(self.buffer, pad_to_even=self.pad_to_even)
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        """Reader on a copy of the buffer. Read-only buffers are shared, like
+        copy.deepcopy() shares bytes
+        """
+        if self._view.readonly:
+            copied = self.copy()
+        else:
+            copied = BufferReader(bytearray(self._view), pad_to_even=self.pad_to_even)
+        copied._position = self._position
+        return copied
+
+    def __reduce__(self):
+        # Buffers like memory maps and memoryviews cannot be pickled. Pickle
+        # the content instead, writable if the buffer was
+        content = bytes(self._view) if self._view.readonly else bytearray(self._view)
+        return BufferReader, (content, self.pad_to_even), {"_position": self._position}
+
+    def __setstate__(self, state):
+        self._position = state["_position"]
+
+    def getbuffer(self) -> Any:
+        return self.buffer
+
+    def read_view(self, size=-1) -> memoryview:
+        part = self._advance(size)
+        if part.stop <= self._size or part.start == part.stop:
+            return self._view[part]
+        # includes the virtual pad byte
+        return memoryview(bytes(self._view[part.start :]) + b"\0")
+
+
+def as_buffer(value: Any) -> Any:
+    """Content of value if it is a SeekableReader, otherwise value itself. For
+    code that needs a buffer, like an encoder
+    """
+    return value.getbuffer() if isinstance(value, SeekableReader) else value
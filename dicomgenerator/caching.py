@@ -0,0 +1,212 @@
+"""Process-wide caches for things that are expensive to load, like templates"""
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional, Tuple, Union, cast
+
+from pydicom.dataelem import DataElement
+from pydicom.dataset import Dataset
+from pydicom.multival import MultiValue
+from pydicom.sequence import Sequence
+
+from dicomgenerator.binary_templates import load_template
+from dicomgenerator.buffers import SeekableReader
+from dicomgenerator.logging import get_module_logger
+from dicomgenerator.metrics import increment
+from dicomgenerator.persistence import BulkDataLoader
+
+logger = get_module_logger("caching")
+
+PathLike = Union[str, Path]
+
+
+class LRUCache:
+    """Dictionary-like cache that holds at most maxsize items. Least recently
+    used items are evicted first. Safe to share between threads.
+    """
+
+    def __init__(self, maxsize: int = 16):
+        if maxsize < 1:
+            raise ValueError(f"maxsize should be 1 or more, got {maxsize}")
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], Any]) -> Any:
+        """Return cached value for key. Call create() and cache if not found"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = create()
+            self.put(key, value)
+        return value
+
+    def discard(self, condition: Callable[[Hashable], bool]):
+        """Remove all items whose key matches condition"""
+        with self._lock:
+            for key in [x for x in self._items if condition(x)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_MISSING = object()
+
+
+_EMPTY_STATE = Dataset().__dict__
+_SHARED_TYPES = frozenset({str, int, float, bytes, type(None)})
+
+
+def _empty_dataset() -> Dataset:
+    """Same as Dataset(), without going through Dataset.__setattr__ for each
+    internal attribute. Matters for datasets with many sequence items
+    """
+    empty = Dataset.__new__(Dataset)
+    empty.__dict__.update(
+        {
+            key: value.copy() if isinstance(value, dict) else value
+            for key, value in _EMPTY_STATE.items()
+        }
+    )
+    return empty
+
+
+def clone_dataset(dataset: Dataset) -> Dataset:
+    """Copy of dataset that can be modified without affecting the original
+
+    Much cheaper than copy.deepcopy(). Element values that pydicom keeps as
+    immutable types (str, UID, DSfloat, PersonName, bytes) are shared, only the
+    mutable containers (sequences and multi-values) are copied. Buffered values
+    get a new reader on the same content, so clones can be written from
+    different threads.
+    """
+    clone = _empty_dataset()
+    elements = clone._dict
+    for tag, element in dataset._dict.items():
+        if not isinstance(element, DataElement):
+            elements[tag] = element  # not yet parsed raw element, immutable
+            continue
+        copied = DataElement.__new__(DataElement)
+        copied.__dict__.update(element.__dict__)
+        value = copied._value
+        if type(value) in _SHARED_TYPES:
+            pass  # most common case, skip the isinstance() checks below
+        elif isinstance(value, Sequence):
+            copied._value = Sequence([clone_dataset(x) for x in value])
+        elif isinstance(value, MultiValue):
+            multi = MultiValue.__new__(MultiValue)
+            multi.__dict__.update(value.__dict__)
+            multi._list = list(value._list)
+            copied._value = multi
+        elif isinstance(value, SeekableReader):
+            copied._value = value.copy()
+        elements[tag] = copied
+    return clone
+
+
+def clone_file_dataset(dataset: Dataset) -> Dataset:
+    """Like clone_dataset(), but also copies attributes that are not elements,
+    like file_meta and preamble
+    """
+    clone = clone_dataset(dataset)
+    for key, value in dataset.__dict__.items():
+        if key not in clone.__dict__:
+            clone.__dict__[key] = copy.deepcopy(value)
+    return clone
+
+
+def load_json_template(path: PathLike) -> Dataset:
+    """Parse a json-dicom template from disk. BulkDataURI values are memory
+    mapped from sidecar files, see persistence.BulkDataLoader
+    """
+    with open(path) as f:
+        return Dataset.from_json(
+            json.load(f), bulk_data_uri_handler=BulkDataLoader(Path(path).parent)
+        )
+
+
+class TemplateCache:
+    """Keeps parsed json-dicom templates in memory as prototype datasets
+
+    Templates are keyed by path, modification time and size, so editing a
+    template on disk is picked up automatically. Use get() to obtain a private,
+    editable copy of a prototype. By default, templates are loaded from their
+    compiled version if there is one, see dicomgenerator.binary_templates.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 16,
+        loader: Callable[[PathLike], Dataset] = load_template,
+    ):
+        self.loader = loader
+        self._prototypes = LRUCache(maxsize=maxsize)
+
+    def __len__(self):
+        return len(self._prototypes)
+
+    @staticmethod
+    def key(path: PathLike) -> Tuple[str, int, int]:
+        """Identifies a template file and its version on disk"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        return path, stat.st_mtime_ns, stat.st_size
+
+    def prototype(self, path: PathLike) -> Dataset:
+        """The cached dataset for this template. Do not modify this"""
+        key = self.key(path)
+        prototype: Dataset = self._prototypes.get_or_create(
+            key, lambda: self._load(key[0])
+        )
+        return prototype
+
+    def get(self, path: PathLike) -> Dataset:
+        """A fresh, editable copy of the template at path"""
+        return clone_dataset(self.prototype(path))
+
+    def warm(self, *paths: PathLike):
+        """Load templates now so that first use later on is fast"""
+        for path in paths:
+            self.prototype(path)
+
+    def invalidate(self, path: Optional[PathLike] = None):
+        """Remove template at path from cache. Removes all if path is None"""
+        if path is None:
+            self._prototypes.clear()
+        else:
+            path = os.path.abspath(path)
+            self._prototypes.discard(lambda key: cast(Tuple[str, Any], key)[0] == path)
+
+    def _load(self, path: str) -> Dataset:
+        logger.debug(f"Loading template '{path}'")
+        increment("template.loads")
+        return self.loader(path)
+
+
+# Shared by all dataset factories in this process
+TEMPLATE_CACHE = TemplateCache()
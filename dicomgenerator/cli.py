@@ -0,0 +1,392 @@
+"""Command line interface for generating DICOM corpora
+
+>>> dicomgenerator generate /tmp/corpus --count 1000 --seed test --workers 8
+>>> dicomgenerator generate /tmp/structure --patients 10 --studies 1-3 --instances 50
+>>> dicomgenerator convert /data/archive /tmp/templates --workers 8
+"""
+import importlib
+import itertools
+import math
+import random
+import sys
+import time
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Type, Union
+
+import click
+import numpy as np
+
+from dicomgenerator.binary_templates import BinaryTemplateError, compile_template
+from dicomgenerator.export import export
+from dicomgenerator.metrics import disable_metrics, enable_metrics, report
+from dicomgenerator.parallel import GenerationProgress, generate_corpus
+from dicomgenerator.persistence import JSONDataset
+from dicomgenerator.pixeldata import draw_noise
+from dicomgenerator.rng import RNGContext, use_rng
+from dicomgenerator.tools import (
+    CONVERTED,
+    FAILED,
+    SKIPPED,
+    PixelDataMode,
+    convert_tree,
+)
+
+if TYPE_CHECKING:  # generators imports factory-boy and Faker, which are slow
+    from dicomgenerator.generators import DatasetFactory
+    from dicomgenerator.hierarchy import HierarchyShape, InstancePosition
+
+MB = 2**20
+
+
+@dataclass(frozen=True)
+class CountRange:
+    """Random count between low and high inclusive. Picklable, unlike a lambda"""
+
+    low: int
+    high: int
+
+    def __call__(self, rng: random.Random) -> int:
+        return rng.randint(self.low, self.high)
+
+
+if TYPE_CHECKING:  # generic since click 8.2, cannot be subscripted before that
+    _CountParamType = click.ParamType[Union[int, CountRange]]
+else:
+    _CountParamType = click.ParamType
+
+
+class CountType(_CountParamType):
+    """A count like '3', or a random range like '1-5'"""
+
+    name = "count"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, (int, CountRange)):
+            return value
+        try:
+            low, _, high = value.partition("-")
+            low = int(low)
+            count = CountRange(low, int(high)) if high else low
+        except ValueError:
+            self.fail(f"'{value}' is not a count like '3' or a range like '1-5'")
+        if isinstance(count, CountRange) and count.high < count.low:
+            self.fail(f"Range '{value}' ends before it starts")
+        return count
+
+
+@dataclass(frozen=True)
+class PixelSpec:
+    """Pixel data to generate for each file, parsed from 'kind:ROWSxCOLUMNS:dtype'
+
+    kind is 'noise' or 'blank'. For example 'noise:512x512:uint16'
+    """
+
+    kind: str
+    rows: int
+    columns: int
+    dtype: str
+    seed: Optional[str] = None
+
+    @classmethod
+    def parse(cls, value: str, seed: Optional[str] = None) -> "PixelSpec":
+        try:
+            kind, size, dtype = value.split(":")
+            rows, columns = (int(x) for x in size.lower().split("x"))
+            np.iinfo(dtype)
+        except ValueError as e:
+            raise ValueError(
+                f"'{value}' is not a pixel spec like 'noise:512x512:uint16'"
+            ) from e
+        if kind not in ("noise", "blank"):
+            raise ValueError(f"Unknown pixel kind '{kind}'. Use 'noise' or 'blank'")
+        return cls(kind=kind, rows=rows, columns=columns, dtype=dtype, seed=seed)
+
+    def __call__(self, position: Union[int, "InstancePosition"]) -> np.ndarray:
+        if self.kind == "blank":
+            return np.zeros((self.rows, self.columns), dtype=self.dtype)
+        seed = f"{self.seed}:{position}" if self.seed else None
+        return draw_noise(self.rows, self.columns, self.dtype, seed=seed)
+
+
+def resolve_factory(name: str) -> Type["DatasetFactory"]:
+    """Factory class from a name in dicomgenerator.templates, or 'module:Class'"""
+    from dicomgenerator.generators import DatasetFactory
+
+    module_name, _, class_name = name.rpartition(":")
+    module = importlib.import_module(module_name or "dicomgenerator.templates")
+    factory_class = getattr(module, class_name, None)
+    if not (
+        isinstance(factory_class, type) and issubclass(factory_class, DatasetFactory)
+    ):
+        raise ValueError(f"'{name}' is not a DatasetFactory")
+    return factory_class
+
+
+def format_progress(progress: GenerationProgress) -> str:
+    total = "?" if progress.total is None else progress.total
+    eta = progress.eta
+    return (
+        f"{progress.done}/{total} files, {progress.files_per_second:.1f} files/s, "
+        f"{progress.bytes_per_second / MB:.1f} MB/s, "
+        f"ETA {'?' if eta is None else f'{eta:.0f}s'}"
+    )
+
+
+def format_summary(progress: GenerationProgress) -> str:
+    return (
+        f"Generated {progress.done} files ({progress.bytes_written / MB:.1f} MB) in "
+        f"{progress.elapsed:.1f}s: {progress.files_per_second:.1f} files/s, "
+        f"{progress.bytes_per_second / MB:.1f} MB/s"
+    )
+
+
+class ProgressReporter:
+    """Rewrites a single status line on stderr, at most every interval seconds"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last_report = 0.0
+
+    def __call__(self, progress: GenerationProgress):
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or progress.done == progress.total:
+            self.last_report = now
+            click.echo(f"\r{format_progress(progress)}", nl=False, err=True)
+
+    def finish(self, progress: GenerationProgress):
+        click.echo(f"\r{format_progress(progress)}", err=True)
+        click.echo(format_summary(progress))
+
+
+@click.group()
+def main():
+    """Generate DICOM data for testing"""
+
+
+@main.command()
+@click.argument("output_dir", type=click.Path(file_okay=False, path_type=Path))
+@click.option(
+    "--template",
+    "-t",
+    default="CTDatasetFactory",
+    show_default=True,
+    help="Factory in dicomgenerator.templates, or 'module:FactoryClass'",
+)
+@click.option("--count", "-n", type=int, help="Number of independent files")
+@click.option("--patients", type=CountType(), help="Patients, like '10'")
+@click.option("--studies", type=CountType(), help="Studies per patient, like '1-3'")
+@click.option("--series", type=CountType(), help="Series per study")
+@click.option("--instances", type=CountType(), help="Instances per series")
+@click.option(
+    "--pixels",
+    help="Replace pixel data, like 'noise:512x512:uint16' or 'blank:64x64:uint8'",
+)
+@click.option("--seed", help="Same seed gives the same files")
+@click.option(
+    "--workers",
+    "-w",
+    type=int,
+    help="Worker processes for --count. Defaults to number of CPUs",
+)
+@click.option("--chunk-size", type=int, default=100, show_default=True)
+@click.option("--compress", is_flag=True, help="Write RLE Lossless pixel data")
+@click.option(
+    "--metrics", is_flag=True, help="Print time spent in each stage when done"
+)
+def generate(
+    output_dir,
+    template,
+    count,
+    patients,
+    studies,
+    series,
+    instances,
+    pixels,
+    seed,
+    workers,
+    chunk_size,
+    compress,
+    metrics,
+):
+    """Generate DICOM files in OUTPUT_DIR
+
+    Use --count for a flat corpus of independent files, generated in parallel.
+    Use --patients, --studies, --series and --instances for a realistic
+    hierarchy where files share patient, study and series attributes.
+    """
+    try:
+        factory_class = resolve_factory(template)
+    except (ImportError, ValueError) as e:
+        raise click.BadParameter(str(e), param_hint="--template") from e
+    try:
+        pixel_generator = PixelSpec.parse(pixels, seed=seed) if pixels else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--pixels") from e
+
+    levels = (patients, studies, series, instances)
+    hierarchical = any(x is not None for x in levels)
+    if hierarchical and count is not None:
+        raise click.UsageError("Use either --count or hierarchy options, not both")
+    if not hierarchical and count is None:
+        raise click.UsageError("Use --count or hierarchy options like --patients")
+
+    sink = enable_metrics() if metrics else None
+    reporter = ProgressReporter()
+    if hierarchical:
+        from dicomgenerator.hierarchy import HierarchyShape
+
+        shape = HierarchyShape(*(1 if x is None else x for x in levels))
+        progress = generate_hierarchy_files(
+            output_dir,
+            shape,
+            factory_class=factory_class,
+            seed=seed,
+            pixel_generator=pixel_generator,
+            compress=compress,
+            progress=reporter,
+        )
+    else:
+        progress = generate_corpus(
+            output_dir,
+            count=count,
+            factory_class=factory_class,
+            seed=seed,
+            workers=workers,
+            chunk_size=chunk_size,
+            progress=reporter,
+            compress=compress,
+            pixel_generator=pixel_generator,
+        )
+    reporter.finish(progress)
+    if sink is not None:
+        disable_metrics()
+        report(sink)
+
+
+@main.command()
+@click.argument(
+    "input_dir", type=click.Path(exists=True, file_okay=False, path_type=Path)
+)
+@click.argument("output_dir", type=click.Path(file_okay=False, path_type=Path))
+@click.option(
+    "--pixel-data",
+    type=click.Choice([x.value for x in PixelDataMode]),
+    default=PixelDataMode.EXTERNAL.value,
+    show_default=True,
+    help="Write pixel data to raw sidecar files, inline as base64, or drop it",
+)
+@click.option("--annotated", is_flag=True, help="Write AnnotatedDataset templates")
+@click.option("--pattern", default="*", show_default=True, help="Only these files")
+@click.option(
+    "--workers",
+    "-w",
+    type=int,
+    help="Worker processes. Defaults to number of CPUs",
+)
+@click.option("--force", is_flag=True, help="Also convert files that are up to date")
+def convert(input_dir, output_dir, pixel_data, annotated, pattern, workers, force):
+    """Convert all DICOM files in INPUT_DIR to json templates in OUTPUT_DIR
+
+    Templates that are newer than their DICOM file are skipped. Files that
+    cannot be converted are listed at the end and make the exit code 1
+    """
+    json_dataset_class = JSONDataset
+    if annotated:
+        from dicomgenerator.annotation import AnnotatedDataset
+
+        json_dataset_class = AnnotatedDataset
+
+    reporter = ProgressReporter()
+    results = convert_tree(
+        input_dir,
+        output_dir,
+        pixel_data=PixelDataMode(pixel_data),
+        json_dataset_class=json_dataset_class,
+        pattern=pattern,
+        workers=workers,
+        force=force,
+        progress=reporter,
+    )
+    counts = Counter(x.status for x in results)
+    click.echo(
+        f"Converted {counts[CONVERTED]}, skipped {counts[SKIPPED]} up to date, "
+        f"failed {counts[FAILED]} files"
+    )
+    for result in results:
+        if result.status == FAILED:
+            click.echo(f"{result.source}: {result.error}", err=True)
+    if counts[FAILED]:
+        sys.exit(1)
+
+
+@main.command("compile")
+@click.argument(
+    "templates", nargs=-1, type=click.Path(exists=True, dir_okay=False, path_type=Path)
+)
+def compile_templates(templates):
+    """Compile json templates, so that they load faster
+
+    Compiles all templates that come with dicomgenerator if no TEMPLATES are
+    given. Compiled templates are written to DICOMGENERATOR_CACHE_DIR
+    """
+    from dicomgenerator.resources import TEMPLATE_PATH
+
+    for template in templates or sorted(TEMPLATE_PATH.glob("*.json")):
+        try:
+            path = compile_template(template)
+        except BinaryTemplateError as e:
+            raise click.ClickException(str(e)) from e
+        click.echo(f"Compiled '{template}' to '{path}'")
+
+
+def generate_hierarchy_files(
+    output_dir: Path,
+    shape: "HierarchyShape",
+    factory_class: Type["DatasetFactory"],
+    seed: Optional[str] = None,
+    pixel_generator: Optional[PixelSpec] = None,
+    compress: bool = False,
+    progress=None,
+) -> GenerationProgress:
+    """Export all datasets of a hierarchy to output_dir, in a single process
+
+    With a seed, each instance is generated in its own random stream, like
+    generate_corpus() does. Patient, study and series values come from the
+    stream of the first instance that uses them
+    """
+    from dicomgenerator.hierarchy import generate_hierarchy
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    status = GenerationProgress(total=fixed_total(shape))
+    datasets = generate_hierarchy(
+        shape, factory_class=factory_class, pixel_generator=pixel_generator
+    )
+    for index in itertools.count():
+        # datasets is lazy. Values for each instance are drawn in next()
+        with use_rng(RNGContext(seed, index)) if seed is not None else nullcontext():
+            dataset = next(datasets, None)
+        if dataset is None:
+            break
+        path = output_dir / f"{index:06d}.dcm"
+        export(dataset=dataset, path=path, compress=compress)
+        status.done += 1
+        status.bytes_written += path.stat().st_size
+        if progress:
+            progress(status)
+    return status
+
+
+def fixed_total(shape: "HierarchyShape") -> Optional[int]:
+    """Number of instances in shape, or None if any level has a random count"""
+    levels = (shape.patients, shape.studies, shape.series, shape.instances)
+    counts = [x for x in levels if not callable(x)]
+    if len(counts) < len(levels):
+        return None
+    return math.prod(counts)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""Write pixel data with a compressed transfer syntax, to save disk space
+
+Frames are encoded with pydicom's RLE Lossless encoder. Generated data often
+contains identical frames (blank images, repeated templates), so encoded frames
+are cached by content.
+"""
+import hashlib
+from concurrent.futures import Executor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pydicom.dataset import Dataset
+from pydicom.encaps import encapsulate
+from pydicom.pixels.encoders import RLELosslessEncoder
+from pydicom.uid import ExplicitVRLittleEndian, RLELossless
+
+from dicomgenerator.buffers import as_buffer
+from dicomgenerator.caching import LRUCache, clone_file_dataset
+from dicomgenerator.exceptions import DICOMGeneratorError
+from dicomgenerator.metrics import increment
+
+
+class FrameDescription(NamedTuple):
+    """Everything besides pixel values that is needed to encode a frame"""
+
+    rows: int
+    columns: int
+    samples_per_pixel: int
+    bits_allocated: int
+    bits_stored: int
+    pixel_representation: int
+    photometric_interpretation: str
+
+    @classmethod
+    def from_dataset(cls, dataset: Dataset) -> "FrameDescription":
+        return cls(
+            rows=dataset.Rows,
+            columns=dataset.Columns,
+            samples_per_pixel=dataset.get("SamplesPerPixel", 1),
+            bits_allocated=dataset.BitsAllocated,
+            bits_stored=dataset.get("BitsStored", dataset.BitsAllocated),
+            pixel_representation=dataset.get("PixelRepresentation", 0),
+            photometric_interpretation=dataset.get(
+                "PhotometricInterpretation", "MONOCHROME2"
+            ),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.rows
+            * self.columns
+            * self.samples_per_pixel
+            * (self.bits_allocated // 8)
+        )
+
+
+# Encoded frames by (frame content hash, FrameDescription)
+_encoded_frame_cache = LRUCache(maxsize=64)
+
+
+def encode_rle_frame(frame: Any, description: FrameDescription) -> bytes:
+    """RLE Lossless encoded frame. Can be run in a worker process, frame should
+    then be bytes. Otherwise, any buffer
+    """
+    return RLELosslessEncoder.encode(
+        frame,
+        encoding_plugin="pydicom",
+        number_of_frames=1,
+        **description._asdict(),
+    )
+
+
+def split_frames(dataset: Dataset) -> List[memoryview]:
+    """Views on each uncompressed frame in dataset's PixelData"""
+    description = FrameDescription.from_dataset(dataset)
+    value = dataset.PixelData
+    data = memoryview(as_buffer(value))
+    data = data.cast("B")
+    frames = int(dataset.get("NumberOfFrames", 1) or 1)
+    size = description.nbytes
+    if len(data) < frames * size:
+        raise CompressionError(
+            f"PixelData has {len(data)} bytes, expected {frames * size} bytes for "
+            f"{frames} frames of {size} bytes"
+        )
+    return [data[i * size : (i + 1) * size] for i in range(frames)]
+
+
+def compress_pixel_data(
+    dataset: Dataset, executor: Optional[Executor] = None
+) -> Dataset:
+    """Encode uncompressed PixelData in dataset as RLE Lossless, in place
+
+    Sets TransferSyntaxUID. Frames that have been encoded before, in this or any
+    other dataset, are taken from cache.
+
+    Parameters
+    ----------
+    dataset:
+        Dataset with uncompressed pixel data
+    executor:
+        If given, encode frames in this pool, for example a ProcessPoolExecutor.
+        Defaults to encoding in the current process
+
+    Raises
+    ------
+    CompressionError
+        If dataset has no pixel data, or pixel data is already compressed
+    """
+    if "PixelData" not in dataset:
+        raise CompressionError("Dataset has no PixelData to compress")
+    file_meta = getattr(dataset, "file_meta", {})
+    transfer_syntax = file_meta.get("TransferSyntaxUID", ExplicitVRLittleEndian)
+    if transfer_syntax.is_compressed:
+        raise CompressionError(
+            f"PixelData is already compressed as {transfer_syntax.name}"
+        )
+
+    description = FrameDescription.from_dataset(dataset)
+    frames = split_frames(dataset)
+    keys = [(hashlib.blake2b(x, digest_size=16).digest(), description) for x in frames]
+
+    encoded: Dict[Tuple[bytes, FrameDescription], bytes] = {}
+    to_encode = {}
+    for key, frame in zip(keys, frames, strict=True):
+        cached = _encoded_frame_cache.get(key)
+        if cached is not None:
+            encoded[key] = cached
+        elif key not in to_encode:
+            to_encode[key] = frame
+    if executor and len(to_encode) > 1:
+        futures = {
+            key: executor.submit(encode_rle_frame, bytes(frame), description)
+            for key, frame in to_encode.items()
+        }
+        results = {key: future.result() for key, future in futures.items()}
+    else:
+        results = {
+            key: encode_rle_frame(frame, description)
+            for key, frame in to_encode.items()
+        }
+    for key, value in results.items():
+        _encoded_frame_cache.put(key, value)
+    encoded.update(results)
+    increment("compression.reused_frames", len(frames) - len(to_encode))
+
+    dataset.PixelData = encapsulate([encoded[x] for x in keys], has_bot=True)
+    element = dataset["PixelData"]
+    element.VR = "OB"
+    element.is_undefined_length = True
+    dataset.ensure_file_meta()
+    dataset.file_meta.TransferSyntaxUID = RLELossless
+    return dataset
+
+
+def compressed_copy(dataset: Dataset, executor: Optional[Executor] = None) -> Dataset:
+    """Copy of dataset with RLE Lossless compressed pixel data. Does not
+    modify dataset
+    """
+    return compress_pixel_data(clone_file_dataset(dataset), executor=executor)
+
+
+class CompressionError(DICOMGeneratorError):
+    pass
@@ -7,7 +7,7 @@ class VR:
     Made this because I can never remember the short name strings.
     """
 
-    def __init__(self, short_name, long_name):
+    def __init__(self, short_name: str, long_name: str):
         self.short_name = short_name
         self.long_name = long_name
 
@@ -1,10 +1,13 @@
+import os
 from pathlib import Path
 
 from pydicom.dataset import Dataset
 from pydicom.uid import CTImageStorage, ExplicitVRLittleEndian
 
+from dicomgenerator.metrics import metrics_enabled, stage
 
-def export(dataset: Dataset, path: Path, force=True):
+
+def export(dataset: Dataset, path: Path, force=True, compress=False):
     """Save dataset to path, forcing default and dummy pixel_array to save
 
     Parameters
@@ -16,6 +19,9 @@ def export(dataset: Dataset, path: Path, force=True):
     force: Bool, optional
         If true, fill in/ make up missing DICOM pixel_array to make this dataset save.
         See notes below. Defaults to True
+    compress: Bool, optional
+        If true, write pixel data RLE Lossless compressed. dataset itself is not
+        modified. Defaults to False
 
     Notes
     -----
@@ -26,10 +32,24 @@ def export(dataset: Dataset, path: Path, force=True):
 
 
     """
+    dataset = prepare_export(dataset, force=force, compress=compress)
+    with stage("export.write") as timer:
+        dataset.save_as(str(path), write_like_original=not force)
+        if metrics_enabled():
+            timer.add_bytes(os.path.getsize(path))
+
+
+def prepare_export(dataset: Dataset, force=True, compress=False) -> Dataset:
+    """Dataset as export() would write it. See export() for parameters"""
     if force:
-        force_make_savable(dataset).save_as(str(path), write_like_original=False)
-    else:
-        dataset.save_as(str(path), write_like_original=True)
+        with stage("export.prepare"):
+            dataset = force_make_savable(dataset)
+    if compress:
+        from dicomgenerator.compression import compressed_copy
+
+        with stage("export.compress"):
+            dataset = compressed_copy(dataset)
+    return dataset
 
 
 def force_make_savable(dataset):
@@ -43,10 +63,13 @@ def force_make_savable(dataset):
     dataset.is_implicit_VR = False
 
     # ensure meta information that is needed for persisting to disk
-    if not hasattr(dataset, "file_meta"):
-        dataset.ensure_file_meta()
-        dataset.file_meta.MediaStorageSOPClassUID = CTImageStorage
-        dataset.file_meta.MediaStorageSOPInstanceUID = dataset.SOPInstanceUID
-        dataset.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    dataset.ensure_file_meta()
+    file_meta = dataset.file_meta
+    if "MediaStorageSOPClassUID" not in file_meta:
+        file_meta.MediaStorageSOPClassUID = CTImageStorage
+    if "MediaStorageSOPInstanceUID" not in file_meta:
+        file_meta.MediaStorageSOPInstanceUID = dataset.SOPInstanceUID
+    if "TransferSyntaxUID" not in file_meta:
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
 
     return dataset
@@ -1,24 +1,75 @@
 """General functions to create pydicom datasets"""
 
 import datetime
-import factory
 import json
+from contextvars import ContextVar
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+    cast,
+)
+
+import factory
 import pydicom
 from numpy import ndarray
 
-from pydicom.datadict import dictionary_VR
+from pydicom.datadict import dictionary_VR, tag_for_keyword
+from pydicom.dataelem import DataElement
 from pydicom.dataset import Dataset
-from pydicom.tag import Tag
+from pydicom.tag import BaseTag, Tag
 
+from dicomgenerator.caching import TEMPLATE_CACHE, clone_dataset
 from dicomgenerator.dicom import VRs
 from dicomgenerator.exceptions import DICOMGeneratorError
+from dicomgenerator.metrics import increment, stage, timed
+from dicomgenerator.persistence import BulkDataLoader
 from dicomgenerator.pixeldata import PhotoMetricInterpretation
+from dicomgenerator.rng import ContextualRandom
 from dicomgenerator.settings import DICOM_GENERATOR_ROOT_UID
+from dicomgenerator.uid import get_uid_allocator
+from factory import enums
 from factory.fuzzy import FuzzyDate
 from faker.providers import BaseProvider
 from faker import Faker
 from pydicom.uid import generate_uid
 
+# Random values from factory-boy, including fuzzy attributes, factory.Faker
+# declarations and the providers below, follow dicomgenerator.rng.use_rng().
+# Unchanged outside use_rng()
+if not isinstance(factory.random.randgen, ContextualRandom):
+    factory.random.randgen = ContextualRandom(factory.random.randgen)
+
+
+def follow_rng(faker: Faker) -> Faker:
+    """Make faker draw from the active RNGContext within use_rng()"""
+    for generator in faker.factories:
+        if not isinstance(generator.random, ContextualRandom):
+            generator.random = ContextualRandom(generator.random)
+    return faker
+
+
+_get_factory_faker = vars(factory.Faker)["_get_faker"].__func__
+
+
+def _get_contextual_faker(cls, locale=None) -> Faker:
+    """factory.Faker._get_faker(), for Faker instances that follow use_rng()"""
+    return follow_rng(_get_factory_faker(cls, locale))
+
+
+factory.Faker._get_faker = classmethod(  # type: ignore[method-assign, assignment]
+    _get_contextual_faker
+)
+
 
 def quick_dataset(*_, **kwargs) -> Dataset:
     """A dataset with keyword args as tagname - value pairs
@@ -94,18 +145,173 @@ class DatasetFactory(factory.Factory):
         """Instead of creating a clean instance, will load pydicom Dataset
         instance from template, then overwrite loaded pixel_array with any kwargs
 
+        Templates are parsed once per process and cached, see
+        dicomgenerator.caching.TEMPLATE_CACHE. Each call works on a copy. Cached
+        copies are plain Datasets, so a Meta.model that is a Dataset subclass
+        is loaded from the template file each call, as before.
         """
-        obj = model_class.from_json(
-            *args,
-            json_dataset=json.load(open(template_path)),
-        )
+        batch = _active_batch.get()
+        if batch is not None and batch.factory is cls:
+            return batch.create(kwargs)
+        if model_class is not Dataset or args:
+            with stage("factory.template"):
+                obj = model_class.from_json(
+                    *args,
+                    json_dataset=json.loads(Path(template_path).read_bytes()),
+                    bulk_data_uri_handler=BulkDataLoader(Path(template_path).parent),
+                )
+        else:
+            with stage("factory.template"):
+                obj = TEMPLATE_CACHE.get(template_path)
         for key, value in kwargs.items():  # overwrite loaded args with kwargs
             setattr(obj, key, value)
         return obj
 
+    @classmethod
+    def _generate(cls, strategy, params):
+        """Time whole creation, including resolving all declarations"""
+        with stage("factory.generate"):
+            return super()._generate(strategy, params)
+
+    @classmethod
+    def iter_batch(
+        cls,
+        size: int,
+        per_item: Optional[Dict[str, Union[Callable[[int], Any], Any]]] = None,
+        **kwargs,
+    ) -> Iterator[Dataset]:
+        """Lazily generate size datasets, one at a time
+
+        Like create_batch(), but never holds more than one dataset in memory.
+        Work that is the same for each item is done once for the whole batch:
+        the template is looked up once, and fixed values (plain class
+        attributes and kwargs) are set on a batch prototype once. Each item is
+        a copy of that prototype, with only declarations like factory.Faker and
+        per_item values evaluated and set.
+
+        >>> for ds in CTDatasetFactory.iter_batch(1000, Modality="MR"):
+        >>>     export(ds, path=...)
+
+        Parameters
+        ----------
+        size:
+            Generate this many datasets
+        per_item:
+            Values that differ per dataset. Dict of keyword -> either a callable
+            that takes the item index and returns a value, or an iterable that
+            yields one value per item. For example:
+            {"InstanceNumber": range(1, 1001),
+             "PatientID": lambda i: f"patient{i}"}
+        kwargs:
+            Values that are the same for all datasets
+
+        Raises
+        ------
+        ValueError
+            If a per_item iterable runs out before size datasets were generated
+        """
+        sources = {
+            key: _per_item_source(key, value) for key, value in (per_item or {}).items()
+        }
+        batch = None
+        if cls._meta.model is Dataset:
+            batch = cls._batch_prototype(kwargs, varying=sources.keys())
+        for index in range(size):
+            item_kwargs = dict(kwargs)
+            for key, source in sources.items():
+                item_kwargs[key] = source(index)
+            token = _active_batch.set(batch)
+            try:
+                dataset = cls.create(**item_kwargs)
+            finally:
+                _active_batch.reset(token)
+            yield dataset
+
+    @classmethod
+    def _batch_prototype(cls, kwargs: Dict[str, Any], varying) -> "_Batch":
+        """Template with all element values that are the same for each item set.
+        Other attributes, like preamble, are not copied along with the
+        prototype, so they are set for each item
+        """
+        declarations = {**cls._meta.pre_declarations.as_dict(), **kwargs}
+        exclude = getattr(cls._meta, "exclude", ())
+        skip = {"template_path", *varying, *exclude, *cls._meta.parameters}
+        fixed = {
+            key: value
+            for key, value in declarations.items()
+            if key not in skip
+            and enums.get_builder_phase(value) is None
+            and tag_for_keyword(key) is not None
+        }
+        template_path = declarations["template_path"]
+        with stage("factory.template"):
+            prototype = TEMPLATE_CACHE.get(template_path)
+        for key, value in fixed.items():
+            setattr(prototype, key, value)
+        tags = {
+            key: BaseTag(tag)
+            for key in {*declarations, *varying}
+            if key not in fixed and (tag := tag_for_keyword(key)) is not None
+        }
+        return _Batch(
+            factory=cls, prototype=prototype, fixed=frozenset(fixed), tags=tags
+        )
+
     template_path = ""
 
 
+class _Batch(NamedTuple):
+    """Shared state for the items of DatasetFactory.iter_batch()"""
+
+    factory: type
+    prototype: Dataset
+    fixed: FrozenSet[str]  # keys whose value is already set in prototype
+    tags: Dict[str, BaseTag]  # tag for each other key that is a DICOM keyword
+
+    def create(self, kwargs: Dict[str, Any]) -> Dataset:
+        """Copy of prototype with the values in kwargs that differ per item"""
+        obj = clone_dataset(self.prototype)
+        elements = obj._dict
+        for key, value in kwargs.items():
+            if key in self.fixed:
+                continue
+            tag = self.tags.get(key)
+            element = elements.get(tag) if tag is not None else None
+            if isinstance(element, DataElement):
+                # copied for this item, so value can be set directly, which
+                # skips the keyword lookups of Dataset.__setattr__
+                element.value = value
+            else:
+                setattr(obj, key, value)
+        return obj
+
+
+# Set while DatasetFactory.iter_batch() creates an item
+_active_batch: ContextVar[Optional[_Batch]] = ContextVar("active_batch", default=None)
+
+
+def _per_item_source(key: str, value) -> Callable[[int], Any]:
+    """Wrap per_item value for DatasetFactory.iter_batch() as function of index"""
+    if callable(value):
+        return cast(Callable[[int], Any], value)
+    if isinstance(value, (str, bytes)):
+        raise TypeError(
+            f"per_item value for '{key}' is a string. Pass values that are the "
+            f"same for each item as keyword argument instead"
+        )
+    iterator = iter(value)
+
+    def next_value(index):
+        try:
+            return next(iterator)
+        except StopIteration as e:
+            raise ValueError(
+                f"per_item values for '{key}' ran out at item {index}"
+            ) from e
+
+    return next_value
+
+
 class DICOMVRProvider(BaseProvider):
     """Generates valid pixel_array for several DICOM Value representations (VR)
 
@@ -116,6 +322,7 @@ class DICOMVRProvider(BaseProvider):
 
     locale = "nl_NL"
 
+    @timed("faker.dicom_person_name")
     def dicom_person_name(self):
         """Something like 'DoeFake^Jane' or 'VriesFake^Sep de' (VR = PN)
 
@@ -126,10 +333,11 @@ class DICOMVRProvider(BaseProvider):
         -------
         str
         """
-        faker = Faker(locale=self.locale)
+        faker = get_faker(locale=self.locale)
         return f"{faker.last_name()}Test^{faker.first_name()}"
 
     @staticmethod
+    @timed("faker.dicom_time")
     def dicom_time():
         """Dicom time string. Like 14350204.123 (VR = TM)
 
@@ -148,6 +356,7 @@ class DICOMVRProvider(BaseProvider):
         )
 
     @staticmethod
+    @timed("faker.dicom_date")
     def dicom_date():
         """Dicom date string. Like 20120425 (VR = DA)
 
@@ -161,16 +370,22 @@ class DICOMVRProvider(BaseProvider):
         return date.strftime("%Y%m%d")
 
     @staticmethod
+    @timed("faker.dicom_ui")
     def dicom_ui():
         """Generate Valid DICOM UID (VR = UI)
 
         Uses factory boy random seed, so setting seed in test yields the same
-        UID value each time
+        UID value each time, as does dicomgenerator.rng.use_rng(). Inside a
+        dicomgenerator.uid.use_uid_allocator()
+        context, UIDs are taken from that allocator instead.
 
         Returns
         -------
         str
         """
+        allocator = get_uid_allocator()
+        if allocator is not None:
+            return allocator.next_uid()
         return str(
             generate_uid(
                 prefix=DICOM_GENERATOR_ROOT_UID,
@@ -181,6 +396,72 @@ class DICOMVRProvider(BaseProvider):
 
 factory.Faker.add_provider(DICOMVRProvider)
 
+_fakers: Dict[Optional[str], Faker] = {}
+
+
+def get_faker(locale: Optional[str] = None) -> Faker:
+    """Shared Faker instance for locale, with DICOMVRProvider added
+
+    Creating a Faker instance is expensive, so instances are created once per
+    locale. All instances draw from faker's shared random generator, which is
+    what factory.random.reseed_random() seeds. Seeding keeps working as before.
+    Within dicomgenerator.rng.use_rng(), they draw from the active context.
+    """
+    try:
+        return _fakers[locale]
+    except KeyError:
+        faker = Faker(locale=locale)
+        faker.add_provider(DICOMVRProvider)
+        return _fakers.setdefault(locale, follow_rng(faker))
+
+
+@lru_cache(maxsize=4096)
+def tag_vr(tag: int) -> str:
+    """Value Representation for tag from the pydicom dictionary
+
+    Returns LongString (LO) for unknown tags, assuming the user just wants to
+    get on with it.
+    """
+    try:
+        return dictionary_VR(tag)
+    except KeyError:
+        return VRs.LongString.short_name
+
+
+_randint = factory.random.randgen.randint
+
+# How to generate a mock value for each VR. Each takes a Faker instance
+VALUE_GENERATORS: Dict[str, Callable[[Faker], Any]] = {
+    VRs.ApplicationEntity.short_name: lambda _: "MockEntity",
+    VRs.AgeString.short_name: lambda _: f"{_randint(0, 120): 03d}Y",
+    VRs.AttributeTag.short_name: lambda _: (0x0010, 0x0010),
+    VRs.CodeString.short_name: lambda _: "MOCK_123_CODE",
+    VRs.Date.short_name: lambda faker: faker.dicom_date(),
+    VRs.DecimalString.short_name: lambda _: "+10.4",
+    VRs.DateTime.short_name: lambda faker: faker.dicom_date() + faker.dicom_time(),
+    VRs.FloatingPointSingle.short_name: lambda _: 1.1,
+    VRs.FloatingPointDouble.short_name: lambda _: 1.123,
+    VRs.IntegerString.short_name: lambda _: f"{_randint(-2**31, 2**31)}",
+    VRs.LongString.short_name: lambda faker: faker.sentence()[:64],
+    VRs.LongText.short_name: lambda faker: faker.text()[:10240],
+    VRs.OtherByteString.short_name: lambda _: b"\x13\00",
+    VRs.OtherDoubleString.short_name: lambda _: "MockDoubleString",
+    VRs.OtherFloatString.short_name: lambda _: "MockFloatString",
+    VRs.OtherWordString.short_name: lambda _: b"MockOtherWordString",
+    VRs.PersonName.short_name: lambda faker: faker.dicom_person_name(),
+    VRs.ShortString.short_name: lambda _: "MockShortString",
+    VRs.SignedLong.short_name: lambda _: _randint(-(2**31), 2**31),
+    VRs.Sequence.short_name: lambda _: [],
+    VRs.SignedShort.short_name: lambda _: _randint(-(2**15), 2**15),
+    VRs.ShortText.short_name: lambda faker: faker.sentence(),
+    VRs.Time.short_name: lambda faker: faker.dicom_time(),
+    VRs.UniqueIdentifier.short_name: lambda faker: faker.dicom_ui(),
+    VRs.UnsignedLong.short_name: lambda _: _randint(0, 2**31),
+    VRs.Unknown.short_name: lambda _: "MockUnknown",
+    VRs.UnsignedShort.short_name: lambda _: _randint(0, 2**15),
+    VRs.UnlimitedText.short_name: lambda faker: faker.text(),
+}
+
 
 class DataElementFactory(factory.Factory):
     """Generates pydicom DataElements.
@@ -211,12 +492,7 @@ class DataElementFactory(factory.Factory):
     @factory.lazy_attribute
     def VR(self):  # noqa This has to uppercase to match pydicom DataElement
         """Find the correct Value Representation for this tag from pydicom"""
-        try:
-            return dictionary_VR(Tag(self.tag))
-        except KeyError:
-            # unknown tag. Just return set value, assuming user want to just
-            # get on with it
-            return VRs.LongString.short_name
+        return tag_vr(Tag(self.tag))
 
     @factory.lazy_attribute
     def value(self):  # noqa
@@ -227,70 +503,106 @@ class DataElementFactory(factory.Factory):
         DataElementFactoryException
             If a value cannot be generated
         """
-        faker = Faker()
-        faker.add_provider(DICOMVRProvider)
-        vr = VRs.short_name_to_vr(self.VR)
-        if vr == VRs.ApplicationEntity:
-            return "MockEntity"
-        elif vr == VRs.AgeString:
-            return f"{factory.random.randgen.randint(0, 120): 03d}Y"
-        elif vr == VRs.AttributeTag:
-            return 0x0010, 0x0010
-        elif vr == VRs.CodeString:
-            return "MOCK_123_CODE"
-        elif vr == VRs.Date:
-            return faker.dicom_date()
-        elif vr == VRs.DecimalString:
-            return "+10.4"
-        elif vr == VRs.DateTime:
-            return faker.dicom_date() + faker.dicom_time()
-        elif vr == VRs.FloatingPointSingle:
-            return 1.1
-        elif vr == VRs.FloatingPointDouble:
-            return 1.123
-        elif vr == VRs.IntegerString:
-            return f"{factory.random.randgen.randint(-2**31, 2**31)}"
-        elif vr == VRs.LongString:
-            return faker.sentence()[:64]
-        elif vr == VRs.LongText:
-            return faker.text()[:10240]
-        elif vr == VRs.OtherByteString:
-            return b"\x13\00"
-        elif vr == VRs.OtherDoubleString:
-            return "MockDoubleString"
-        elif vr == VRs.OtherFloatString:
-            return "MockFloatString"
-        elif vr == VRs.OtherWordString:
-            return b"MockOtherWordString"
-        elif vr == VRs.PersonName:
-            return faker.dicom_person_name()
-        elif vr == VRs.ShortString:
-            return "MockShortString"
-        elif vr == VRs.SignedLong:
-            return factory.random.randgen.randint(-(2**31), 2**31)
-        elif vr == VRs.Sequence:
-            return []
-        elif vr == VRs.SignedShort:
-            return factory.random.randgen.randint(-(2**15), 2**15)
-        elif vr == VRs.ShortText:
-            return faker.sentence()
-        elif vr == VRs.Time:
-            return faker.dicom_time()
-        elif vr == VRs.UniqueIdentifier:
-            return faker.dicom_ui()
-        elif vr == VRs.UnsignedLong:
-            return factory.random.randgen.randint(0, 2**31)
-        elif vr == VRs.Unknown:
-            return "MockUnknown"
-        elif vr == VRs.UnsignedShort:
-            return factory.random.randgen.randint(0, 2**15)
-        elif vr == VRs.UnlimitedText:
-            return faker.text()
-        else:
-            raise DataElementFactoryError(
-                f"I dont know how to generate a mock value for"
-                f" {vr}, the VR of '{self.tag}'"
-            )
+        generate = value_generator(self.tag, self.VR)
+        with stage("faker.value"):
+            return generate(get_faker())
+
+
+def value_generator(tag, vr: str) -> Callable[[Faker], Any]:
+    """The function in VALUE_GENERATORS for vr
+
+    Raises
+    ------
+    ValueError
+        If vr is not a known VR
+    DataElementFactoryError
+        If vr is known, but no value can be generated for it
+    """
+    try:
+        return VALUE_GENERATORS[vr]
+    except KeyError:
+        known_vr = VRs.short_name_to_vr(vr)  # raises ValueError if unknown
+        raise DataElementFactoryError(
+            f"I dont know how to generate a mock value for"
+            f" {known_vr}, the VR of '{tag}'"
+        ) from None
+
+
+class PlannedElement(NamedTuple):
+    tag: BaseTag
+    VR: str
+    generate: Callable[[Faker], Any]
+
+
+class ElementPlan:
+    """Generates DataElements for a fixed list of tags, much faster than
+    DataElementFactory
+
+    VR and value generator of each tag are looked up once, when the plan is
+    made. Values are random like DataElementFactory's, and follow seeding and
+    dicomgenerator.rng.use_rng() in the same way.
+
+    >>> plan = ElementPlan(["PatientName", "PatientID", 0x00080020])
+    >>> plan.elements()  # [DataElement(PatientName), ...], new values each call
+    >>> for dataset in plan.iter_datasets(1_000_000):
+    >>>     fuzz(dataset)
+
+    Parameters
+    ----------
+    tags:
+        Generate an element for each of these. Anything Tag() accepts
+    vrs:
+        VR to use for some tags, by tag. For the other tags, VR is taken from
+        the pydicom dictionary, like DataElementFactory does
+
+    Raises
+    ------
+    ValueError
+        If a tag or VR is not valid
+    DataElementFactoryError
+        If no value can be generated for the VR of a tag
+    """
+
+    def __init__(self, tags: Iterable[Any], vrs: Optional[Dict[Any, str]] = None):
+        vrs = {Tag(tag): vr for tag, vr in (vrs or {}).items()}
+        self.planned: List[PlannedElement] = []
+        for tag in tags:
+            tag = Tag(tag)
+            vr = vrs.get(tag) or tag_vr(tag)
+            self.planned.append(PlannedElement(tag, vr, value_generator(tag, vr)))
+
+    def __len__(self):
+        return len(self.planned)
+
+    @classmethod
+    def from_dataset(cls, dataset: Dataset) -> "ElementPlan":
+        """Plan for all top-level elements in dataset, with the same VRs.
+        Values in dataset are not used
+        """
+        return cls(
+            tags=dataset.keys(), vrs={x.tag: x.VR for x in dataset.elements() if x.VR}
+        )
+
+    @classmethod
+    def from_template(cls, template_path) -> "ElementPlan":
+        """Plan for all top-level elements in a json-dicom template"""
+        return cls.from_dataset(TEMPLATE_CACHE.prototype(template_path))
+
+    def elements(self) -> List[DataElement]:
+        """A new element with a random value for each tag, in plan order"""
+        faker = get_faker()
+        increment("plan.generated_elements", len(self.planned))
+        with stage("plan.elements"):
+            return [DataElement(x.tag, x.VR, x.generate(faker)) for x in self.planned]
+
+    def dataset(self) -> Dataset:
+        """A new dataset with a random value for each tag"""
+        return Dataset({x.tag: x for x in self.elements()})
+
+    def iter_datasets(self, size: int) -> Iterator[Dataset]:
+        """Lazily generate size datasets, one at a time"""
+        for _ in range(size):
+            yield self.dataset()
 
 
 class DataElementFactoryError(DICOMGeneratorError):
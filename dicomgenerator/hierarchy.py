@@ -0,0 +1,163 @@
+"""Generate realistic patient / study / series / instance structures
+
+Attributes that are shared within a level (patient name within a patient, study
+UID within a study) are generated once for that level. Only instance-level
+attributes are generated for each instance.
+"""
+import datetime
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, Optional, Type, Union
+
+import factory
+import numpy as np
+from pydicom.dataset import Dataset
+
+from dicomgenerator.caching import clone_file_dataset
+from dicomgenerator.generators import (
+    DatasetFactory,
+    FuzzyDICOMDateString,
+    get_faker,
+)
+from dicomgenerator.pixeldata import add_pixel_data_2d
+from dicomgenerator.volume import slice_positions
+
+# Fixed, so that seeded output does not depend on the day it is generated
+BIRTH_DATES = FuzzyDICOMDateString(
+    start_date=datetime.date(1930, 1, 1), end_date=datetime.date(2010, 12, 31)
+)
+
+# A fixed number, or a function that draws a number from a random generator
+Count = Union[int, Callable[[Any], int]]
+
+
+@dataclass
+class HierarchyShape:
+    """How many of each level to generate
+
+    Each count is either an int, or a callable that takes a random.Random
+    instance and returns an int. For example, a random 1 to 3 studies per patient:
+    >>> HierarchyShape(patients=10, studies=lambda rng: rng.randint(1, 3))
+    """
+
+    patients: Count = 1
+    studies: Count = 1  # per patient
+    series: Count = 1  # per study
+    instances: Count = 1  # per series
+
+    @staticmethod
+    def draw(count: Count) -> int:
+        if callable(count):
+            return count(factory.random.randgen)
+        return count
+
+
+@dataclass
+class InstancePosition:
+    """Where in the hierarchy a generated instance is"""
+
+    patient: int
+    study: int
+    series: int
+    instance: int
+
+
+def patient_attributes(index: int) -> Dict[str, Any]:
+    """Attributes shared by all instances of a patient"""
+    faker = get_faker()
+    return {
+        "PatientID": f"PAT{index:06d}",
+        "PatientName": faker.dicom_person_name(),
+        "PatientBirthDate": BIRTH_DATES.fuzz(),
+        "PatientSex": factory.random.randgen.choice(["M", "F", "O"]),
+    }
+
+
+def study_attributes(index: int, factory_class: Type[DatasetFactory]) -> Dict[str, Any]:
+    """Attributes shared by all instances of a study"""
+    faker = get_faker()
+    attributes = {
+        "StudyInstanceUID": faker.dicom_ui(),
+        "StudyID": str(index + 1),
+        "AccessionNumber": str(factory.random.randgen.randint(10**7, 10**8 - 1)),
+    }
+    # Factories like CTDatasetFactory derive all study dates and times from these
+    declarations = factory_class._meta.declarations
+    if "base_study_date" in declarations:
+        attributes["base_study_date"] = faker.dicom_date()
+    if "base_study_time" in declarations:
+        attributes["base_study_time"] = faker.dicom_time()
+    return attributes
+
+
+def series_attributes(index: int) -> Dict[str, Any]:
+    """Attributes shared by all instances of a series"""
+    faker = get_faker()
+    return {
+        "SeriesInstanceUID": faker.dicom_ui(),
+        "FrameOfReferenceUID": faker.dicom_ui(),
+        "SeriesNumber": index + 1,
+    }
+
+
+def generate_hierarchy(
+    shape: HierarchyShape,
+    factory_class: Optional[Type[DatasetFactory]] = None,
+    pixel_generator: Optional[Callable[[InstancePosition], np.ndarray]] = None,
+    **factory_kwargs,
+) -> Iterator[Dataset]:
+    """Lazily generate datasets for patients, their studies, series and instances
+
+    Runs the full factory once per series. Instances within a series are copies
+    that differ only in SOPInstanceUID, InstanceNumber, ImagePositionPatient,
+    SliceLocation and pixel data.
+
+    Parameters
+    ----------
+    shape:
+        How many patients, studies per patient, etc. to generate
+    factory_class:
+        Generate series datasets with this factory. Defaults to CTDatasetFactory
+    pixel_generator:
+        If given, called for each instance. Returned 2D array is set as pixel
+        data. Its dtype is used for bits allocated
+    factory_kwargs:
+        Passed to factory_class for each series. Overrides generated values
+
+    Returns
+    -------
+    Iterator[Dataset]
+        Datasets in patient, study, series, instance order
+    """
+    if factory_class is None:
+        from dicomgenerator.templates import CTDatasetFactory
+
+        factory_class = CTDatasetFactory
+
+    faker = get_faker()
+    for patient in range(shape.draw(shape.patients)):
+        patient_attrs = patient_attributes(patient)
+        for study in range(shape.draw(shape.studies)):
+            study_attrs = study_attributes(study, factory_class)
+            for series in range(shape.draw(shape.series)):
+                series_dataset: Dataset = factory_class.create(
+                    **{
+                        **patient_attrs,
+                        **study_attrs,
+                        **series_attributes(series),
+                        **factory_kwargs,
+                    }
+                )
+                count = shape.draw(shape.instances)
+                positions = slice_positions(series_dataset, count)
+                for instance in range(count):
+                    dataset = clone_file_dataset(series_dataset)
+                    dataset.SOPInstanceUID = faker.dicom_ui()
+                    dataset.InstanceNumber = instance + 1
+                    dataset.ImagePositionPatient = positions[instance].image_position
+                    dataset.SliceLocation = positions[instance].location
+                    if pixel_generator:
+                        pixels = pixel_generator(
+                            InstancePosition(patient, study, series, instance)
+                        )
+                        add_pixel_data_2d(dataset, pixels, dtype=pixels.dtype.name)
+                    yield dataset
@@ -0,0 +1,244 @@
+"""Opt-in timing of generation stages, to find out where time goes
+
+Stages like template loading, pixel generation and file writing are timed only
+while metrics are being collected. Otherwise, timing a stage costs a single
+check:
+
+>>> with collect_metrics() as metrics:
+>>>     for ds in CTDatasetFactory.iter_batch(100):
+>>>         export(ds, path=...)
+>>> print(format_report(metrics))
+"""
+import functools
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    TypeVar,
+    cast,
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class MetricsSink:
+    """Receives timings and counts. Subclass to send metrics somewhere else"""
+
+    def record(self, stage: str, seconds: float, nbytes: int = 0):
+        """Stage took seconds and wrote nbytes"""
+        raise NotImplementedError()
+
+    def increment(self, counter: str, amount: int = 1):
+        raise NotImplementedError()
+
+
+@dataclass
+class StageSummary:
+    count: int
+    total: float  # seconds
+    p50: float
+    p99: float
+    nbytes: int
+
+
+class InMemorySink(MetricsSink):
+    """Keeps all timings, for summaries at the end of a run. Safe to share
+    between threads. Sinks from worker processes can be merged
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, "array[float]"] = {}
+        self.nbytes: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, nbytes=0):
+        with self._lock:
+            if stage not in self.durations:
+                self.durations[stage] = array("d")
+                self.nbytes[stage] = 0
+            self.durations[stage].append(seconds)
+            self.nbytes[stage] += nbytes
+
+    def increment(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def merge(self, other: "InMemorySink"):
+        """Add all metrics from other to this sink"""
+        with self._lock:
+            for stage, durations in other.durations.items():
+                self.durations.setdefault(stage, array("d")).extend(durations)
+                self.nbytes[stage] = self.nbytes.get(stage, 0) + other.nbytes[stage]
+            for counter, amount in other.counters.items():
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def summary(self) -> Dict[str, StageSummary]:
+        with self._lock:
+            return {
+                stage: summarize(durations, self.nbytes[stage])
+                for stage, durations in sorted(self.durations.items())
+            }
+
+
+def summarize(durations: "array[float]", nbytes: int) -> StageSummary:
+    ordered = sorted(durations)
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return StageSummary(
+        count=len(ordered),
+        total=sum(ordered),
+        p50=percentile(0.5),
+        p99=percentile(0.99),
+        nbytes=nbytes,
+    )
+
+
+_sink: Optional[MetricsSink] = None
+
+
+def get_metrics_sink() -> Optional[MetricsSink]:
+    """Sink that metrics currently go to. None if metrics are disabled"""
+    return _sink
+
+
+def metrics_enabled() -> bool:
+    return _sink is not None
+
+
+def enable_metrics(sink: Optional[MetricsSink] = None) -> MetricsSink:
+    """Start sending metrics to sink, a new InMemorySink by default"""
+    global _sink
+    _sink = sink if sink is not None else InMemorySink()
+    return _sink
+
+
+def disable_metrics():
+    global _sink
+    _sink = None
+
+
+@contextmanager
+def collect_metrics(sink: Optional[MetricsSink] = None) -> Iterator[MetricsSink]:
+    """Collect metrics within this context, restoring the previous sink after"""
+    previous = _sink
+    try:
+        yield enable_metrics(sink)
+    finally:
+        if previous is None:
+            disable_metrics()
+        else:
+            enable_metrics(previous)
+
+
+class StageTimer:
+    """Times a stage from enter to exit. Use add_bytes() to record output size"""
+
+    def __init__(self, sink: MetricsSink, name: str):
+        self.sink = sink
+        self.name = name
+        self.nbytes = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.record(self.name, time.perf_counter() - self.start, self.nbytes)
+
+    def add_bytes(self, nbytes: int):
+        self.nbytes += nbytes
+
+
+class NoOpTimer:
+    """Stands in for StageTimer when metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def add_bytes(self, nbytes: int):
+        pass
+
+
+_NO_OP_TIMER = NoOpTimer()
+
+
+def stage(name: str):
+    """Context manager timing the code within as stage name
+
+    >>> with stage("export.write") as timer:
+    >>>     timer.add_bytes(write_file())
+    """
+    if _sink is None:
+        return _NO_OP_TIMER
+    return StageTimer(_sink, name)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator timing each call of a function as stage name"""
+
+    def decorator(function: F) -> F:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _sink is None:
+                return function(*args, **kwargs)
+            with StageTimer(_sink, name):
+                return function(*args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def increment(counter: str, amount: int = 1):
+    """Add amount to counter, if metrics are enabled"""
+    if _sink is not None:
+        _sink.increment(counter, amount)
+
+
+def format_report(sink: InMemorySink) -> str:
+    """Table of all stages with timings, slowest stages first"""
+    summaries = sink.summary()
+    lines: List[str] = [
+        f"{'stage':<28} {'count':>8} {'total s':>9} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'MB':>9}"
+    ]
+    for name, summary in sorted(summaries.items(), key=lambda x: -x[1].total):
+        lines.append(
+            f"{name:<28} {summary.count:>8} {summary.total:>9.3f} "
+            f"{summary.p50 * 1000:>9.3f} {summary.p99 * 1000:>9.3f} "
+            f"{summary.nbytes / 2**20:>9.1f}"
+        )
+    for counter, amount in sorted(sink.counters.items()):
+        lines.append(f"{counter:<28} {amount:>8}")
+    return "\n".join(lines)
+
+
+def report(sink: InMemorySink, file: TextIO = sys.stderr):
+    """Print stage breakdown, for example at the end of a run"""
+    print(format_report(sink), file=file)
@@ -0,0 +1,249 @@
+"""Generate large numbers of DICOM files using multiple processes"""
+import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional, Tuple, Type
+
+import numpy as np
+from pydicom.dataset import Dataset
+
+from dicomgenerator.binary_templates import ensure_compiled
+from dicomgenerator.export import export
+from dicomgenerator.logging import get_module_logger
+from dicomgenerator.metrics import InMemorySink, collect_metrics, get_metrics_sink
+from dicomgenerator.pixeldata import add_pixel_data_2d
+from dicomgenerator.rng import RNGContext, use_rng
+from dicomgenerator.uid import UIDAllocator, use_uid_allocator
+
+if TYPE_CHECKING:  # generators imports factory-boy and Faker, which are slow
+    from dicomgenerator.generators import DatasetFactory
+
+logger = get_module_logger("parallel")
+
+
+@dataclass
+class GenerationProgress:
+    """How far along generating a corpus is"""
+
+    total: Optional[int]  # None if not known in advance
+    done: int = 0
+    bytes_written: int = 0
+    start_time: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since start"""
+        return time.perf_counter() - self.start_time
+
+    @property
+    def files_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.bytes_written / elapsed if elapsed else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated seconds until done. None if this cannot be estimated yet"""
+        rate = self.files_per_second
+        if not rate or self.total is None:
+            return None
+        return (self.total - self.done) / rate
+
+
+@dataclass(frozen=True)
+class ChunkTask:
+    """Generate and export files for a consecutive range of indices"""
+
+    factory_class: Type["DatasetFactory"]
+    output_dir: Path
+    start: int
+    stop: int
+    seed: str
+    filename: str
+    factory_kwargs: Dict[str, Any]
+    uid_allocator: Optional[UIDAllocator] = None
+    uids_per_instance: int = 0
+    compress: bool = False
+    pixel_generator: Optional[Callable[[int], np.ndarray]] = None
+    collect_metrics: bool = False
+
+
+def generate_chunk(task: ChunkTask) -> Tuple[int, int, Optional[InMemorySink]]:
+    """Generate and export all files in task. Runs inside a worker process
+
+    Returns
+    -------
+    Tuple[int, int, Optional[InMemorySink]]
+        Number of files written, number of bytes written, metrics collected if
+        task.collect_metrics is True
+    """
+    if not task.collect_metrics:
+        return (*_generate_chunk(task), None)
+    sink = InMemorySink()
+    with collect_metrics(sink):
+        return (*_generate_chunk(task), sink)
+
+
+def _generate_chunk(task: ChunkTask) -> Tuple[int, int]:
+    bytes_written = 0
+    for index in range(task.start, task.stop):
+        path = task.output_dir / task.filename.format(index=index)
+        # A stream per instance index makes output independent of how work is
+        # distributed over processes
+        with use_rng(RNGContext(task.seed, index)):
+            dataset = _generate_instance(task, index)
+        export(dataset=dataset, path=path, compress=task.compress)
+        bytes_written += os.path.getsize(path)
+    return task.stop - task.start, bytes_written
+
+
+def _generate_instance(task: ChunkTask, index: int) -> Dataset:
+    dataset: Dataset
+    if task.uid_allocator:
+        allocator = task.uid_allocator.slot(index, task.uids_per_instance)
+        with use_uid_allocator(allocator):
+            dataset = task.factory_class.create(**task.factory_kwargs)
+    else:
+        dataset = task.factory_class.create(**task.factory_kwargs)
+    if task.pixel_generator:
+        pixels = task.pixel_generator(index)
+        add_pixel_data_2d(dataset, pixels, dtype=pixels.dtype.name)
+    return dataset
+
+
+def split_into_chunks(count: int, chunk_size: int) -> Iterator[Tuple[int, int]]:
+    """(start, stop) index ranges covering range(count)"""
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size should be 1 or more, got {chunk_size}")
+    for start in range(0, count, chunk_size):
+        yield start, min(start + chunk_size, count)
+
+
+def generate_corpus(
+    output_dir,
+    count: int,
+    factory_class: Optional[Type["DatasetFactory"]] = None,
+    seed: Optional[str] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 100,
+    filename: str = "{index:06d}.dcm",
+    progress: Optional[Callable[[GenerationProgress], None]] = None,
+    uid_allocator: Optional[UIDAllocator] = None,
+    uids_per_instance: int = 100,
+    compress: bool = False,
+    pixel_generator: Optional[Callable[[int], np.ndarray]] = None,
+    **factory_kwargs,
+) -> GenerationProgress:
+    """Generate count DICOM files in output_dir, spread over multiple processes
+
+    Parameters
+    ----------
+    output_dir:
+        Write files here. Is created if it does not exist
+    count:
+        Write this many files
+    factory_class:
+        Generate datasets with this factory. Should be importable from a module
+        so worker processes can find it. Defaults to CTDatasetFactory
+    seed:
+        If given, each file is generated with a seed derived from this seed and
+        the file index. Output is then identical for any number of workers.
+        Defaults to a random seed, different for each run
+    workers:
+        Number of worker processes. Defaults to number of CPUs. If 1, all work
+        is done in the current process
+    chunk_size:
+        Send this many files to a worker at a time
+    filename:
+        Format string for file names. Is formatted with 'index'
+    progress:
+        Called with current progress each time a chunk is done
+    uid_allocator:
+        If given, take UIDs from this allocator instead of generating random ones.
+        Each file gets its own range of uids_per_instance counter values, so UIDs
+        never collide between workers
+    uids_per_instance:
+        Size of the UID range for each file when using uid_allocator
+    compress:
+        If True, write pixel data RLE Lossless compressed
+    pixel_generator:
+        If given, called with the index of each file. Returned 2D array is set
+        as pixel data. Should be picklable, like a module-level function
+    factory_kwargs:
+        Passed to factory_class for each dataset
+
+    Notes
+    -----
+    If metrics are being collected in an InMemorySink, metrics from all workers
+    are merged into it. See dicomgenerator.metrics
+
+    With more than one worker, the factory's template is compiled first if
+    needed, so that worker processes do not each parse the json template. See
+    dicomgenerator.binary_templates
+
+    Returns
+    -------
+    GenerationProgress
+        Final progress, with totals for the whole run
+    """
+    if factory_class is None:
+        from dicomgenerator.templates import CTDatasetFactory
+
+        factory_class = CTDatasetFactory
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    template_path = factory_kwargs.get("template_path", factory_class.template_path)
+    if workers > 1 and template_path:
+        ensure_compiled(template_path)  # so each worker loads it fast
+    if seed is None:
+        # Forked workers start with identical global random state. Without a
+        # corpus seed each worker would generate the same values
+        seed = secrets.token_hex(16)
+    tasks = [
+        ChunkTask(
+            factory_class=factory_class,
+            output_dir=output_dir,
+            start=start,
+            stop=stop,
+            seed=seed,
+            filename=filename,
+            factory_kwargs=factory_kwargs,
+            uid_allocator=uid_allocator,
+            uids_per_instance=uids_per_instance,
+            compress=compress,
+            pixel_generator=pixel_generator,
+            collect_metrics=isinstance(get_metrics_sink(), InMemorySink),
+        )
+        for start, stop in split_into_chunks(count, chunk_size)
+    ]
+    status = GenerationProgress(total=count)
+    sink = get_metrics_sink()
+
+    def update(result: Tuple[int, int, Optional[InMemorySink]]):
+        status.done += result[0]
+        status.bytes_written += result[1]
+        if result[2] is not None and isinstance(sink, InMemorySink):
+            sink.merge(result[2])
+        if progress:
+            progress(status)
+
+    logger.info(f"Generating {count} files in '{output_dir}' with {workers} workers")
+    if workers == 1:
+        for task in tasks:
+            update(generate_chunk(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(generate_chunk, task) for task in tasks]
+            for future in as_completed(futures):
+                update(future.result())
+
+    return status
@@ -1,16 +1,30 @@
 """Functions and classes for reading, writing and editing datasets"""
 import json
+import mmap
+import os
 from pathlib import Path
-from typing import Type
+from typing import Iterable, Iterator, List, Optional, Tuple, Type
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 
 import pydicom
+from pydicom.dataelem import DataElement
 from pydicom.dataset import Dataset
 
 from dicomgenerator import logging
+from dicomgenerator.buffers import BufferReader, as_buffer
+from dicomgenerator.exceptions import DICOMGeneratorError
+from dicomgenerator.metrics import stage, timed
 
 
 logger = logging.get_module_logger("annotation")
 
+# Binary values that take more than this many characters as base64 are written to
+# a sidecar file by save_to_path(), instead of inline
+BULK_DATA_THRESHOLD = 2**16
+
+JSON_INDENT = 4
+
 
 class JSONSerializable:
     """Something that you can persist to and from JSON"""
@@ -35,20 +49,194 @@ class JSONDataset(JSONSerializable):
         self.dataset = dataset
 
     @classmethod
-    def load(cls, handle):
-        """Load from json file"""
-        return cls.from_json_dict(json.load(handle))
+    @timed("json.load")
+    def load(cls, handle, bulk_data_uri_handler=None):
+        """Load from json file
+
+        Parameters
+        ----------
+        handle:
+            Open json file
+        bulk_data_uri_handler: Callable[[str, str, str], Any], optional
+            Called with (tag, vr, uri) for each BulkDataURI value, returns
+            the value. See BulkDataLoader. BulkDataURI values are left empty if
+            not given
+        """
+        return cls.from_json_dict(
+            json.load(handle), bulk_data_uri_handler=bulk_data_uri_handler
+        )
+
+    def save(
+        self,
+        handle,
+        bulk_data_element_handler=None,
+        bulk_data_threshold=BULK_DATA_THRESHOLD,
+    ):
+        """Save to file in json format
 
-    def save(self, handle):
-        """Save to file in json format"""
-        handle.write(json.dumps(self.to_json_dict(), indent=4))
+        Parameters
+        ----------
+        handle:
+            Open text file to write to
+        bulk_data_element_handler: Callable[[DataElement], str], optional
+            Called for binary elements larger than bulk_data_threshold. Stores
+            the value and returns a BulkDataURI for it. See BulkDataWriter.
+            Defaults to writing all binary values inline, as base64
+        bulk_data_threshold: int, optional
+            Size of the base64 encoded value above which bulk_data_element_handler
+            is used
+        """
+        with stage("json.save") as timer:
+            for chunk in self.iter_json(
+                bulk_data_element_handler=bulk_data_element_handler,
+                bulk_data_threshold=bulk_data_threshold,
+            ):
+                handle.write(chunk)
+                timer.add_bytes(len(chunk))
+
+    def iter_json(
+        self, bulk_data_element_handler=None, bulk_data_threshold=BULK_DATA_THRESHOLD
+    ) -> Iterator[str]:
+        """Json text in chunks, encoding one element at a time. Joined, the
+        chunks are equal to json.dumps(self.to_json_dict(), indent=4)
+        """
+        yield from iter_json_object(
+            (
+                f"{element.tag:08X}",
+                json.dumps(
+                    element.to_json_dict(
+                        bulk_data_element_handler=bulk_data_element_handler,
+                        bulk_data_threshold=bulk_data_threshold,
+                    ),
+                    indent=JSON_INDENT,
+                ),
+            )
+            for element in self.dataset
+        )
 
     @classmethod
-    def from_json_dict(cls, dataset_dict):
-        return cls(dataset=Dataset.from_json(dataset_dict))
+    def load_from_path(cls, path):
+        """Load from json file, memory mapping any BulkDataURI sidecar files"""
+        path = Path(path)
+        with open(path) as f:
+            return cls.load(f, bulk_data_uri_handler=BulkDataLoader(path.parent))
 
-    def to_json_dict(self):
-        return self.dataset.to_json_dict()
+    def save_to_path(self, path, bulk_data_threshold=BULK_DATA_THRESHOLD):
+        """Save to json file. Binary values larger than bulk_data_threshold are
+        written to raw sidecar files next to it and referenced by BulkDataURI
+
+        Returns
+        -------
+        List[Path]
+            Paths of the sidecar files that were written
+        """
+        path = Path(path)
+        writer = BulkDataWriter(path)
+        with open(path, "w") as f:
+            self.save(
+                f,
+                bulk_data_element_handler=writer,
+                bulk_data_threshold=bulk_data_threshold,
+            )
+        return writer.paths
+
+    @classmethod
+    def from_json_dict(cls, dataset_dict, bulk_data_uri_handler=None):
+        return cls(
+            dataset=Dataset.from_json(
+                dataset_dict, bulk_data_uri_handler=bulk_data_uri_handler
+            )
+        )
+
+    def to_json_dict(
+        self, bulk_data_element_handler=None, bulk_data_threshold=BULK_DATA_THRESHOLD
+    ):
+        return self.dataset.to_json_dict(
+            bulk_data_element_handler=bulk_data_element_handler,
+            bulk_data_threshold=bulk_data_threshold,
+        )
+
+
+def iter_json_object(items: Iterable[Tuple[str, str]], depth: int = 0) -> Iterator[str]:
+    """Json text of an object with the given (key, encoded value) items
+
+    Values should be encoded with json.dumps(indent=JSON_INDENT). They are
+    indented to fit at depth, so the result is formatted as if the whole object
+    was encoded at once
+    """
+    inner = "\n" + " " * JSON_INDENT * (depth + 1)
+    empty = True
+    for key, text in items:
+        yield f"{'{' if empty else ','}{inner}{json.dumps(key)}: "
+        yield text.replace("\n", inner)
+        empty = False
+    yield "{}" if empty else "\n" + " " * JSON_INDENT * depth + "}"
+
+
+class BulkDataWriter:
+    """Writes binary element values to raw files next to a json file
+
+    Use as bulk_data_element_handler. Files are named after the json file, like
+    'ct_template.0.7FE00010.raw', and referenced by a URI relative to the json
+    file, so that json and sidecar files can be moved together.
+    """
+
+    def __init__(self, json_path: Path):
+        self.directory = Path(json_path).parent
+        self.stem = Path(json_path).stem
+        self.paths: List[Path] = []
+
+    def __call__(self, element: DataElement) -> str:
+        # the same tag can occur more than once, in sequences
+        name = f"{self.stem}.{len(self.paths)}.{element.tag:08X}.raw"
+        value = memoryview(as_buffer(element.value)).cast("B")
+        path = self.directory / name
+        with open(path, "wb") as f:
+            f.write(value)
+        self.paths.append(path)
+        return name
+
+
+class BulkDataLoader:
+    """Resolves BulkDataURI values by memory mapping the file they point to
+
+    Use as bulk_data_uri_handler. Nothing is read from disk until the value is
+    accessed, so loading json with large pixel data is fast. Values are
+    BufferReader instances, which pydicom streams when writing.
+
+    Parameters
+    ----------
+    directory:
+        Resolve relative URIs against this directory, normally the directory
+        of the json file
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def __call__(self, tag: str, vr: str, uri: str):
+        path = self.resolve(uri)
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b""
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError as e:
+            raise BulkDataError(
+                f"BulkDataURI '{uri}' of element {tag}: '{path}' not found"
+            ) from e
+        return BufferReader(mapped)
+
+    def resolve(self, uri: str) -> Path:
+        """Local path for uri. Relative URIs are relative to directory"""
+        parsed = urlparse(uri)
+        if parsed.scheme == "file":
+            return Path(url2pathname(parsed.path))
+        if parsed.scheme:
+            raise BulkDataError(
+                f"Cannot load BulkDataURI '{uri}'. Only local files are supported"
+            )
+        return self.directory / url2pathname(parsed.path)
 
 
 class FileJSONDataset:
@@ -96,15 +284,29 @@ class FileJSONDataset:
 
     source_file_path: Path
 
-    def save_to_path(self, save_path=None):
-        """Save to disk. Next to input file by default"""
+    def save_to_path(self, save_path=None, bulk_data_threshold: Optional[int] = None):
+        """Save to disk. Next to input file by default
+
+        All values are written inline by default. If bulk_data_threshold is
+        given, larger binary values like PixelData are written to raw sidecar
+        files next to the json file instead, see BULK_DATA_THRESHOLD
+        """
         if save_path:
             save_path = Path(save_path)
         else:
             source = Path(self.dicom_file_path)
             save_path = source.parent / (source.stem + "_template.json")
-        with open(save_path, "w") as f:
-            self.json_dataset.save(f)
+        if bulk_data_threshold is None:
+            with open(save_path, "w") as f:
+                self.json_dataset.save(f)
+        else:
+            self.json_dataset.save_to_path(
+                save_path, bulk_data_threshold=bulk_data_threshold
+            )
 
         logger.info(f"Wrote {self} to '{save_path}'")
         return save_path
+
+
+class BulkDataError(DICOMGeneratorError):
+    pass
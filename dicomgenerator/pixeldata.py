@@ -1,17 +1,21 @@
 """Classes and functions for working with Dataset pixeldata"""
 import hashlib
-from dataclasses import dataclass
+import os
+from dataclasses import astuple, dataclass
 from enum import Enum
-from typing import Iterable, Optional, Tuple
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Optional, Sequence, Tuple, Union
 
 import numpy as np
-from PIL import Image
-from numpy.random import random
 from pydicom import Dataset, FileMetaDataset
 from pydicom.uid import ExplicitVRLittleEndian
 
+from dicomgenerator.buffers import BufferReader, as_buffer
+from dicomgenerator.caching import LRUCache
 from dicomgenerator.logging import get_module_logger
+from dicomgenerator.metrics import timed
 from dicomgenerator.resources import RESOURCE_PATH
+from dicomgenerator.rng import get_rng
 
 logger = get_module_logger("pixeldata")
 
@@ -32,6 +36,7 @@ class PhotoMetricInterpretation(Enum):
     YBR_FULL_422 = "YBR_FULL_422"
 
 
+@timed("pixels.replace")
 def replace_pixel_data(dataset, image_path=None):
     """Replace the DICOM PixelData tag with the data from image_path
 
@@ -55,67 +60,165 @@ def replace_pixel_data(dataset, image_path=None):
 
     logger.info(f'Replacing image data with image at "{image_path}"')
 
-    im = Image.open(image_path)
-    pixel_values = list(im.getdata())
-    # convert image into numpy ndarray. use only R channel from RGB as this is
-    # a greyscale image
-    pix_np = np.array([x[0] for x in pixel_values])
-    w, h = im.size  # Set dimensions
-    pix_np.shape = (h, w)
-    pix_np = rescale(pix_np, min_val=-2048, max_val=1000)  # make pixel_array CT-like
-    dataset.PixelData = pix_np.astype(
-        np.int16
-    ).tobytes()  # Not sure whether this can be other than int16.
-    dataset.Rows, dataset.Columns = pix_np.shape
+    image = load_image_pixels(image_path, min_val=-2048, max_val=1000)  # CT-like
+    dataset.PixelData = image.pixel_bytes
+    dataset.Rows, dataset.Columns = image.rows, image.columns
     return dataset
 
 
-def rescale(ndarray, min_val, max_val):
+class ImagePixels(NamedTuple):
+    """Pixel data for an image, ready to be put into a dataset"""
+
+    pixel_bytes: bytes  # int16 values, row-major
+    rows: int
+    columns: int
+
+
+_image_pixels_cache = LRUCache(maxsize=32)
+
+
+def load_image_pixels(image_path, min_val: int, max_val: int) -> ImagePixels:
+    """Read greyscale image, rescaled to int16 values between min_val and max_val
+
+    Results are cached per image file and value range, so loading the same image
+    again costs nothing.
+
+    Parameters
+    ----------
+    image_path:
+        pathlike to rgb or greyscale image readable with pillow
+    min_val: int
+    max_val: int
+
+    """
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, min_val, max_val)
+    pixels: ImagePixels = _image_pixels_cache.get_or_create(
+        key, lambda: _read_image_pixels(image_path, min_val, max_val)
+    )
+    return pixels
+
+
+def _read_image_pixels(image_path, min_val: int, max_val: int) -> ImagePixels:
+    from PIL import Image
+
+    with Image.open(image_path) as im:
+        pix_np = np.asarray(im)
+    if pix_np.ndim == 3:
+        # use only R channel from RGB as this is a greyscale image
+        pix_np = pix_np[..., 0]
+    pix_np = rescale(
+        pix_np, min_val=min_val, max_val=max_val, out=np.empty(pix_np.shape, np.int16)
+    )
+    rows, columns = pix_np.shape
+    return ImagePixels(pixel_bytes=pix_np.tobytes(), rows=rows, columns=columns)
+
+
+# Number of values to rescale at a time. Small enough to stay in CPU cache
+RESCALE_CHUNK_SIZE = 2**16
+
+
+@timed("pixels.rescale")
+def rescale(ndarray, min_val, max_val, out=None, chunk_size: int = RESCALE_CHUNK_SIZE):
     """Rescale pixel_array of ndarray linearly so min of ndarray is min, max is max
 
+    Works through ndarray in chunks, so memory use does not grow with the size of
+    ndarray. Integer results are rounded to the nearest value.
+
     Parameters
     ----------
     ndarray: numpy nd array
     min_val: int
     max_val: int
+    out: numpy ndarray, optional
+        Write result into this C-contiguous array of the same shape as ndarray.
+        Can be ndarray itself. Defaults to a new array with the dtype of ndarray
+    chunk_size: int, optional
+        Number of values to process at a time
 
     Returns
     -------
     numpy ndarray
+        out, if given. If all values of ndarray are the same, all values are set
+        to min_val
 
     """
-
-    old_max = ndarray.max()
-    old_min = ndarray.min()
-    old_range = old_max - old_min
-    old_dtype = ndarray.dtype
-    new_range = max_val - min_val
-    range_scale = new_range / old_range
-
-    ndarray = ndarray.astype(float)
-    ndarray -= old_min  # translate to make based on 0
-    ndarray *= range_scale  # scale to make range same size
-    ndarray += min_val  # translate back to make old min fall on (new) min
-
-    return ndarray.astype(old_dtype)
+    if out is None:
+        out = np.empty_like(ndarray, order="C")
+    elif out.shape != ndarray.shape or not out.flags.c_contiguous:
+        raise ValueError(
+            f"out should be C-contiguous with shape {ndarray.shape}, got {out.shape}"
+        )
+    if not ndarray.size:
+        return out
+
+    old_min = float(ndarray.min())
+    old_max = float(ndarray.max())
+    if old_max == old_min:
+        out[...] = min_val
+        return out
+
+    # float32 is exact for all values of 8 and 16-bit integers
+    if ndarray.dtype.kind in "iub" and ndarray.dtype.itemsize <= 2:
+        work_dtype = np.dtype(np.float32)
+    else:
+        work_dtype = np.result_type(ndarray.dtype, np.float32)
+    # (x - old_min) * scale + min_val, as a single multiply and add
+    scale = work_dtype.type((max_val - min_val) / (old_max - old_min))
+    offset = work_dtype.type(min_val - old_min * float(scale))
+    round_result = out.dtype.kind in "iub"
+
+    values = ndarray.reshape(-1)
+    result = out.reshape(-1)
+    scratch = np.empty(min(chunk_size, values.size), dtype=work_dtype)
+    for start in range(0, values.size, chunk_size):
+        chunk = values[start : start + chunk_size]
+        work = scratch[: chunk.size]
+        np.multiply(chunk, scale, out=work, casting="unsafe")
+        work += offset
+        if round_result:
+            np.rint(work, out=work)
+        result[start : start + chunk.size] = work
+    return out
 
 
 def generate_image(width=128, height=128):
     """Create an image that can be written to pixeldata"""
+    from PIL import Image
+
     image = Image.effect_noise((width, height), 50)
     return image
 
 
 def effect_noise_seeded(width, height, sigma, seed=None):
+    from PIL import Image
+
     rng = np.random.default_rng(seed)
     noise = rng.normal(loc=128, scale=sigma, size=(height, width))
     noise = np.clip(noise, 0, 255).astype(np.uint8)
     return Image.fromarray(noise, mode="L")
 
 
-def add_pixel_data_2d(dataset: Dataset, pixel_array: np.ndarray, dtype: str):
+@timed("pixels.set")
+def add_pixel_data_2d(
+    dataset: Dataset, pixel_array: np.ndarray, dtype: str, zero_copy: bool = False
+):
     """Write image into pixel data. Set rows and columns
 
+    Parameters
+    ----------
+    dataset:
+        Write into this dataset
+    pixel_array:
+        2D array of pixel values. Can be a numpy.memmap
+    dtype:
+        Data type of pixel values
+    zero_copy:
+        If True, do not copy pixel_array into the dataset. PixelData will read
+        directly from pixel_array when the dataset is written. Use this with
+        numpy.memmap to write very large images without loading them in memory.
+        Do not modify pixel_array until the dataset has been written.
+
     Warning
     -------
     Modifies dataset.file_meta and sets TransferSyntaxUID. Is not completely respectful
@@ -135,16 +238,17 @@ def add_pixel_data_2d(dataset: Dataset, pixel_array: np.ndarray, dtype: str):
     ds.SamplesPerPixel = 1
     ds.PhotometricInterpretation = PhotoMetricInterpretation.MONOCHROME2.value
 
-    ds.PixelData = pixel_array.tobytes()
+    if zero_copy:
+        ds.PixelData = BufferReader(np.ascontiguousarray(pixel_array))
+    elif pixel_array.nbytes % 2 == 1:
+        # Trailing padding required to make the length an even number of bytes
+        ds.PixelData = pixel_array.tobytes() + b"\x00"
+    else:
+        ds.PixelData = pixel_array.tobytes()
     ds["PixelData"].VR = "OB"
     ds.Rows = pixel_array.shape[0]  # 320 pixels
     ds.Columns = pixel_array.shape[1]  # 480 pixels
 
-    # add padding for DICOM conformance
-    if pixel_array.size % 2 == 1:
-        # Trailing padding required to make the length an even number of bytes
-        ds.PixelData = b"".join((pixel_array.tobytes(), b"\x00"))
-
     return ds
 
 
@@ -153,8 +257,33 @@ def md5_int(string_in):
     return int(hashlib.md5(string_in.encode()).hexdigest(), 16)
 
 
+@lru_cache(maxsize=256)
+def noise_seed_sequence(seed: str) -> np.random.SeedSequence:
+    """Root of all random streams for seed. Cached, as hashing is not free"""
+    return np.random.SeedSequence(md5_int(seed))
+
+
+def noise_rng(seed: str, frame: int = 0) -> np.random.Generator:
+    """Independent random stream for a single frame of a seeded series
+
+    Same as the frame'th child of noise_seed_sequence(seed).spawn(), but without
+    spawning all children before it. This means frame i can be generated
+    without generating frames 0 to i-1.
+    """
+    parent = noise_seed_sequence(seed)
+    child = np.random.SeedSequence(parent.entropy, spawn_key=(*parent.spawn_key, frame))
+    return np.random.Generator(np.random.PCG64(child))
+
+
+@timed("pixels.noise")
 def draw_noise(
-    height: int, width: int, dtype: str, seed: Optional[str] = None
+    height: int,
+    width: int,
+    dtype: str,
+    seed: Optional[str] = None,
+    frames: Optional[int] = None,
+    frame: int = 0,
+    out: Optional[np.ndarray] = None,
 ) -> np.ndarray:
     """Return an array containing random values between 0 and maximum for the given
     datatype.
@@ -168,24 +297,42 @@ def draw_noise(
         Optional random seed to use for generation. Two calls to draw_noise with seed
         and other parameters unchanged should result in identical ndarrays.
         Defaults to empty string, in which case no seed is set and the resulting noise
-        is random
+        is random. Within dicomgenerator.rng.use_rng(), defaults to a seed drawn
+        from the active context, so noise is reproducible and differs per call
+    frames:
+        If given, return this many frames in an array of shape (frames, height,
+        width). Defaults to a single 2-d array
+    frame:
+        Index of the first frame. With seed, each frame index has its own random
+        stream, so noise for frame 10 is the same whether it is drawn on its own or
+        as part of frames 0 to 20
+    out:
+        Write values into this array instead of a new one. Should have the
+        shape and dtype of the result
 
     Returns
     -------
     numpy ndarray
-        a 2-d array
+        a 2-d array, or 3-d if frames is given
 
     """
-    max_value = np.iinfo(dtype).max
-    if seed:
-        rng = np.random.default_rng(md5_int(seed))
-        arr = rng.random((height, width))
-    else:
-        arr = random((height, width))
-
-    # Convert to the required `dtype` and set the maximum `value`
-    arr = arr * max_value
-    return arr.astype(dtype)
+    data_type = np.dtype(dtype)
+    shape = (height, width) if frames is None else (frames, height, width)
+    if out is None:
+        out = np.empty(shape, dtype=data_type)
+    elif out.shape != shape or out.dtype != data_type:
+        raise ValueError(
+            f"out should have shape {shape} and dtype {data_type}, got {out.shape} "
+            f"and {out.dtype}"
+        )
+    max_value = np.iinfo(data_type).max
+    if not seed:
+        context = get_rng()
+        seed = str(context.getrandbits(64)) if context is not None else None
+    for index, target in enumerate(out.reshape((-1, height, width))):
+        rng = noise_rng(seed, frame + index) if seed else np.random.default_rng()
+        target[...] = rng.integers(0, max_value, (height, width), dtype=data_type)
+    return out
 
 
 @dataclass
@@ -224,6 +371,7 @@ class Block:
         )
 
 
+@timed("pixels.blocks")
 def add_blocks(dataset: Dataset, blocks: Iterable[Block], value=0) -> Dataset:
     """Fill dataset PixelData area within blocks with value
 
@@ -250,6 +398,133 @@ def add_blocks(dataset: Dataset, blocks: Iterable[Block], value=0) -> Dataset:
     return dataset
 
 
+# Above this number of blocks, painting a single mask is faster than painting
+# blocks one by one
+BLOCK_MASK_THRESHOLD = 500
+
+
+@timed("pixels.blocks")
+def add_blocks_array(
+    dataset: Dataset,
+    blocks: Union[np.ndarray, Iterable["Block"]],
+    value=0,
+    frames: Optional[Union[int, Sequence[int]]] = None,
+) -> Dataset:
+    """Fill dataset PixelData area within many blocks with value, in place
+
+    Faster than add_blocks() for large numbers of blocks. Pixel data is not
+    decoded but modified directly. Only works for uncompressed pixel data.
+
+    Parameters
+    ----------
+    dataset:
+        Modify pixel data of this dataset
+    blocks:
+        Array of shape (N, 4). Each row is origin_x, origin_y, height, width, like
+        Block. A list of Block instances also works
+    value:
+        Set all pixels within blocks to this value
+    frames:
+        Index or indices of frames to paint blocks on. Defaults to all frames
+
+    Returns
+    -------
+    Dataset:
+        The same dataset. Its PixelData is a writable BufferReader after this, so
+        that subsequent calls do not need to copy anything
+
+    Raises
+    ------
+    ValueError:
+        If any block is not within the image, or pixel data is compressed
+    OverflowError:
+        If value does not fit inside the bit depth of the dataset's pixel data
+    """
+    pixels = writable_pixel_view(dataset)
+    if not isinstance(blocks, np.ndarray):
+        blocks = np.asarray(
+            [astuple(x) if isinstance(x, Block) else x for x in blocks],
+            dtype=np.int64,
+        )
+    blocks = blocks.astype(np.int64, copy=False).reshape(-1, 4)
+    x0, y0 = blocks[:, 0], blocks[:, 1]
+    y1, x1 = y0 + blocks[:, 2], x0 + blocks[:, 3]
+    _, rows, columns = pixels.shape
+    outside = (x0 < 0) | (y0 < 0) | (x1 < x0) | (y1 < y0)
+    outside |= (x1 > columns) | (y1 > rows)
+    if outside.any():
+        raise ValueError(
+            f"Blocks {blocks[outside].tolist()} are not within image size "
+            f"{rows, columns}. This does not make sense"
+        )
+
+    if frames is None:
+        frames = range(pixels.shape[0])
+    elif isinstance(frames, int):
+        frames = [frames]
+
+    if len(blocks) <= BLOCK_MASK_THRESHOLD:
+        for frame in frames:
+            for top, bottom, left, right in zip(y0, y1, x0, x1, strict=True):
+                pixels[frame, top:bottom, left:right] = value
+        return dataset
+
+    # Mark all blocks in one go using a 2D difference array
+    counts = np.zeros((rows + 1, columns + 1), dtype=np.int32)
+    np.add.at(counts, (y0, x0), 1)
+    np.add.at(counts, (y0, x1), -1)
+    np.add.at(counts, (y1, x0), -1)
+    np.add.at(counts, (y1, x1), 1)
+    np.cumsum(counts, axis=0, out=counts)
+    np.cumsum(counts, axis=1, out=counts)
+    mask = counts[:rows, :columns] > 0
+    for frame in frames:
+        pixels[frame][mask] = value
+    return dataset
+
+
+def writable_pixel_view(dataset: Dataset) -> np.ndarray:
+    """Writable array of shape (frames, rows, columns) on dataset's pixel data
+
+    Writing to the array modifies the dataset directly. Pixel data is copied
+    once into a bytearray that belongs to the dataset, unless it is in one
+    already. Buffers that might belong to someone else, like zero-copy arrays
+    and memory maps, are never written to.
+
+    Raises
+    ------
+    ValueError
+        If pixel data is compressed, or not a single sample of 8, 16, 32 or 64
+        bits
+    """
+    file_meta = getattr(dataset, "file_meta", {})
+    transfer_syntax = file_meta.get("TransferSyntaxUID", ExplicitVRLittleEndian)
+    if transfer_syntax.is_compressed:
+        raise ValueError(
+            f"Can only write into uncompressed pixel data, not {transfer_syntax.name}"
+        )
+    bits = dataset.BitsAllocated
+    if bits not in (8, 16, 32, 64) or dataset.get("SamplesPerPixel", 1) != 1:
+        raise ValueError(
+            "Can only write into single-sample pixel data of 8, 16, 32 or 64 bits"
+        )
+    kind = "i" if dataset.get("PixelRepresentation", 0) == 1 else "u"
+    dtype = np.dtype(f"<{kind}{bits // 8}")
+
+    value = dataset.PixelData
+    if isinstance(value, BufferReader) and isinstance(value.buffer, bytearray):
+        buffer = value.buffer
+    else:
+        buffer = bytearray(as_buffer(value))
+        dataset.PixelData = BufferReader(buffer)
+        dataset["PixelData"].VR = "OB" if bits == 8 else "OW"
+
+    frames = int(dataset.get("NumberOfFrames", 1) or 1)
+    shape = (frames, dataset.Rows, dataset.Columns)
+    count = shape[0] * shape[1] * shape[2]
+    return np.frombuffer(buffer, dtype=dtype, count=count).reshape(shape)
+
+
 def check_bounds(block: Block, pixel_array: np.ndarray):
     """Raise exception if block is no fully within the bounds of pixel array
 
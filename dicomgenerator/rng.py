@@ -0,0 +1,125 @@
+"""Reproducible random streams that do not depend on call order
+
+By default, random values come from factory-boy's and Faker's global random
+generators, so each value depends on everything generated before it. An
+RNGContext is an independent stream derived from a corpus seed and an instance
+index. Within use_rng(), factories, VR providers and pixel noise all draw from
+it:
+
+>>> with use_rng(RNGContext("corpus1", index=42)):
+>>>     dataset = CTDatasetFactory()
+
+The same seed and index give the same dataset in any thread or process, no
+matter what other threads or processes generate meanwhile.
+"""
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+
+class RNGContext(random.Random):
+    """Random stream for a single generated instance
+
+    A random.Random, so it can be used wherever one is expected. Each draw is
+    thread safe, so a context can be shared as a handle between threads. Output
+    is only reproducible if draws happen in the same order though, so give
+    each instance its own context.
+
+    Parameters
+    ----------
+    seed:
+        Corpus seed
+    index:
+        Index of the instance within the corpus
+    """
+
+    def __init__(self, seed: str, index: int = 0):
+        self._lock = threading.Lock()
+        self.seed_value = seed
+        self.index = index
+        super().__init__(self.key)
+
+    def __repr__(self):
+        return f"RNGContext('{self.seed_value}', {self.index})"
+
+    def __reduce__(self):
+        # For sending to worker processes. Continues where this context was
+        return RNGContext, (self.seed_value, self.index), self.getstate()
+
+    @property
+    def key(self) -> str:
+        """Identifies this stream. Different seed and index give different keys"""
+        return f"{self.seed_value}:{self.index}"
+
+    def spawn(self, index: int) -> "RNGContext":
+        """Independent context for the index-th part of this instance, like the
+        index-th instance of a series. Does not draw from this context
+        """
+        return RNGContext(self.key, index)
+
+    def random(self):
+        with self._lock:
+            return super().random()
+
+    def getrandbits(self, k):
+        with self._lock:
+            return super().getrandbits(k)
+
+
+_active_rng: ContextVar[Optional[RNGContext]] = ContextVar("active_rng", default=None)
+
+
+def get_rng() -> Optional[RNGContext]:
+    """The context that random values currently come from, if any"""
+    return _active_rng.get()
+
+
+@contextmanager
+def use_rng(context: RNGContext):
+    """Draw all random values generated in this context from context
+
+    Context variables are local to each thread and asyncio task, so other
+    threads can use their own context at the same time.
+    """
+    token = _active_rng.set(context)
+    try:
+        yield context
+    finally:
+        _active_rng.reset(token)
+
+
+class ContextualRandom(random.Random):
+    """Draws from the active RNGContext, or from fallback outside any context
+
+    For random generators that other code keeps a reference to, like
+    factory.random.randgen and the generator of a Faker instance. Replacing
+    those with a ContextualRandom makes them follow use_rng(). Outside a context
+    they behave exactly like fallback.
+    """
+
+    def __init__(self, fallback: random.Random):
+        super().__init__()
+        self.fallback = fallback
+
+    def _stream(self) -> random.Random:
+        context = _active_rng.get()
+        return self.fallback if context is None else context
+
+    def seed(self, *args, **kwargs):
+        # random.Random.__init__ seeds too. That should not reseed any stream
+        if "fallback" in self.__dict__:
+            self._stream().seed(*args, **kwargs)
+
+    def random(self):
+        return self._stream().random()
+
+    def getrandbits(self, k):
+        return self._stream().getrandbits(k)
+
+    def getstate(self):
+        return self._stream().getstate()
+
+    def setstate(self, state):
+        self._stream().setstate(state)
@@ -1,6 +1,20 @@
 """Functions and classes for turning existing DICOM files into editable datasets
 and templates
 """
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Type
+
+import pydicom
+
+from dicomgenerator.logging import get_module_logger
+from dicomgenerator.parallel import GenerationProgress
+from dicomgenerator.persistence import BULK_DATA_THRESHOLD, JSONDataset
+
+logger = get_module_logger("tools")
 
 
 def dataset_to_json(dataset, replace_image_data=True, description="Converted"):
@@ -20,3 +34,200 @@ def to_annotated_dataset(
         "Removed after v0.9. Use pydicom 3 functions: "
         "https://pydicom.github.io/pydicom/stable/tutorials/dicom_json.html"
     )
+
+
+class PixelDataMode(Enum):
+    """What to do with pixel data and other large binary values when converting"""
+
+    INLINE = "inline"  # base64 in the json file
+    EXTERNAL = "external"  # raw sidecar files, see persistence.BulkDataWriter
+    DROP = "drop"  # leave out pixel data. Is not read at all
+
+
+CONVERTED = "converted"
+SKIPPED = "skipped"  # output is up to date
+FAILED = "failed"
+
+
+@dataclass(frozen=True)
+class ConversionTask:
+    """Convert a single DICOM file to a json template"""
+
+    source: Path
+    output: Path
+    pixel_data: PixelDataMode = PixelDataMode.EXTERNAL
+    json_dataset_class: Type[JSONDataset] = JSONDataset
+    bulk_data_threshold: int = BULK_DATA_THRESHOLD
+    force: bool = False
+
+
+@dataclass(frozen=True)
+class ConversionResult:
+    source: Path
+    output: Path
+    status: str  # CONVERTED, SKIPPED or FAILED
+    error: Optional[str] = None
+
+
+def is_up_to_date(source: Path, output: Path) -> bool:
+    """True if output exists and is not older than source"""
+    try:
+        return output.stat().st_mtime_ns >= source.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def read_for_conversion(
+    path: Path, pixel_data: PixelDataMode, bulk_data_threshold: int
+) -> pydicom.Dataset:
+    """Read DICOM file, reading as little pixel data as pixel_data mode allows
+
+    Externalized values are deferred: they are read from path only when they
+    are written to their sidecar file
+    """
+    if pixel_data == PixelDataMode.DROP:
+        return pydicom.dcmread(path, stop_before_pixels=True)
+    if pixel_data == PixelDataMode.EXTERNAL:
+        # base64 threshold to bytes, so values are not read to be written inline
+        return pydicom.dcmread(path, defer_size=(bulk_data_threshold // 4) * 3)
+    return pydicom.dcmread(path)
+
+
+def convert_file(task: ConversionTask) -> ConversionResult:
+    """Convert task.source to a json template. Runs inside a worker process
+
+    Does not raise exceptions. Failures are returned as a FAILED result
+    """
+    if not task.force and is_up_to_date(task.source, task.output):
+        return ConversionResult(task.source, task.output, SKIPPED)
+    try:
+        dataset = read_for_conversion(
+            task.source, task.pixel_data, task.bulk_data_threshold
+        )
+        json_dataset = task.json_dataset_class(dataset)
+        task.output.parent.mkdir(parents=True, exist_ok=True)
+        if task.pixel_data == PixelDataMode.INLINE:
+            with open(task.output, "w") as f:
+                json_dataset.save(f)
+        else:
+            json_dataset.save_to_path(
+                task.output, bulk_data_threshold=task.bulk_data_threshold
+            )
+    except Exception as e:
+        # a partial file would look up to date on the next run
+        task.output.unlink(missing_ok=True)
+        return ConversionResult(
+            task.source, task.output, FAILED, f"{type(e).__name__}: {e}"
+        )
+    return ConversionResult(task.source, task.output, CONVERTED)
+
+
+def template_path(source: Path, input_dir: Path, output_dir: Path) -> Path:
+    """Where to write the template for source. Mirrors the input tree
+
+    Only a '.dcm' extension is replaced. Files are often named after UIDs, where
+    everything after the first '.' is part of the name
+    """
+    relative = source.relative_to(input_dir)
+    name = relative.name
+    if relative.suffix.lower() == ".dcm":
+        name = relative.stem
+    return output_dir / relative.parent / f"{name}_template.json"
+
+
+def find_files(input_dir: Path, pattern: str = "*", exclude=None) -> Iterator[Path]:
+    """All files in input_dir and its subdirectories matching pattern, sorted.
+    Files in directory exclude are skipped
+    """
+    exclude = Path(exclude).resolve() if exclude else None
+    for path in sorted(input_dir.rglob(pattern)):
+        if not path.is_file():
+            continue
+        if exclude and path.resolve().is_relative_to(exclude):
+            continue
+        yield path
+
+
+def convert_tree(
+    input_dir,
+    output_dir,
+    pixel_data: PixelDataMode = PixelDataMode.EXTERNAL,
+    json_dataset_class: Type[JSONDataset] = JSONDataset,
+    pattern: str = "*",
+    workers: Optional[int] = None,
+    chunk_size: int = 16,
+    force: bool = False,
+    bulk_data_threshold: int = BULK_DATA_THRESHOLD,
+    progress: Optional[Callable[[GenerationProgress], None]] = None,
+) -> List[ConversionResult]:
+    """Convert all DICOM files in input_dir to json templates in output_dir,
+    spread over multiple processes
+
+    Parameters
+    ----------
+    input_dir:
+        Convert all files in this directory and its subdirectories
+    output_dir:
+        Write templates here, in the same directory structure as input_dir
+    pixel_data:
+        Write pixel data inline, to sidecar files, or not at all
+    json_dataset_class:
+        Convert to this class, for example AnnotatedDataset. Should be
+        importable from a module so worker processes can find it
+    pattern:
+        Only convert files matching this glob pattern
+    workers:
+        Number of worker processes. Defaults to number of CPUs. If 1, all work
+        is done in the current process
+    chunk_size:
+        Send this many files to a worker at a time
+    force:
+        Convert all files. By default, files whose template is newer than the
+        file itself are skipped
+    bulk_data_threshold:
+        Threshold for writing values to sidecar files, see
+        persistence.BULK_DATA_THRESHOLD
+    progress:
+        Called with current progress after each file
+
+    Returns
+    -------
+    List[ConversionResult]
+        One result for each file, in file order. A file that cannot be
+        converted does not stop the run, check results for FAILED
+    """
+    input_dir, output_dir = Path(input_dir), Path(output_dir)
+    tasks = [
+        ConversionTask(
+            source=source,
+            output=template_path(source, input_dir, output_dir),
+            pixel_data=pixel_data,
+            json_dataset_class=json_dataset_class,
+            bulk_data_threshold=bulk_data_threshold,
+            force=force,
+        )
+        for source in find_files(input_dir, pattern, exclude=output_dir)
+    ]
+    status = GenerationProgress(total=len(tasks))
+    results: List[ConversionResult] = []
+
+    def update(result: ConversionResult):
+        if result.status == FAILED:
+            logger.warning(f"Could not convert '{result.source}': {result.error}")
+        results.append(result)
+        status.done += 1
+        if progress:
+            progress(status)
+
+    workers = workers or os.cpu_count() or 1
+    logger.info(
+        f"Converting {len(tasks)} files in '{input_dir}' with {workers} workers"
+    )
+    if workers == 1:
+        for task in tasks:
+            update(convert_file(task))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(convert_file, tasks, chunksize=chunk_size):
+                update(result)
+    return results
@@ -0,0 +1,311 @@
+"""Pixel data for 3D volumes: long series of slices and multi-frame datasets
+
+Volumes are generated slab by slab (a few slices at a time), so memory use
+depends on slab size, not on the size of the whole volume.
+"""
+import secrets
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydicom import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence as DicomSequence
+from pydicom.uid import ExplicitVRLittleEndian
+
+from dicomgenerator.buffers import SeekableReader
+from dicomgenerator.caching import clone_file_dataset
+from dicomgenerator.pixeldata import PhotoMetricInterpretation, draw_noise
+from dicomgenerator.rng import get_rng
+
+
+@dataclass
+class SlicePosition:
+    """Where a slice is in patient space"""
+
+    image_position: List[float]  # ImagePositionPatient
+    location: float  # SliceLocation, distance along the slice normal
+
+
+def slice_positions(series: Dataset, count: int) -> List[SlicePosition]:
+    """Positions of count consecutive slices, starting at the position in series
+    and moving along the slice normal by SliceThickness each slice
+    """
+    origin = np.array(series.get("ImagePositionPatient", [0.0, 0.0, 0.0]), float)
+    orientation = series.get("ImageOrientationPatient", [1, 0, 0, 0, 1, 0])
+    normal = np.cross(
+        np.array(orientation[:3], float), np.array(orientation[3:], float)
+    )
+    spacing = float(series.get("SliceThickness", 1.0) or 1.0)
+    steps = np.arange(count)[:, np.newaxis] * spacing
+    return [
+        SlicePosition(
+            image_position=[round(x, 5) for x in position],
+            location=round(float(np.dot(position, normal)), 5),
+        )
+        for position in origin + steps * normal
+    ]
+
+
+class Volume:
+    """A stack of 2D slices that can be generated in parts
+
+    slab() should give the same values each time it is called, so that a
+    VolumeReader can generate a part again when it is read again
+    """
+
+    def __init__(self, slices: int, rows: int, columns: int, dtype: str = "uint16"):
+        self.slices = slices
+        self.rows = rows
+        self.columns = columns
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def slice_nbytes(self) -> int:
+        return self.rows * self.columns * self.dtype.itemsize
+
+    def slab(self, start: int, stop: int) -> np.ndarray:
+        """Pixel values for slices start up to stop, shape (stop-start, rows, cols)"""
+        raise NotImplementedError()
+
+    def iter_slabs(self, slab_size: int = 16) -> Iterator[Tuple[int, np.ndarray]]:
+        """(first slice index, slab) for consecutive slabs covering all slices"""
+        if slab_size < 1:
+            raise ValueError(f"slab_size should be 1 or more, got {slab_size}")
+        for start in range(0, self.slices, slab_size):
+            yield start, self.slab(start, min(start + slab_size, self.slices))
+
+
+class NoiseVolume(Volume):
+    """Random values. Each slice is the same regardless of slab size
+
+    Without seed, a seed is drawn once, from the active dicomgenerator.rng
+    context if there is one
+    """
+
+    def __init__(self, slices, rows, columns, dtype="uint16", seed=None):
+        super().__init__(slices, rows, columns, dtype)
+        if seed is None:
+            context = get_rng()
+            bits = context.getrandbits(64) if context else secrets.randbits(64)
+            seed = str(bits)
+        self.seed = seed
+
+    def slab(self, start, stop):
+        return draw_noise(
+            self.rows,
+            self.columns,
+            self.dtype.name,
+            seed=self.seed,
+            frames=stop - start,
+            frame=start,
+        )
+
+
+class PhantomVolume(Volume):
+    """Nested ellipsoids, somewhat like a simplified 3D Shepp-Logan phantom"""
+
+    # (center z, y, x), (radius z, y, x), intensity. In units of half volume size
+    ellipsoids = [
+        ((0.0, 0.0, 0.0), (0.9, 0.69, 0.92), 0.8),
+        ((0.0, -0.0184, 0.0), (0.88, 0.6624, 0.874), -0.6),
+        ((0.0, 0.0, 0.22), (0.41, 0.11, 0.31), 0.4),
+        ((0.0, 0.0, -0.22), (0.41, 0.16, 0.41), 0.4),
+        ((0.25, 0.35, 0.0), (0.21, 0.25, 0.21), 0.3),
+        ((-0.5, -0.1, 0.0), (0.1, 0.046, 0.046), 0.3),
+    ]
+
+    def slab(self, start, stop):
+        z = self._axis(self.slices)[start:stop, np.newaxis, np.newaxis]
+        y = self._axis(self.rows)[np.newaxis, :, np.newaxis]
+        x = self._axis(self.columns)[np.newaxis, np.newaxis, :]
+        values = np.zeros((stop - start, self.rows, self.columns), dtype=np.float32)
+        for (cz, cy, cx), (rz, ry, rx), intensity in self.ellipsoids:
+            inside = ((z - cz) / rz) ** 2 + ((y - cy) / ry) ** 2 + (
+                (x - cx) / rx
+            ) ** 2 <= 1
+            values[inside] += intensity
+        np.clip(values, 0, 1, out=values)
+        values *= np.iinfo(self.dtype).max
+        return values.astype(self.dtype)
+
+    @staticmethod
+    def _axis(size: int) -> np.ndarray:
+        return np.linspace(-1, 1, size, dtype=np.float32)
+
+
+class ImageStackVolume(Volume):
+    """Slices read from image files. Images are re-used if there are fewer images
+    than slices
+    """
+
+    def __init__(
+        self, image_paths: Sequence[Any], rows, columns, dtype="uint16", slices=None
+    ):
+        super().__init__(slices or len(image_paths), rows, columns, dtype)
+        self.image_paths = list(image_paths)
+
+    def slab(self, start, stop):
+        from PIL import Image
+
+        slab = np.empty((stop - start, self.rows, self.columns), dtype=self.dtype)
+        scale = np.iinfo(self.dtype).max / 255
+        for i, index in enumerate(range(start, stop)):
+            path = self.image_paths[index % len(self.image_paths)]
+            with Image.open(path) as image:
+                grey = image.convert("L").resize((self.columns, self.rows))
+                slab[i] = np.asarray(grey) * scale
+        return slab
+
+
+class VolumeReader(SeekableReader):
+    """All slices of a volume as one file-like value, generated while reading
+
+    Only the slab that is being read is kept in memory. Reading it all at once,
+    with getbuffer() or a single read(), generates the whole volume.
+    """
+
+    def __init__(self, volume: Volume, slab_size: int = 16):
+        if slab_size < 1:
+            raise ValueError(f"slab_size should be 1 or more, got {slab_size}")
+        super().__init__(volume.slices * volume.slice_nbytes)
+        self.volume = volume
+        self.slab_size = slab_size
+        self._slab_nbytes = slab_size * volume.slice_nbytes
+        self._slab_index: Optional[int] = None
+        self._slab = memoryview(b"")
+
+    def __reduce__(self):
+        return (
+            VolumeReader,
+            (self.volume, self.slab_size),
+            {"_position": self._position},
+        )
+
+    def __setstate__(self, state):
+        self._position = state["_position"]
+
+    def copy(self) -> "VolumeReader":
+        return VolumeReader(self.volume, self.slab_size)
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        # content is generated the same way each time, so sharing volume is fine
+        copied = self.copy()
+        copied._position = self._position
+        return copied
+
+    def getbuffer(self) -> Any:
+        return self.volume.slab(0, self.volume.slices)
+
+    def read_view(self, size=-1) -> memoryview:
+        part = self._advance(size)
+        chunks: List[Any] = []
+        position = part.start
+        while position < min(part.stop, self._size):
+            index, offset = divmod(position, self._slab_nbytes)
+            chunk = self._get_slab(index)[offset : offset + part.stop - position]
+            chunks.append(chunk)
+            position += len(chunk)
+        if part.start <= self._size < part.stop:
+            chunks.append(b"\0")  # virtual pad byte
+        if len(chunks) == 1:
+            return memoryview(chunks[0])
+        return memoryview(b"".join(chunks))
+
+    def _get_slab(self, index: int) -> memoryview:
+        if index != self._slab_index:
+            start = index * self.slab_size
+            stop = min(start + self.slab_size, self.volume.slices)
+            slab = np.ascontiguousarray(self.volume.slab(start, stop))
+            self._slab = memoryview(slab).cast("B")
+            self._slab_index = index
+        return self._slab
+
+
+def volume_series(
+    dataset: Dataset, volume: Volume, slab_size: int = 16
+) -> Iterator[Dataset]:
+    """Lazily generate one dataset per slice of volume, based on dataset
+
+    Each slice gets its own InstanceNumber, ImagePositionPatient and
+    SliceLocation, consistent with ImageOrientationPatient and SliceThickness in
+    dataset. Give each slice its own SOPInstanceUID before saving.
+    """
+    positions = slice_positions(dataset, volume.slices)
+    for start, slab in volume.iter_slabs(slab_size):
+        for i, pixels in enumerate(slab):
+            index = start + i
+            instance = clone_file_dataset(dataset)
+            instance.InstanceNumber = index + 1
+            instance.ImagePositionPatient = positions[index].image_position
+            instance.SliceLocation = positions[index].location
+            set_pixel_module(instance, volume, frames=1)
+            instance.PixelData = pixels.tobytes()
+            yield instance
+
+
+def set_pixel_module(dataset: Dataset, volume: Volume, frames: int):
+    """Set image pixel description elements for pixels from volume
+
+    Warning
+    -------
+    Modifies dataset.file_meta and sets TransferSyntaxUID, like add_pixel_data_2d
+    """
+    dataset.file_meta = FileMetaDataset()
+    dataset.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    num_bits = volume.dtype.itemsize * 8
+    dataset.BitsAllocated = num_bits
+    dataset.BitsStored = num_bits
+    dataset.HighBit = num_bits - 1
+    dataset.PixelRepresentation = 1 if volume.dtype.kind == "i" else 0
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = PhotoMetricInterpretation.MONOCHROME2.value
+    dataset.Rows = volume.rows
+    dataset.Columns = volume.columns
+    if frames > 1:
+        dataset.NumberOfFrames = frames
+    elif "NumberOfFrames" in dataset:
+        del dataset.NumberOfFrames
+
+
+def add_pixel_data_multiframe(
+    dataset: Dataset, volume: Volume, slab_size: int = 16
+) -> Dataset:
+    """Write all slices of volume into dataset as frames of a multi-frame image
+
+    Pixel data is a VolumeReader: frames are generated slab by slab while the
+    dataset is written, so memory use depends on slab_size, not on the size of
+    the volume. Frame positions are written to PerFrameFunctionalGroupsSequence,
+    orientation and spacing to SharedFunctionalGroupsSequence.
+    """
+    set_pixel_module(dataset, volume, frames=volume.slices)
+    dataset.PixelData = VolumeReader(volume, slab_size=slab_size)
+    dataset["PixelData"].VR = "OB" if volume.dtype.itemsize == 1 else "OW"
+
+    add_frame_positions(dataset, slice_positions(dataset, volume.slices))
+    return dataset
+
+
+def add_frame_positions(dataset: Dataset, positions: List[SlicePosition]):
+    """Describe frame geometry in functional groups, as multi-frame IODs do"""
+    shared = Dataset()
+    orientation = Dataset()
+    orientation.ImageOrientationPatient = dataset.get(
+        "ImageOrientationPatient", [1, 0, 0, 0, 1, 0]
+    )
+    measures = Dataset()
+    measures.PixelSpacing = dataset.get("PixelSpacing", [1, 1])
+    measures.SliceThickness = dataset.get("SliceThickness", 1)
+    shared.PlaneOrientationSequence = DicomSequence([orientation])
+    shared.PixelMeasuresSequence = DicomSequence([measures])
+    dataset.SharedFunctionalGroupsSequence = DicomSequence([shared])
+
+    per_frame = []
+    for position in positions:
+        plane = Dataset()
+        plane.ImagePositionPatient = position.image_position
+        frame = Dataset()
+        frame.PlanePositionSequence = DicomSequence([plane])
+        per_frame.append(frame)
+    dataset.PerFrameFunctionalGroupsSequence = DicomSequence(per_frame)
@@ -0,0 +1,332 @@
+"""Fast writing of many DICOM files that differ only in a few elements
+
+Saving a pydicom Dataset encodes every element each time. CompiledTemplate
+encodes all fixed elements of a dataset once, and only encodes the variable
+elements for each file that is written:
+
+>>> template = CompiledTemplate.compile(CTDatasetFactory())
+>>> template.write("/tmp/file1", SOPInstanceUID="1.2.3", PatientName="Test^One")
+"""
+import datetime
+import struct
+from io import BytesIO
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, List, Sequence, Union
+
+import pydicom
+from pydicom.charset import convert_encodings, encode_string
+from pydicom.datadict import dictionary_VR, tag_for_keyword
+from pydicom.dataelem import DataElement
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.filebase import DicomBytesIO
+from pydicom.filewriter import write_data_element
+from pydicom.tag import Tag
+from pydicom.uid import (
+    CTImageStorage,
+    ExplicitVRLittleEndian,
+    PYDICOM_IMPLEMENTATION_UID,
+)
+
+from dicomgenerator.buffers import as_buffer
+from dicomgenerator.exceptions import DICOMGeneratorError
+
+# Elements that typically differ between generated files
+VARIABLE_ELEMENTS = (
+    "SOPInstanceUID",
+    "StudyInstanceUID",
+    "SeriesInstanceUID",
+    "FrameOfReferenceUID",
+    "PatientName",
+    "PatientID",
+    "AccessionNumber",
+    "StudyDate",
+    "StudyTime",
+    "SeriesDate",
+    "ContentDate",
+    "InstanceNumber",
+    "PixelData",
+)
+
+# Explicit VR elements with these VRs have a 4-byte length field
+LONG_LENGTH_VRS = {
+    "OB",
+    "OD",
+    "OF",
+    "OL",
+    "OV",
+    "OW",
+    "SQ",
+    "SV",
+    "UC",
+    "UN",
+    "UR",
+    "UT",
+    "UV",
+}
+
+TEXT_VRS = {
+    "AE",
+    "AS",
+    "CS",
+    "DA",
+    "DS",
+    "DT",
+    "IS",
+    "LO",
+    "LT",
+    "PN",
+    "SH",
+    "ST",
+    "TM",
+    "UC",
+    "UI",
+    "UR",
+    "UT",
+}
+
+BYTES_VRS = {"OB", "OW", "UN"}
+
+PREAMBLE = b"\0" * 128
+MAGIC = b"DICM"
+
+
+class Slot:
+    """Place in a compiled byte layout that is filled in for each file"""
+
+    def __init__(self, keyword: str, tag: int, vr: str, default: Any):
+        self.keyword = keyword
+        self.tag = tag
+        self.vr = vr
+        self.default = default
+        group, element = tag >> 16, tag & 0xFFFF
+        self._tag_vr = struct.pack("<HH", group, element) + vr.encode()
+        self._pad = b"\0" if vr in ("UI", "OB", "OW", "UN") else b" "
+
+    def header(self, length: int) -> bytes:
+        """Tag, VR and length of this element
+
+        Raises
+        ------
+        ValueError
+            If length does not fit in the length field of this VR
+        """
+        long_length = self.vr in LONG_LENGTH_VRS
+        max_length = 0xFFFFFFFE if long_length else 0xFFFE
+        if length > max_length:
+            raise ValueError(
+                f"Value for {self.keyword} is {length} bytes, but VR {self.vr} "
+                f"allows at most {max_length} bytes"
+            )
+        if long_length:
+            return self._tag_vr + struct.pack("<HL", 0, length)
+        return self._tag_vr + struct.pack("<H", length)
+
+    def encode(self, value: Any, encodings: List[str]) -> List[Any]:
+        """Chunks to write for this element with value. Large buffers are not
+        copied
+        """
+        if self.vr in BYTES_VRS and not isinstance(value, str):
+            buffer = memoryview(as_buffer(value)).cast("B")
+            chunks: List[Any] = [self.header(len(buffer) + len(buffer) % 2), buffer]
+            if len(buffer) % 2:
+                chunks.append(b"\0")
+            return chunks
+        if self.vr in TEXT_VRS:
+            if isinstance(value, (list, tuple)):
+                text = "\\".join(format_text(x) for x in value)
+            else:
+                text = format_text(value)
+            encoded = encode_string(text, encodings)
+            if len(encoded) % 2:
+                encoded += self._pad
+            return [self.header(len(encoded)), encoded]
+
+        # Anything else is rare enough to let pydicom handle it
+        fp = new_buffer()
+        write_data_element(fp, DataElement(self.tag, self.vr, value), encodings)
+        return [fp.getvalue()]
+
+
+def format_text(value: Any) -> str:
+    """Value of a text VR element as string, formatting dates and times the
+    way pydicom's filewriter does
+    """
+    if not isinstance(value, (datetime.date, datetime.time)):
+        return str(value)
+    original = getattr(value, "original_string", None)  # pydicom DA, DT or TM
+    if original:
+        return str(original)
+    if isinstance(value, datetime.datetime):  # before date, datetime is a date
+        fraction = ".%f" if value.microsecond > 0 else ""
+        return value.strftime(f"%Y%m%d%H%M%S{fraction}%z")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y%m%d")
+    return value.strftime("%H%M%S.%f" if value.microsecond > 0 else "%H%M%S")
+
+
+def new_buffer() -> DicomBytesIO:
+    fp = DicomBytesIO()
+    fp.is_little_endian = True
+    fp.is_implicit_VR = False
+    return fp
+
+
+class Layout:
+    """Pre-encoded bytes interleaved with slots, in tag order"""
+
+    def __init__(self, parts: List[Union[bytes, Slot]]):
+        self.parts = parts
+
+    @classmethod
+    def compile(
+        cls, dataset: Dataset, slots: Dict[int, Slot], encodings: List[str]
+    ) -> "Layout":
+        tags = sorted(set(dataset.keys()) | set(slots))
+        parts: List[Union[bytes, Slot]] = []
+        fp = new_buffer()
+        for tag in tags:
+            if tag in slots:
+                parts.append(fp.getvalue())
+                parts.append(slots[tag])
+                fp = new_buffer()
+            else:
+                write_data_element(fp, dataset[tag], encodings)
+        parts.append(fp.getvalue())
+        return cls([x for x in parts if x != b""])
+
+    def chunks(self, values: Dict[str, Any], encodings: List[str]) -> List[Any]:
+        chunks: List[Any] = []
+        for part in self.parts:
+            if isinstance(part, Slot):
+                value = values.get(part.keyword, part.default)
+                if value is not None:
+                    chunks.extend(part.encode(value, encodings))
+            else:
+                chunks.append(part)
+        return chunks
+
+
+class CompiledTemplate:
+    """A dataset pre-encoded as explicit VR little endian bytes, with slots for
+    elements that change per written file
+    """
+
+    def __init__(self, meta: Layout, body: Layout, encodings: List[str]):
+        self.meta = meta
+        self.body = body
+        self.encodings = encodings
+
+    @classmethod
+    def compile(
+        cls, dataset: Dataset, variable: Iterable[str] = VARIABLE_ELEMENTS
+    ) -> "CompiledTemplate":
+        """Encode dataset, leaving slots for the elements in variable
+
+        Parameters
+        ----------
+        dataset:
+            Encode this dataset. Any file_meta in dataset is ignored
+        variable:
+            Keywords of elements that can be given a new value for each write.
+            If dataset has a value for these, that value is used when no new
+            value is given
+
+        Raises
+        ------
+        ValueError
+            If any variable keyword is not a valid DICOM keyword
+        """
+        encodings = convert_encodings(dataset.get("SpecificCharacterSet"))
+        slots: Dict[int, Slot] = {}
+        for keyword in variable:
+            tag = tag_for_keyword(keyword)
+            if tag is None:
+                raise ValueError(f"Unknown DICOM keyword '{keyword}'")
+            element = dataset[tag] if tag in dataset else None
+            vr = element.VR if element is not None else dictionary_VR(tag)
+            default = element.value if element is not None else None
+            if keyword == "PixelData" and vr not in BYTES_VRS:
+                vr = "OW"
+            slots[tag] = Slot(keyword, tag, vr, default)
+        body = Layout.compile(dataset, slots, encodings)
+
+        sop_instance_uid = slots.get(Tag("SOPInstanceUID"))
+        meta_slots: Dict[int, Slot] = {}
+        if sop_instance_uid:
+            media_tag = Tag("MediaStorageSOPInstanceUID")
+            meta_slots[media_tag] = Slot(
+                "SOPInstanceUID", media_tag, "UI", sop_instance_uid.default
+            )
+        meta = Layout.compile(cls.file_meta(dataset), meta_slots, encodings)
+        return cls(meta=meta, body=body, encodings=encodings)
+
+    @staticmethod
+    def file_meta(dataset: Dataset) -> FileMetaDataset:
+        """File meta information for writing dataset, like export.force_make_savable
+        but always explicit VR little endian
+        """
+        meta = FileMetaDataset()
+        meta.FileMetaInformationVersion = b"\x00\x01"
+        meta.MediaStorageSOPClassUID = dataset.get("SOPClassUID", CTImageStorage)
+        meta.MediaStorageSOPInstanceUID = dataset.get("SOPInstanceUID", "")
+        meta.TransferSyntaxUID = ExplicitVRLittleEndian
+        meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+        meta.ImplementationVersionName = f"PYDICOM {pydicom.__version__}"
+        return meta
+
+    @property
+    def variable(self) -> Sequence[str]:
+        """Keywords of elements that can be set for each write"""
+        return [x.keyword for x in self.body.parts if isinstance(x, Slot)]
+
+    def chunks(self, values: Dict[str, Any]) -> List[Any]:
+        """All chunks of bytes that make up a DICOM file with values filled in"""
+        unknown = set(values) - set(self.variable)
+        if unknown:
+            raise CompiledTemplateError(
+                f"{sorted(unknown)} are not variable in this template. "
+                f"Variable elements are {self.variable}"
+            )
+        meta = self.meta.chunks(values, self.encodings)
+        group_length = sum(len(memoryview(x).cast("B")) for x in meta)
+        return [
+            PREAMBLE,
+            MAGIC,
+            struct.pack("<HH2sHL", 2, 0, b"UL", 4, group_length),
+            *meta,
+            *self.body.chunks(values, self.encodings),
+        ]
+
+    def write_to(self, fp: BinaryIO, **values) -> int:
+        """Write DICOM file with given element values to file-like fp
+
+        Returns
+        -------
+        int
+            Number of bytes written
+        """
+        written = 0
+        for chunk in self.chunks(values):
+            written += fp.write(chunk)
+        return written
+
+    def write(self, path: Union[str, Path], **values) -> int:
+        """Write DICOM file with given element values to path
+
+        Returns
+        -------
+        int
+            Number of bytes written
+        """
+        with open(path, "wb") as f:
+            return self.write_to(f, **values)
+
+    def encode(self, **values) -> bytes:
+        """DICOM file with given element values, as bytes"""
+        fp = BytesIO()
+        self.write_to(fp, **values)
+        return fp.getvalue()
+
+
+class CompiledTemplateError(DICOMGeneratorError):
+    pass
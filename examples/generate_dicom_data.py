@@ -2,6 +2,8 @@ import uuid
 from pathlib import Path
 
 from dicomgenerator.export import export
+from dicomgenerator.hierarchy import HierarchyShape, generate_hierarchy
+from dicomgenerator.parallel import generate_corpus
 from dicomgenerator.templates import CTDatasetFactory
 
 """Generate some CT-like DICOM files """
@@ -55,6 +57,27 @@ def generate_dicom_structure(structure, output_dir):
     print(f"Wrote {count} files to {output_dir}")
 
 
+def generate_random_structure(output_dir):
+    """10 patients with 1-3 studies of 2 series of 50 slices each"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    shape = HierarchyShape(
+        patients=10, studies=lambda rng: rng.randint(1, 3), series=2, instances=50
+    )
+    for dataset in generate_hierarchy(shape):
+        export(dataset=dataset, path=output_dir / str(uuid.uuid4()))
+
+
+def generate_large_corpus(output_dir, count=10000):
+    """Use all CPU cores. Same seed gives the same files, for any number of cores"""
+    generate_corpus(
+        output_dir,
+        count=count,
+        seed="corpus1",
+        progress=lambda p: print(f"{p.done}/{p.total} files"),
+    )
+
+
 structure = {
     "patient1": {"11111.1": ["2222.1", "2222.2"], "11111.2": ["2222.1"]},
     "patient2": {"11111.1": ["2222.1"], "11111.2": ["2222.1", "2222.2", "2222.3"]},
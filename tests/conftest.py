@@ -1,3 +1,4 @@
+import os
 import shutil
 
 import pytest
@@ -6,6 +7,12 @@ import pydicom
 from tests import RESOURCE_PATH
 
 
+@pytest.fixture(autouse=True, scope="session")
+def a_template_cache_dir(tmp_path_factory):
+    """Write compiled templates to a temporary directory, not the user cache"""
+    os.environ["DICOMGENERATOR_CACHE_DIR"] = str(tmp_path_factory.mktemp("cache"))
+
+
 @pytest.fixture()
 def a_dataset_path(tmp_path):
     """Path to a copy of a valid DICOM dataset"""
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+from pydicom import dcmread
+
+from dicomgenerator.async_export import (
+    AsyncExportError,
+    AsyncExportSink,
+    export_all,
+)
+from dicomgenerator.templates import CTDatasetFactory
+from dicomgenerator.uid import UIDAllocator, use_uid_allocator
+
+
+@pytest.mark.parametrize("fsync_batch", [0, 3])
+def test_export_all(tmp_path, fsync_batch):
+    items = (
+        (CTDatasetFactory(InstanceNumber=index), tmp_path / f"{index}.dcm")
+        for index in range(7)
+    )
+    progress = export_all(items, writers=3, queue_size=2, fsync_batch=fsync_batch)
+
+    assert progress.done == 7
+    assert progress.bytes_written == sum(x.stat().st_size for x in tmp_path.iterdir())
+    # all temporary files should have been renamed
+    assert sorted(x.name for x in tmp_path.iterdir()) == [f"{i}.dcm" for i in range(7)]
+    assert dcmread(tmp_path / "5.dcm").InstanceNumber == 5
+
+
+def test_export_all_context(tmp_path):
+    """Context like use_uid_allocator() should apply to generation"""
+    allocator = UIDAllocator(seed="a seed")
+    with use_uid_allocator(allocator):
+        items = ((CTDatasetFactory(), tmp_path / f"{i}.dcm") for i in range(3))
+        export_all(items)
+    uids = [dcmread(x).SOPInstanceUID for x in tmp_path.glob("*.dcm")]
+    assert len(uids) == 3
+    assert all(x.startswith(allocator.prefix) for x in uids)
+
+
+def test_backpressure(tmp_path):
+    """When writing is slow, put() should wait instead of queueing everything"""
+
+    class SlowSink(AsyncExportSink):
+        def write(self, dataset, path):
+            time.sleep(0.01)
+            return 0
+
+    async def produce():
+        queued = []
+        async with SlowSink(writers=1, queue_size=2) as sink:
+            for index in range(10):
+                await sink.put(CTDatasetFactory(), tmp_path / f"{index}.dcm")
+                queued.append(sink._queue.qsize())
+        return queued, sink.progress.done
+
+    queued, done = asyncio.run(produce())
+    assert max(queued) <= 2
+    assert done == 10
+
+
+def test_write_error(tmp_path):
+    async def produce():
+        async with AsyncExportSink(writers=2) as sink:
+            for index in range(5):
+                await sink.put(CTDatasetFactory(), tmp_path / "missing" / f"{index}")
+                await asyncio.sleep(0.01)
+
+    with pytest.raises(AsyncExportError):
+        asyncio.run(produce())
+
+    with pytest.raises(AsyncExportError):
+        asyncio.run(AsyncExportSink().put(CTDatasetFactory(), tmp_path / "a"))
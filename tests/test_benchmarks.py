@@ -0,0 +1,33 @@
+from click.testing import CliRunner
+
+from benchmarks.__main__ import main
+from benchmarks.runner import Result, find_regressions, save_results
+
+
+def test_find_regressions():
+    baseline = {"a": Result(1.0, 1.0, 1), "b": Result(1.0, 1.0, 1)}
+    current = {"a": Result(1.1, 1.1, 1), "b": Result(1.5, 1.5, 1), "c": Result(9, 9, 1)}
+    regressions = find_regressions(baseline, current, threshold=0.2)
+    assert [x.name for x in regressions] == ["b"]
+    assert regressions[0].ratio == 1.5
+
+
+def test_run_and_compare(tmp_path):
+    runner = CliRunner()
+    output = tmp_path / "baseline.json"
+    result = runner.invoke(
+        main,
+        ["run", "-k", "draw_noise_uint16[64]", "--repeat", "1", "--min-time", "0"]
+        + ["-o", str(output)],
+    )
+    assert result.exit_code == 0, result.output
+    assert "draw_noise_uint16[64]" in result.output
+
+    result = runner.invoke(main, ["compare", str(output), str(output)])
+    assert result.exit_code == 0
+
+    slower = tmp_path / "slower.json"
+    save_results({"draw_noise_uint16[64]": Result(1.0, 1.0, 1)}, slower)
+    result = runner.invoke(main, ["compare", str(output), str(slower)])
+    assert result.exit_code == 1
+    assert "1 regressions" in result.output
@@ -0,0 +1,74 @@
+import shutil
+
+import pydicom
+import pytest
+
+from dicomgenerator.caching import load_json_template
+from dicomgenerator.binary_templates import (
+    BinaryTemplateError,
+    compile_template,
+    binary_template_path,
+    ensure_compiled,
+    load_template,
+)
+from dicomgenerator.export import export
+from dicomgenerator.persistence import JSONDataset
+from dicomgenerator.resources import TEMPLATE_PATH
+from tests import RESOURCE_PATH
+
+
+@pytest.fixture
+def a_template_path(tmp_path):
+    path = tmp_path / "template.json"
+    shutil.copy(TEMPLATE_PATH / "ct_toshiba_aquilion.json", path)
+    return path
+
+
+def test_compile_template(a_template_path, tmp_path):
+    cache_dir = tmp_path / "cache"
+    path = compile_template(a_template_path, cache_dir=cache_dir)
+    assert path == binary_template_path(a_template_path, cache_dir=cache_dir)
+    assert path.parent == cache_dir
+
+    compiled = load_template(a_template_path, cache_dir=cache_dir)
+    expected = load_json_template(a_template_path)
+    assert compiled.PatientID == expected.PatientID
+    assert len(compiled) == len(expected)
+
+    # written files should be the same, also for values that encoding changes
+    export(compiled, path=tmp_path / "compiled.dcm")
+    export(expected, path=tmp_path / "expected.dcm")
+    assert (tmp_path / "compiled.dcm").read_bytes() == (
+        tmp_path / "expected.dcm"
+    ).read_bytes()
+    assert compiled.ReferringPhysicianName == expected.ReferringPhysicianName == " "
+    for element in expected:
+        assert compiled[element.tag] == element
+
+
+def test_compiled_template_invalidation(a_template_path, tmp_path):
+    cache_dir = tmp_path / "cache"
+    assert load_template(a_template_path, cache_dir).PatientID == "3100910591"
+    path = ensure_compiled(a_template_path, cache_dir)
+    assert ensure_compiled(a_template_path, cache_dir) == path
+
+    # changed json should be used instead of the outdated compiled version
+    content = a_template_path.read_text().replace("3100910591", "5551234")
+    a_template_path.write_text(content)
+    assert load_template(a_template_path, cache_dir).PatientID == "5551234"
+    ensure_compiled(a_template_path, cache_dir)
+    assert load_template(a_template_path, cache_dir).PatientID == "5551234"
+
+    path.write_bytes(b"broken")
+    assert load_template(a_template_path, cache_dir).PatientID == "5551234"
+
+
+def test_compile_bulk_data_template(tmp_path):
+    path = tmp_path / "template.json"
+    dataset = pydicom.dcmread(RESOURCE_PATH / "dcmfile1")
+    JSONDataset(dataset).save_to_path(path, bulk_data_threshold=1024)
+
+    with pytest.raises(BinaryTemplateError):
+        compile_template(path, cache_dir=tmp_path)
+    assert ensure_compiled(path, cache_dir=tmp_path) is None
+    assert load_template(path, cache_dir=tmp_path)["PixelData"] == dataset["PixelData"]
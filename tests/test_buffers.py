@@ -0,0 +1,48 @@
+import copy
+import mmap
+import os
+import pickle
+
+import numpy as np
+
+from dicomgenerator.buffers import BufferReader
+
+
+def test_buffer_reader():
+    reader = BufferReader(b"\x01\x02\x03")
+    assert len(reader) == 4  # padded to even length
+    assert reader.read(2) == b"\x01\x02"
+    assert reader.read() == b"\x03\x00"
+    assert reader.read() == b""
+
+    reader.seek(0)
+    assert b"".join(reader.iter_views(chunk_size=3)) == b"\x01\x02\x03\x00"
+    assert reader.seek(0, os.SEEK_END) == 4
+
+    assert len(BufferReader(b"\x01\x02\x03", pad_to_even=False)) == 3
+
+
+def test_buffer_reader_no_copy():
+    array = np.zeros(10, dtype=np.uint16)
+    reader = BufferReader(array)
+    array[0] = 0xFFFF  # changes should be visible through the reader
+    assert reader.read(2) == b"\xff\xff"
+
+
+def test_buffer_reader_copies(tmp_path):
+    path = tmp_path / "data"
+    path.write_bytes(b"\x01\x02\x03")
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    reader = BufferReader(mapped)
+    reader.read(1)
+
+    # copies have their own position, deep copies and pickles their own data
+    assert copy.copy(reader).read() == b"\x01\x02\x03\x00"
+    assert copy.deepcopy(reader).read() == b"\x02\x03\x00"
+    assert pickle.loads(pickle.dumps(reader)).read() == b"\x02\x03\x00"
+
+    writable = BufferReader(bytearray(b"\x01\x02"))
+    copied = copy.deepcopy(writable)
+    copied.buffer[0] = 7
+    assert writable.read() == b"\x01\x02"
@@ -0,0 +1,97 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pydicom
+import pytest
+
+from dicomgenerator.caching import (
+    LRUCache,
+    TemplateCache,
+    clone_dataset,
+    load_json_template,
+)
+from dicomgenerator.export import export
+from dicomgenerator.metrics import collect_metrics
+from dicomgenerator.persistence import JSONDataset
+from dicomgenerator.resources import TEMPLATE_PATH
+from dicomgenerator.templates import CTDatasetFactory
+
+
+@pytest.fixture
+def a_template_path(tmp_path):
+    """Path to a copy of a json template"""
+    path = tmp_path / "template.json"
+    shutil.copy(TEMPLATE_PATH / "ct_toshiba_aquilion.json", path)
+    return path
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # makes 'b' least recently used
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert len(cache) == 2
+    assert cache.get_or_create("d", lambda: 4) == 4
+
+
+def test_clone_dataset(a_dataset):
+    clone = clone_dataset(a_dataset)
+    assert clone == a_dataset
+
+    # modifying the clone should leave the original alone
+    clone.PatientName = "Changed"
+    clone.ImageType[0] = "Changed"
+    assert a_dataset.PatientName != "Changed"
+    assert a_dataset.ImageType[0] != "Changed"
+
+
+def test_clone_buffered_values(a_dataset, tmp_path):
+    """Clones of a template with sidecar files should be writable in parallel"""
+    path = tmp_path / "template.json"
+    JSONDataset(a_dataset).save_to_path(path, bulk_data_threshold=1024)
+    cache = TemplateCache(loader=load_json_template)
+    clones = [cache.get(path) for _ in range(32)]
+    assert clones[0].PixelData is not clones[1].PixelData
+
+    def write(index):
+        export(clones[index], path=tmp_path / f"{index}.dcm")
+        return pydicom.dcmread(tmp_path / f"{index}.dcm").PixelData
+
+    with ThreadPoolExecutor(8) as executor:
+        written = list(executor.map(write, range(32)))
+    assert all(x == a_dataset.PixelData for x in written)
+
+
+def test_template_cache(a_template_path):
+    cache = TemplateCache(maxsize=2)
+    with collect_metrics() as sink:
+        first = cache.get(a_template_path)
+        first.PatientID = "changed"
+        second = cache.get(a_template_path)
+    assert second.PatientID != "changed"
+    assert len(cache) == 1
+    assert sink.counters["template.loads"] == 1
+
+    # editing the template on disk should be picked up
+    content = a_template_path.read_text().replace("3100910591", "5551234")
+    a_template_path.write_text(content)
+    stat = os.stat(a_template_path)
+    os.utime(a_template_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(a_template_path).PatientName == "5551234"
+
+    cache.invalidate(a_template_path)
+    assert len(cache) == 0
+    cache.warm(a_template_path)
+    assert len(cache) == 1
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_factory_uses_copies():
+    """Factory results should never share state with each other"""
+    one = CTDatasetFactory()
+    one.ImageType[0] = "Changed"
+    assert CTDatasetFactory().ImageType[0] != "Changed"
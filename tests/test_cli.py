@@ -0,0 +1,94 @@
+import random
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from pydicom import dcmread
+
+from dicomgenerator.cli import CountRange, PixelSpec, main
+
+
+@pytest.fixture()
+def runner():
+    return CliRunner()
+
+
+def test_generate_count(runner, tmp_path):
+    result = runner.invoke(
+        main,
+        ["generate", str(tmp_path), "-n", "3", "--seed", "cli", "-w", "1"]
+        + ["--pixels", "noise:8x10:uint16"],
+    )
+    assert result.exit_code == 0, result.output
+    assert "Generated 3 files" in result.output
+    files = sorted(tmp_path.iterdir())
+    assert len(files) == 3
+    assert dcmread(files[0]).pixel_array.shape == (8, 10)
+
+
+def test_generate_hierarchy(runner, tmp_path):
+    result = runner.invoke(
+        main,
+        ["generate", str(tmp_path), "--patients", "2", "--studies", "1-2"]
+        + ["--instances", "3", "--seed", "cli", "--compress"],
+    )
+    assert result.exit_code == 0, result.output
+    datasets = [dcmread(x) for x in sorted(tmp_path.iterdir())]
+    assert len({x.PatientID for x in datasets}) == 2
+    assert len(datasets) in (6, 9, 12)
+
+    # same seed, same files
+    again = tmp_path.parent / "again"
+    runner.invoke(
+        main,
+        ["generate", str(again), "--patients", "2", "--studies", "1-2"]
+        + ["--instances", "3", "--seed", "cli", "--compress"],
+    )
+    for path in tmp_path.iterdir():
+        assert path.read_bytes() == (again / path.name).read_bytes()
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        ["-n", "1", "--template", "NotAFactory"],
+        ["-n", "1", "--pixels", "noise:8:uint16"],
+        ["--patients", "3-1"],
+        ["-n", "1", "--patients", "2"],
+        [],
+    ],
+)
+def test_generate_invalid(runner, tmp_path, arguments):
+    result = runner.invoke(main, ["generate", str(tmp_path)] + arguments)
+    assert result.exit_code == 2
+
+
+def test_pixel_spec():
+    spec = PixelSpec.parse("blank:4x6:uint8")
+    assert spec(0).shape == (4, 6)
+    assert spec(0).dtype == np.uint8
+    noise = PixelSpec.parse("noise:4x6:uint8", seed="a")
+    assert np.array_equal(noise(1), noise(1))
+    assert 2 <= CountRange(2, 4)(random.Random(0)) <= 4
+
+
+def test_convert(runner, a_dataset_path, tmp_path):
+    output_dir = tmp_path / "templates"
+    arguments = ["convert", str(a_dataset_path.parent), str(output_dir), "-w", "1"]
+    result = runner.invoke(main, arguments)
+    assert result.exit_code == 0, result.output
+    assert "Converted 1, skipped 0 up to date, failed 0 files" in result.output
+    assert (output_dir / "dcmfile1_template.json").exists()
+
+    (a_dataset_path.parent / "broken").write_text("not DICOM")
+    result = runner.invoke(main, arguments)
+    assert result.exit_code == 1
+    assert "Converted 0, skipped 1 up to date, failed 1 files" in result.output
+
+
+def test_compile(runner, tmp_path):
+    template = tmp_path / "template.json"
+    template.write_text('{"00100020": {"vr": "LO", "Value": ["123"]}}')
+    result = runner.invoke(main, ["compile", str(template)])
+    assert result.exit_code == 0, result.output
+    assert "Compiled" in result.output
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from pydicom import dcmread
+from pydicom.uid import RLELossless
+
+from dicomgenerator import compression
+from dicomgenerator.compression import CompressionError, compress_pixel_data
+from dicomgenerator.export import export
+from dicomgenerator.metrics import collect_metrics
+from dicomgenerator.generators import quick_dataset
+from dicomgenerator.pixeldata import add_blocks_array, add_pixel_data_2d, draw_noise
+from dicomgenerator.volume import PhantomVolume, add_pixel_data_multiframe
+
+
+@pytest.fixture()
+def a_pixel_dataset():
+    ds = quick_dataset(PatientID="TestPatient", SOPInstanceUID="1.2.3")
+    pixels = draw_noise(21, 31, "uint16", seed="compression")
+    return with_file_meta(add_pixel_data_2d(ds, pixel_array=pixels, dtype="uint16"))
+
+
+def with_file_meta(ds):
+    """add_pixel_data_2d sets file_meta, but not all elements needed for saving"""
+    ds.file_meta.MediaStorageSOPClassUID = "1.2.3"
+    ds.file_meta.MediaStorageSOPInstanceUID = "4.5.6"
+    return ds
+
+
+def test_export_compressed(a_pixel_dataset, tmp_path):
+    original = a_pixel_dataset.PixelData
+    export(a_pixel_dataset, tmp_path / "compressed", compress=True)
+    export(a_pixel_dataset, tmp_path / "uncompressed")
+
+    # exporting compressed should not affect the dataset itself
+    assert a_pixel_dataset.PixelData is original
+
+    compressed = dcmread(tmp_path / "compressed")
+    uncompressed = dcmread(tmp_path / "uncompressed")
+    assert compressed.file_meta.TransferSyntaxUID == RLELossless
+    assert np.array_equal(compressed.pixel_array, uncompressed.pixel_array)
+
+
+def test_add_blocks_compressed(a_pixel_dataset):
+    """Painting into compressed pixel data would corrupt it"""
+    compressed = compress_pixel_data(a_pixel_dataset)
+    with pytest.raises(ValueError, match="compressed"):
+        add_blocks_array(compressed, [(0, 0, 2, 2)], value=1)
+
+
+def test_compress_identical_frames(tmp_path):
+    """Identical frames should only be encoded once, in a worker pool if given"""
+    ds = quick_dataset(PatientID="TestPatient", SOPInstanceUID="1.2.3")
+    volume = PhantomVolume(4, 16, 16)  # first and last frames are empty
+    ds = with_file_meta(add_pixel_data_multiframe(ds, volume))
+
+    with patch.object(
+        compression, "encode_rle_frame", wraps=compression.encode_rle_frame
+    ) as encode:
+        with ThreadPoolExecutor(2) as executor, collect_metrics() as sink:
+            compress_pixel_data(ds, executor=executor)
+        assert encode.call_count == 3
+        assert sink.counters["compression.reused_frames"] == 1
+
+    ds.save_as(tmp_path / "multiframe", enforce_file_format=True)
+    assert np.array_equal(
+        dcmread(tmp_path / "multiframe").pixel_array, volume.slab(0, 4)
+    )
+
+    with pytest.raises(CompressionError):
+        compress_pixel_data(ds)
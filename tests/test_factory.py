@@ -1,10 +1,17 @@
 #!/usr/bin/env python
 import pytest
 from pydicom.dataelem import DataElement
+from pydicom.dataset import Dataset
 from pydicom.tag import BaseTag, Tag
 
+from dicomgenerator.binary_templates import load_template
 from dicomgenerator.dicom import VRs
-from dicomgenerator.generators import DataElementFactory
+from dicomgenerator.generators import (
+    DataElementFactory,
+    ElementPlan,
+    get_faker,
+)
+from dicomgenerator.resources import TEMPLATE_PATH
 from dicomgenerator.templates import CTDatasetFactory
 from factory import random
 
@@ -22,6 +29,22 @@ def test_factory():
     assert CTDatasetFactory(AccessionNumber="1234").AccessionNumber == "1234"
 
 
+class DatasetSubclass(Dataset):
+    pass
+
+
+class SubclassFactory(CTDatasetFactory):
+    class Meta:
+        model = DatasetSubclass
+
+
+def test_factory_model_subclass():
+    """Datasets should be instances of Meta.model"""
+    assert isinstance(SubclassFactory(), DatasetSubclass)
+    assert all(isinstance(x, DatasetSubclass) for x in SubclassFactory.iter_batch(2))
+    assert SubclassFactory(PatientID="123").PatientID == "123"
+
+
 def test_factory_random(fix_random_seed):
     """Test reproducibility of randomized tests
 
@@ -76,6 +99,97 @@ def test_data_element_factory_init():
 
 
 def test_data_element_factory_exceptions(fix_random_seed):
-
     with pytest.raises(ValueError):
         DataElementFactory(tag="unknown_tag")
+
+
+def test_iter_batch():
+    """Datasets should be generated lazily, with per-item values"""
+    batch = CTDatasetFactory.iter_batch(
+        3,
+        per_item={
+            "InstanceNumber": range(1, 4),
+            "PatientID": lambda i: f"patient{i}",
+        },
+        Modality="MR",
+    )
+    assert not isinstance(batch, list)
+
+    datasets = list(batch)
+    assert [x.InstanceNumber for x in datasets] == [1, 2, 3]
+    assert [x.PatientID for x in datasets] == ["patient0", "patient1", "patient2"]
+    assert all(x.Modality == "MR" for x in datasets)
+    assert datasets[0].SOPInstanceUID != datasets[1].SOPInstanceUID
+
+
+def test_iter_batch_same_as_create():
+    """Work shared between items should not change the generated datasets"""
+    per_item = {"InstanceNumber": range(1, 4)}
+    random.reseed_random("batch")
+    batch = list(CTDatasetFactory.iter_batch(3, per_item=per_item, Modality="MR"))
+    random.reseed_random("batch")
+    created = [
+        CTDatasetFactory(InstanceNumber=i, Modality="MR")
+        for i in per_item["InstanceNumber"]
+    ]
+
+    assert [x.to_json_dict() for x in batch] == [x.to_json_dict() for x in created]
+    assert len({x.SOPInstanceUID for x in batch}) == 3
+    # items should not share mutable values
+    batch[0].ProcedureCodeSequence[0].CodeValue = "changed"
+    assert batch[1].ProcedureCodeSequence[0].CodeValue != "changed"
+
+
+def test_iter_batch_exceptions():
+    with pytest.raises(ValueError):
+        list(CTDatasetFactory.iter_batch(3, per_item={"InstanceNumber": [1, 2]}))
+
+    with pytest.raises(TypeError):
+        list(CTDatasetFactory.iter_batch(3, per_item={"PatientID": "constant"}))
+
+
+def test_data_element_factory_unknown_vr():
+    with pytest.raises(ValueError):
+        DataElementFactory(tag="PatientName", VR="XX")
+
+
+def test_get_faker():
+    """Faker instances are expensive. They should be re-used"""
+    assert get_faker() is get_faker()
+    assert get_faker("nl_NL") is not get_faker()
+    assert get_faker().dicom_ui()
+
+
+def test_element_plan():
+    """A plan should generate the same elements as DataElementFactory"""
+    tags = ["PatientName", 0x00080020, "AcquisitionTime", "Rows", (0xEE30, 0xF120)]
+    random.reseed_random("plan")
+    expected = [DataElementFactory(tag=x) for x in tags]
+    random.reseed_random("plan")
+    plan = ElementPlan(tags)
+    assert len(plan) == 5
+    assert plan.elements() == expected
+
+    dataset = plan.dataset()
+    assert list(dataset.keys()) == [x.tag for x in expected]
+    assert dataset.PatientName != expected[0].value  # new values each call
+    assert len(list(plan.iter_datasets(3))) == 3
+
+
+def test_element_plan_vrs():
+    plan = ElementPlan(["PatientName", "Rows"], vrs={"Rows": "SS"})
+    assert [x.VR for x in plan.elements()] == ["PN", "SS"]
+
+    with pytest.raises(ValueError):
+        ElementPlan(["unknown_tag"])
+    with pytest.raises(ValueError):
+        ElementPlan(["PatientName"], vrs={"PatientName": "XX"})
+
+
+def test_element_plan_from_template():
+    path = TEMPLATE_PATH / "ct_toshiba_aquilion.json"
+    plan = ElementPlan.from_template(path)
+    template = load_template(path)
+    dataset = plan.dataset()
+    assert list(dataset.keys()) == list(template.keys())
+    assert dataset["PixelData"].VR == template["PixelData"].VR
@@ -0,0 +1,46 @@
+from collections import Counter
+
+from dicomgenerator.hierarchy import (
+    HierarchyShape,
+    generate_hierarchy,
+    patient_attributes,
+)
+from dicomgenerator.pixeldata import draw_noise
+from dicomgenerator.rng import RNGContext, use_rng
+
+
+def test_generate_hierarchy():
+    shape = HierarchyShape(patients=2, studies=2, series=lambda rng: 1, instances=3)
+    datasets = list(generate_hierarchy(shape))
+    assert len(datasets) == 12
+
+    assert len({x.PatientID for x in datasets}) == 2
+    assert len({x.StudyInstanceUID for x in datasets}) == 4
+    assert len({x.SOPInstanceUID for x in datasets}) == 12
+
+    # all instances in a series share upper level attributes
+    for series_uid, count in Counter(x.SeriesInstanceUID for x in datasets).items():
+        assert count == 3
+        series = [x for x in datasets if x.SeriesInstanceUID == series_uid]
+        assert len({x.PatientName for x in series}) == 1
+        assert len({x.StudyDate for x in series}) == 1
+        assert [x.InstanceNumber for x in series] == [1, 2, 3]
+        assert len({tuple(x.ImagePositionPatient) for x in series}) == 3
+
+
+def test_patient_attributes_seeded():
+    """Seeded values should not depend on anything else, including today's date"""
+    with use_rng(RNGContext("corpus", 1)):
+        attributes = patient_attributes(0)
+    with use_rng(RNGContext("corpus", 1)):
+        assert patient_attributes(0) == attributes
+    assert "19300101" <= attributes["PatientBirthDate"] <= "20101231"
+
+
+def test_generate_hierarchy_pixels():
+    datasets = generate_hierarchy(
+        HierarchyShape(instances=2),
+        pixel_generator=lambda position: draw_noise(8, 10, "uint16"),
+    )
+    for dataset in datasets:
+        assert dataset.pixel_array.shape == (8, 10)
@@ -0,0 +1,41 @@
+"""Importing should not load heavy dependencies that are not needed"""
+import subprocess
+import sys
+
+import pytest
+
+# Slow to import, and only needed for generating datasets with factories
+FACTORY_MODULES = ("factory", "faker")
+
+
+def modules_loaded_by(module: str):
+    """All modules in sys.modules after importing module in a fresh interpreter"""
+    command = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", command], capture_output=True, text=True, check=True
+    )
+    return set(result.stdout.split())
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "dicomgenerator.async_export",
+        "dicomgenerator.buffers",
+        "dicomgenerator.caching",
+        "dicomgenerator.cli",
+        "dicomgenerator.binary_templates",
+        "dicomgenerator.compression",
+        "dicomgenerator.export",
+        "dicomgenerator.metrics",
+        "dicomgenerator.parallel",
+        "dicomgenerator.persistence",
+        "dicomgenerator.pixeldata",
+        "dicomgenerator.rng",
+        "dicomgenerator.volume",
+        "dicomgenerator.writer",
+    ],
+)
+def test_no_factory_imports(module):
+    loaded = modules_loaded_by(module)
+    assert not loaded.intersection(FACTORY_MODULES)
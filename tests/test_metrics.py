@@ -0,0 +1,76 @@
+import io
+import pickle
+
+from dicomgenerator.metrics import (
+    InMemorySink,
+    collect_metrics,
+    format_report,
+    get_metrics_sink,
+    report,
+    stage,
+    timed,
+)
+from dicomgenerator.generators import ElementPlan
+from dicomgenerator.parallel import generate_corpus
+from dicomgenerator.templates import CTDatasetFactory
+
+
+def test_stage_disabled():
+    """Without collecting, stages should do nothing"""
+    assert get_metrics_sink() is None
+    with stage("something") as timer:
+        timer.add_bytes(10)
+    assert get_metrics_sink() is None
+
+
+def test_collect_metrics():
+    @timed("double")
+    def double(x):
+        return x * 2
+
+    with collect_metrics() as sink:
+        for i in range(100):
+            with stage("write") as timer:
+                timer.add_bytes(i)
+        assert double(2) == 4
+    assert get_metrics_sink() is None
+
+    summary = sink.summary()
+    assert summary["write"].count == 100
+    assert summary["write"].nbytes == sum(range(100))
+    assert summary["write"].p50 <= summary["write"].p99
+    assert summary["double"].count == 1
+
+
+def test_merge_metrics():
+    """Metrics from worker processes are pickled and merged"""
+    worker = InMemorySink()
+    worker.record("write", 0.1, nbytes=5)
+    worker.increment("files", 2)
+    worker = pickle.loads(pickle.dumps(worker))
+
+    sink = InMemorySink()
+    sink.record("write", 0.3, nbytes=5)
+    sink.merge(worker)
+    assert sink.summary()["write"].count == 2
+    assert sink.summary()["write"].nbytes == 10
+    assert sink.counters == {"files": 2}
+
+    output = io.StringIO()
+    report(sink, file=output)
+    assert "write" in output.getvalue()
+    assert "files" in format_report(sink)
+
+
+def test_metrics_in_generation(tmp_path):
+    with collect_metrics() as sink:
+        CTDatasetFactory()
+        generate_corpus(tmp_path, count=2, workers=1, chunk_size=1)
+        ElementPlan(tags=["PatientID", "StudyDate"]).dataset()
+
+    summary = sink.summary()
+    assert summary["factory.generate"].count == 3
+    assert summary["factory.template"].count == 3
+    assert summary["export.write"].count == 2
+    assert summary["export.write"].nbytes > 0
+    assert sink.counters["plan.generated_elements"] == 2
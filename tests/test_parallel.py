@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+
+import pydicom
+
+from dicomgenerator.parallel import generate_corpus, split_into_chunks
+from dicomgenerator.uid import UIDAllocator
+
+
+def test_split_into_chunks():
+    assert list(split_into_chunks(5, 2)) == [(0, 2), (2, 4), (4, 5)]
+
+
+def test_generate_corpus(tmp_path):
+    updates = []
+    result = generate_corpus(
+        tmp_path / "out", count=5, workers=1, chunk_size=2, progress=updates.append
+    )
+    assert result.done == 5
+    assert result.bytes_written > 0
+    assert len(updates) == 3
+    files = sorted((tmp_path / "out").glob("*.dcm"))
+    assert len(files) == 5
+    assert pydicom.dcmread(files[0]).Modality == "CT"
+
+
+def test_generate_corpus_deterministic(tmp_path):
+    """With a seed, output should not depend on the number of workers"""
+    generate_corpus(tmp_path / "one", count=4, seed="a seed", workers=1)
+    generate_corpus(tmp_path / "two", count=4, seed="a seed", workers=2, chunk_size=1)
+    for path in (tmp_path / "one").glob("*.dcm"):
+        assert path.read_bytes() == (tmp_path / "two" / path.name).read_bytes()
+
+
+def test_generate_corpus_deterministic_processes(tmp_path):
+    """Seeded output should not depend on workers, also in fresh processes.
+    With more than one worker the template is compiled, with one it is not
+    """
+    for workers in (1, 2):
+        command = (
+            "from dicomgenerator.parallel import generate_corpus;"
+            f"generate_corpus('{tmp_path / str(workers)}', count=2, seed='a seed',"
+            f" workers={workers}, chunk_size=1)"
+        )
+        env = dict(os.environ, DICOMGENERATOR_CACHE_DIR=str(tmp_path / "cache"))
+        subprocess.run([sys.executable, "-c", command], check=True, env=env)
+    for path in (tmp_path / "1").glob("*.dcm"):
+        assert path.read_bytes() == (tmp_path / "2" / path.name).read_bytes()
+
+
+def test_generate_corpus_unseeded(tmp_path):
+    """Without a seed, workers should not generate the same values"""
+    generate_corpus(tmp_path, count=8, workers=4, chunk_size=2)
+    uids = [pydicom.dcmread(x).SOPInstanceUID for x in tmp_path.glob("*.dcm")]
+    assert len(set(uids)) == 8
+
+
+def test_generate_corpus_uid_allocator(tmp_path):
+    """All UIDs from allocator should be unique over all workers"""
+    allocator = UIDAllocator(seed="a seed")
+    generate_corpus(tmp_path, count=4, workers=2, chunk_size=1, uid_allocator=allocator)
+    uids = [pydicom.dcmread(x).SOPInstanceUID for x in tmp_path.glob("*.dcm")]
+    assert len(set(uids)) == 4
+    assert all(x.startswith(allocator.prefix) for x in uids)
@@ -1,10 +1,22 @@
+import copy
+import json
 from io import StringIO
+from unittest.mock import patch
 
 import pydicom
+import pytest
+from pydicom.tag import Tag
 
 from dicomgenerator.annotation import AnnotatedDataset
+from dicomgenerator.buffers import BufferReader
+from dicomgenerator.caching import load_json_template
 from dicomgenerator.export import export
-from dicomgenerator.persistence import FileJSONDataset, JSONDataset
+from dicomgenerator.persistence import (
+    BulkDataError,
+    BulkDataLoader,
+    FileJSONDataset,
+    JSONDataset,
+)
 
 
 def test_json_dataset_save_load(a_dataset):
@@ -64,3 +76,99 @@ def test_annotate(a_dataset_path):
 
     for element in original:
         assert reloaded[element.tag] == element
+
+
+def test_bulk_data_save_load(a_dataset, tmp_path):
+    """Large binary values should go to a sidecar file and be memory mapped"""
+    path = tmp_path / "template.json"
+    ds = AnnotatedDataset(a_dataset, annotations={"PixelData": "some pixels"})
+    sidecars = ds.save_to_path(path, bulk_data_threshold=1024)
+
+    assert [x.name for x in sidecars] == ["template.0.7FE00010.raw"]
+    pixel_json = json.loads(path.read_text())["dataset"]["7FE00010"]
+    assert pixel_json["BulkDataURI"] == "template.0.7FE00010.raw"
+    assert "InlineBinary" not in pixel_json
+
+    loaded = AnnotatedDataset.load_from_path(path)
+    assert isinstance(loaded.dataset.PixelData, BufferReader)
+    assert loaded.get_annotation("PixelData") == "some pixels"
+    for element in a_dataset:
+        assert loaded.dataset[element.tag] == element
+
+    # templates are plain json datasets
+    JSONDataset(a_dataset).save_to_path(path, bulk_data_threshold=1024)
+    assert load_json_template(path) == loaded.dataset
+
+    # loaded values should be written like any other
+    export(loaded.dataset, path=tmp_path / "exported")
+    exported = pydicom.dcmread(tmp_path / "exported")
+    assert exported.PixelData == a_dataset.PixelData
+
+
+def test_bulk_data_file_json_dataset(a_dataset_path):
+    saved = FileJSONDataset.from_dicom_path(a_dataset_path).save_to_path()
+    assert len(list(a_dataset_path.parent.glob("*.raw"))) == 0  # small pixel data
+
+    FileJSONDataset.from_dicom_path(a_dataset_path).save_to_path(
+        saved, bulk_data_threshold=1024
+    )
+    assert len(list(a_dataset_path.parent.glob("*.raw"))) == 1
+
+
+def test_bulk_data_loader_errors(tmp_path):
+    loader = BulkDataLoader(tmp_path)
+    assert loader.resolve("a.raw") == tmp_path / "a.raw"
+    assert loader.resolve((tmp_path / "b.raw").as_uri()) == tmp_path / "b.raw"
+    with pytest.raises(BulkDataError):
+        loader("7FE00010", "OW", "https://example.com/pixels")
+    with pytest.raises(BulkDataError):
+        loader("7FE00010", "OW", "missing.raw")
+
+
+def test_streaming_json_matches_json_dumps(a_dataset):
+    for json_dataset in (
+        JSONDataset(a_dataset),
+        AnnotatedDataset(a_dataset, annotations={"PatientID": {"a": [1, 2]}}),
+        AnnotatedDataset(pydicom.Dataset(), description='with "quotes"\n'),
+    ):
+        expected = json.dumps(json_dataset.to_json_dict(), indent=4)
+        assert "".join(json_dataset.iter_json()) == expected
+
+
+def test_annotated_dataset_incremental_save(a_dataset):
+    """Saving again should only encode elements that might have changed"""
+    ad = AnnotatedDataset(a_dataset, annotations={"PatientID": "an id"})
+    with patch.object(
+        ad, "element_to_json_dict", wraps=ad.element_to_json_dict
+    ) as encode:
+        ad.save(StringIO())
+        assert encode.call_count == len(a_dataset)
+        encode.reset_mock()
+
+        ad.save(StringIO())
+        unchanged_count = encode.call_count  # sequences and multi-values
+        assert unchanged_count < len(a_dataset)
+        encode.reset_mock()
+
+        ad.dataset.PatientName = "Changed^Name"
+        ad.annotations[Tag("PatientID")] = "another id"
+        ad.dataset.ImageType[0] = "CHANGED"
+        file = StringIO()
+        ad.save(file)
+        assert encode.call_count == unchanged_count + 2
+
+    file.seek(0)
+    loaded = AnnotatedDataset.load(file)
+    assert loaded.dataset.PatientName == "Changed^Name"
+    assert loaded.dataset.ImageType[0] == "CHANGED"
+    assert loaded.get_annotation("PatientID") == "another id"
+
+
+def test_annotated_dataset_load_does_not_modify_input(a_dataset):
+    json_dict = AnnotatedDataset(
+        a_dataset, annotations={"PatientID": "an id"}
+    ).to_json_dict()
+    original = copy.deepcopy(json_dict)
+    loaded = AnnotatedDataset.from_json_dict(json_dict)
+    assert json_dict == original
+    assert loaded.get_annotation("PatientID") == "an id"
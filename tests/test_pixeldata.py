@@ -1,3 +1,4 @@
+import pickle
 from copy import deepcopy
 from io import BytesIO
 
@@ -6,7 +7,16 @@ import pytest
 from pydicom import Dataset, dcmread
 
 from dicomgenerator.generators import quick_dataset
-from dicomgenerator.pixeldata import Block, add_blocks, draw_noise, add_pixel_data_2d
+from dicomgenerator.pixeldata import (
+    Block,
+    add_blocks,
+    add_blocks_array,
+    draw_noise,
+    add_pixel_data_2d,
+    replace_pixel_data,
+    rescale,
+)
+from dicomgenerator.resources import RESOURCE_PATH
 
 
 def simulate_read_from_disk(ds: Dataset) -> Dataset:
@@ -103,3 +113,148 @@ def test_pixel_data_noise_seed():
 
     # when not using a seed the noise should be different each time
     assert not np.all(draw_noise(201, 301, "uint8") == draw_noise(201, 301, "uint8"))
+
+
+def test_replace_pixel_data():
+    ds = quick_dataset(PatientID="TestPatient", PixelData=draw_noise(10, 10, "uint8"))
+    ds = replace_pixel_data(ds, image_path=RESOURCE_PATH / "skeleton.jpg")
+    assert (ds.Rows, ds.Columns) == (800, 490)
+    assert len(ds.PixelData) == 800 * 490 * 2  # int16
+
+    values = np.frombuffer(ds.PixelData, dtype=np.int16)
+    assert values.min() == -2048
+    assert values.max() == 1000
+
+    # Loading the same image again should re-use the decoded pixels
+    ds2 = replace_pixel_data(deepcopy(ds), image_path=RESOURCE_PATH / "skeleton.jpg")
+    assert ds2.PixelData is ds.PixelData
+
+
+def test_add_pixel_data_zero_copy(tmp_path):
+    """Pixel data from a memory-mapped file should be written without copying"""
+    pixels = np.memmap(tmp_path / "pixels", dtype="uint8", mode="w+", shape=(11, 13))
+    pixels[:] = draw_noise(11, 13, "uint8")
+    ds = quick_dataset(PatientID="TestPatient", Modality="CT")
+    ds = add_pixel_data_2d(ds, pixel_array=pixels, dtype="uint8", zero_copy=True)
+
+    loaded = simulate_read_from_disk(ds)
+    assert np.array_equal(loaded.pixel_array, pixels)
+    assert len(loaded.PixelData) == 11 * 13 + 1  # padded to even length
+
+
+def test_add_blocks_array():
+    """Painting many blocks at once should give the same result as add_blocks"""
+    ds = quick_dataset(PatientID="TestPatient", Modality="CT")
+    ds = add_pixel_data_2d(
+        ds, pixel_array=draw_noise(201, 301, "uint16"), dtype="uint16"
+    )
+    blocks = [Block(10, 10, 50, 200), Block(100, 100, 40, 40), Block(0, 0, 1, 1)]
+
+    expected = add_blocks(deepcopy(ds), blocks, value=5)
+    ds = add_blocks_array(ds, blocks, value=5)
+    assert np.array_equal(simulate_read_from_disk(ds).pixel_array, expected.pixel_array)
+
+    # Subsequent calls write into the same buffer
+    buffer = ds.PixelData.buffer
+    add_blocks_array(ds, [[0, 0, 1, 1]], value=7)
+    assert ds.PixelData.buffer is buffer
+    assert ds.pixel_array[0, 0] == 7
+
+    # the dataset should still be copyable
+    for copied in (deepcopy(ds), pickle.loads(pickle.dumps(ds))):
+        assert copied.PixelData.buffer is not buffer
+        assert copied.PixelData.buffer == buffer
+
+
+def test_add_blocks_array_zero_copy():
+    """Arrays passed with zero_copy belong to the caller and should not change"""
+    pixels = np.ones((20, 30), "uint8")
+    ds = quick_dataset(PatientID="TestPatient", Modality="CT")
+    ds = add_pixel_data_2d(ds, pixel_array=pixels, dtype="uint8", zero_copy=True)
+    add_blocks_array(ds, [[0, 0, 10, 10]], value=0)
+    assert pixels.min() == 1
+    assert ds.pixel_array[0, 0] == 0
+
+
+def test_add_blocks_array_multiframe():
+    ds = quick_dataset(PatientID="TestPatient", Modality="CT")
+    ds = add_pixel_data_2d(ds, pixel_array=np.ones((20, 30), "uint8"), dtype="uint8")
+    ds.PixelData = ds.PixelData * 3
+    ds.NumberOfFrames = 3
+
+    add_blocks_array(ds, [[5, 5, 10, 10]], value=0, frames=[0, 2])
+    frames = ds.pixel_array
+    assert frames[0, 5:15, 5:15].max() == 0
+    assert frames[1].min() == 1
+    assert frames[2, 5:15, 5:15].max() == 0
+
+
+@pytest.mark.parametrize(
+    "block", [[-2, 10, 50, 50], [10, -2, 50, 50], [10, 20, 500, 50], [290, 0, 1, 20]]
+)
+def test_add_blocks_array_exceptions(block):
+    ds = quick_dataset(PatientID="TestPatient", Modality="CT")
+    ds = add_pixel_data_2d(ds, pixel_array=draw_noise(201, 301, "uint8"), dtype="uint8")
+    with pytest.raises(ValueError):
+        add_blocks_array(ds, [[0, 0, 10, 10], block])
+
+    with pytest.raises(OverflowError):
+        add_blocks_array(ds, [[0, 0, 10, 10]], value=1000)
+
+
+def test_rescale():
+    values = np.arange(-100, 1000, dtype=np.int16).reshape(10, 110)
+    expected = np.rint((values - -100.0) * (3000 / 1099) - 2048).astype(np.int16)
+    rescaled = rescale(values, -2048, 952, chunk_size=64)
+    assert rescaled.dtype == np.int16
+    assert np.array_equal(rescaled, expected)
+    assert (rescaled.min(), rescaled.max()) == (-2048, 952)
+
+    # in place
+    assert rescale(values, -2048, 952, out=values) is values
+    assert np.array_equal(values, expected)
+
+    floats = rescale(np.linspace(0, 1, 11), 0, 5)
+    assert np.allclose(floats, np.arange(0, 5.5, 0.5))
+
+
+def test_rescale_constant():
+    """All values the same cannot be stretched, should not divide by zero"""
+    rescaled = rescale(np.full((3, 3), 7, dtype=np.uint16), 10, 20)
+    assert np.all(rescaled == 10)
+
+
+def test_draw_noise_frames():
+    """Any frame of a seeded series can be drawn without drawing the ones before"""
+    frames = draw_noise(11, 13, "uint16", seed="series", frames=5)
+    assert frames.shape == (5, 11, 13)
+    assert frames.dtype == np.uint16
+    assert not np.array_equal(frames[0], frames[1])
+
+    assert np.array_equal(draw_noise(11, 13, "uint16", seed="series"), frames[0])
+    assert np.array_equal(
+        draw_noise(11, 13, "uint16", seed="series", frame=3), frames[3]
+    )
+
+    out = np.zeros((2, 11, 13), dtype=np.uint16)
+    assert (
+        draw_noise(11, 13, "uint16", seed="series", frames=2, frame=3, out=out) is out
+    )
+    assert np.array_equal(out, frames[3:])
+
+    with pytest.raises(ValueError):
+        draw_noise(11, 13, "uint8", out=np.zeros((11, 13), dtype=np.uint16))
+
+
+def test_add_blocks_array_many():
+    """Many blocks are painted with a single mask. Result should be the same"""
+    ds = quick_dataset(PatientID="TestPatient", Modality="CT")
+    ds = add_pixel_data_2d(ds, pixel_array=draw_noise(64, 80, "uint8"), dtype="uint8")
+    rng = np.random.default_rng(0)
+    blocks = np.column_stack(
+        [rng.integers(0, 40, (600, 2)), rng.integers(0, 24, (600, 2))]
+    )
+
+    expected = add_blocks(deepcopy(ds), [Block(*x) for x in blocks.tolist()], 3)
+    add_blocks_array(ds, blocks, value=3)
+    assert np.array_equal(ds.pixel_array, expected.pixel_array)
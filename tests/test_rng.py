@@ -0,0 +1,105 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+
+import factory
+import numpy as np
+from factory import random
+
+from dicomgenerator.generators import DataElementFactory
+from dicomgenerator.pixeldata import draw_noise
+from dicomgenerator.rng import ContextualRandom, RNGContext, get_rng, use_rng
+from dicomgenerator.templates import CTDatasetFactory
+
+
+def generate(index, seed="corpus"):
+    with use_rng(RNGContext(seed, index)):
+        dataset = CTDatasetFactory()
+        dataset.PatientComments = DataElementFactory(tag="PatientComments").value
+        pixels = draw_noise(4, 4, "uint16")
+    return dataset, pixels
+
+
+def test_rng_context_reproducible():
+    dataset, pixels = generate(3)
+    random.randgen.random()  # drawing outside a context should not matter
+    again, pixels_again = generate(3)
+    assert dataset == again
+    assert dataset.PatientComments == again.PatientComments
+    assert np.array_equal(pixels, pixels_again)
+
+    other, other_pixels = generate(4)
+    assert other.SOPInstanceUID != dataset.SOPInstanceUID
+    assert not np.array_equal(pixels, other_pixels)
+    assert get_rng() is None
+
+    # noise should differ between calls in the same context
+    with use_rng(RNGContext("corpus")):
+        assert not np.array_equal(
+            draw_noise(4, 4, "uint16"), draw_noise(4, 4, "uint16")
+        )
+
+
+class StockFakerFactory(CTDatasetFactory):
+    PatientID = factory.Faker("first_name")
+    StudyDescription = factory.Faker("sentence")
+
+
+def test_rng_context_stock_faker():
+    """factory.Faker declarations with regular Faker providers should follow
+    the context as well
+    """
+
+    def generate_stock(index):
+        with use_rng(RNGContext("corpus", index)):
+            return StockFakerFactory()
+
+    dataset = generate_stock(1)
+    factory.Faker._get_faker().first_name()  # should not matter
+    again = generate_stock(1)
+    assert dataset.PatientID == again.PatientID
+    assert dataset.StudyDescription == again.StudyDescription
+    assert generate_stock(2).StudyDescription != dataset.StudyDescription
+
+
+def test_rng_context_threads():
+    """Output should not depend on which thread generates what"""
+    expected = [generate(index)[0] for index in range(8)]
+    with ThreadPoolExecutor(4) as executor:
+        generated = [x[0] for x in executor.map(generate, range(8))]
+    assert generated == expected
+
+
+def test_rng_context_shared_handle():
+    context = RNGContext("shared")
+    with ThreadPoolExecutor(4) as executor:
+        values = list(executor.map(lambda _: context.getrandbits(64), range(100)))
+    assert len(set(values)) == 100
+
+
+def test_rng_context_pickle():
+    context = RNGContext("corpus", index=2)
+    context.random()
+    copy = pickle.loads(pickle.dumps(context))
+    assert copy.key == "corpus:2"
+    assert copy.random() == context.random()
+    assert context.spawn(1).key == "corpus:2:1"
+
+
+def test_reseed_outside_context():
+    """Global seeding should keep working as before"""
+    random.reseed_random("a seed")
+    first = CTDatasetFactory().PatientName
+    random.reseed_random("a seed")
+    assert CTDatasetFactory().PatientName == first
+
+
+def test_contextual_random():
+    fallback = Random("fallback")
+    contextual = ContextualRandom(fallback)
+    assert contextual.random() == Random("fallback").random()
+
+    with use_rng(RNGContext("corpus")) as context:
+        ContextualRandom(Random())  # creating one should not reseed the context
+        assert contextual.random() == RNGContext("corpus").random()
+        assert contextual.getstate() == context.getstate()
@@ -1,6 +1,19 @@
+import shutil
+
+import pydicom
 import pytest
 
+from dicomgenerator.annotation import AnnotatedDataset
 from dicomgenerator.generators import quick_dataset
+from dicomgenerator.persistence import JSONDataset
+from dicomgenerator.tools import (
+    CONVERTED,
+    FAILED,
+    SKIPPED,
+    PixelDataMode,
+    convert_tree,
+)
+from tests import RESOURCE_PATH
 
 
 def test_quick_dataset():
@@ -9,3 +22,58 @@ def test_quick_dataset():
     assert ds.StudyDescription == "Test"
     with pytest.raises(ValueError):
         quick_dataset(unknown=1)
+
+
+@pytest.fixture()
+def a_dicom_tree(tmp_path):
+    """Directory with DICOM files in subdirectories, and one non-DICOM file"""
+    root = tmp_path / "input"
+    (root / "patient1").mkdir(parents=True)
+    (root / "patient2").mkdir()
+    shutil.copy(RESOURCE_PATH / "dcmfile1", root / "patient1" / "1.2.3")
+    shutil.copy(RESOURCE_PATH / "dcmfile1", root / "patient2" / "image.dcm")
+    (root / "patient2" / "notes.txt").write_text("not DICOM")
+    return root
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_convert_tree(a_dicom_tree, tmp_path, workers):
+    output_dir = tmp_path / "output"
+    results = convert_tree(
+        a_dicom_tree, output_dir, workers=workers, bulk_data_threshold=1024
+    )
+    assert [x.status for x in results] == [CONVERTED, CONVERTED, FAILED]
+    assert "notes.txt" in str(results[2].source)
+    assert results[2].error
+
+    template = output_dir / "patient1" / "1.2.3_template.json"
+    assert results[0].output == template
+    assert (output_dir / "patient2" / "image_template.json").exists()
+    assert len(list(output_dir.rglob("*.raw"))) == 2
+    loaded = JSONDataset.load_from_path(template).dataset
+    original = pydicom.dcmread(RESOURCE_PATH / "dcmfile1")
+    assert loaded["PixelData"] == original["PixelData"]
+
+    # only failed files should be tried again
+    results = convert_tree(a_dicom_tree, output_dir, workers=workers)
+    assert [x.status for x in results] == [SKIPPED, SKIPPED, FAILED]
+    results = convert_tree(a_dicom_tree, output_dir, workers=workers, force=True)
+    assert [x.status for x in results] == [CONVERTED, CONVERTED, FAILED]
+
+
+def test_convert_tree_drop_pixel_data(a_dicom_tree):
+    """Output inside the input directory should not be converted itself"""
+    output_dir = a_dicom_tree / "templates"
+    results = convert_tree(
+        a_dicom_tree,
+        output_dir,
+        pixel_data=PixelDataMode.DROP,
+        json_dataset_class=AnnotatedDataset,
+        pattern="patient1/*",
+        workers=1,
+    )
+    assert [x.status for x in results] == [CONVERTED]
+    loaded = AnnotatedDataset.load_from_path(results[0].output).dataset
+    assert "PixelData" not in loaded
+    assert "PatientID" in loaded
+    assert len(convert_tree(a_dicom_tree, output_dir, workers=1)) == 3
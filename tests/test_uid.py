@@ -0,0 +1,77 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pydicom.uid import UID
+
+from dicomgenerator.templates import CTDatasetFactory
+from dicomgenerator.uid import (
+    UIDAllocator,
+    UIDAllocatorError,
+    get_uid_allocator,
+    use_uid_allocator,
+)
+
+
+def test_uid_allocator():
+    allocator = UIDAllocator(seed="a seed")
+    uids = allocator.block(3)
+    assert len(set(uids)) == 3
+    assert all(UID(x).is_valid for x in uids)
+
+    # same seed, same UIDs
+    assert UIDAllocator(seed="a seed").block(3) == uids
+    assert UIDAllocator(seed="other seed").block(3) != uids
+
+
+def test_uid_allocator_ranges():
+    allocator = UIDAllocator(seed="a seed")
+    first = allocator.next_uid()
+    reserved = allocator.reserve(10)
+    reserved_uids = reserved.block(10)
+    with pytest.raises(UIDAllocatorError):
+        reserved.next_uid()  # range is exhausted
+
+    remaining = allocator.block(10)
+    assert not set(reserved_uids) & set(remaining)
+    assert first not in reserved_uids
+
+    # slots are independent of allocator state
+    assert allocator.slot(2, 5).block(5) == UIDAllocator(seed="a seed").slot(
+        2, 5
+    ).block(5)
+
+    with pytest.raises(UIDAllocatorError):
+        UIDAllocator(seed="a seed", start=10**30)
+
+
+def test_uid_allocator_threads():
+    """Ranges from reserve() should never overlap UIDs from next_uid()"""
+    allocator = UIDAllocator(seed="a seed")
+
+    def allocate(index):
+        if index % 2:
+            return allocator.reserve(10).block(10)
+        return allocator.block(10)
+
+    with ThreadPoolExecutor(8) as executor:
+        uids = [x for block in executor.map(allocate, range(200)) for x in block]
+    assert len(set(uids)) == 2000
+
+
+def test_uid_allocator_pickle():
+    """A copy should continue counting, not repeat UIDs already handed out"""
+    allocator = UIDAllocator(seed="a seed")
+    handed_out = allocator.block(3)
+    copied = pickle.loads(pickle.dumps(allocator))
+    assert copied.next_uid() not in handed_out
+    assert copied.slot(1, 5).block(5) == allocator.slot(1, 5).block(5)
+
+
+def test_use_uid_allocator():
+    allocator = UIDAllocator(seed="a seed")
+    with use_uid_allocator(allocator):
+        dataset = CTDatasetFactory()
+    assert get_uid_allocator() is None
+    assert dataset.SOPInstanceUID.startswith(allocator.prefix)
+    assert dataset.SOPInstanceUID != dataset.StudyInstanceUID
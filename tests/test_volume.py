@@ -0,0 +1,83 @@
+import pickle
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from dicomgenerator.export import export
+from dicomgenerator.generators import quick_dataset
+from dicomgenerator.resources import RESOURCE_PATH
+from dicomgenerator.templates import CTDatasetFactory
+from dicomgenerator.volume import (
+    ImageStackVolume,
+    NoiseVolume,
+    PhantomVolume,
+    VolumeReader,
+    add_pixel_data_multiframe,
+    volume_series,
+)
+from tests.test_pixeldata import simulate_read_from_disk
+
+
+@pytest.mark.parametrize(
+    "volume",
+    [
+        NoiseVolume(5, 20, 30, seed="a seed"),
+        PhantomVolume(5, 20, 30, dtype="uint8"),
+        ImageStackVolume([RESOURCE_PATH / "skeleton_tiny.jpg"], 20, 30, slices=5),
+    ],
+)
+def test_slabs(volume):
+    """Slab size should not influence generated values"""
+    whole = volume.slab(0, 5)
+    assert whole.shape == (5, 20, 30)
+    in_slabs = np.concatenate([slab for _, slab in volume.iter_slabs(slab_size=2)])
+    assert np.array_equal(whole, in_slabs)
+
+
+def test_volume_series():
+    volume = PhantomVolume(4, 16, 16)
+    series = list(volume_series(CTDatasetFactory(), volume, slab_size=3))
+    assert [x.InstanceNumber for x in series] == [1, 2, 3, 4]
+    assert len({x.SliceLocation for x in series}) == 4
+    assert np.array_equal(series[2].pixel_array, volume.slab(2, 3)[0])
+
+
+def test_add_pixel_data_multiframe():
+    volume = NoiseVolume(3, 11, 7, dtype="uint8", seed="a seed")  # odd size
+    ds = quick_dataset(PatientID="TestPatient", Modality="CT")
+    ds = add_pixel_data_multiframe(ds, volume, slab_size=2)
+    ds = simulate_read_from_disk(ds)
+
+    assert ds.NumberOfFrames == 3
+    assert np.array_equal(ds.pixel_array, volume.slab(0, 3))
+    assert len(ds.PerFrameFunctionalGroupsSequence) == 3
+
+
+def test_volume_reader():
+    volume = NoiseVolume(3, 11, 7, dtype="uint8")  # odd size, no seed
+    reader = VolumeReader(volume, slab_size=2)
+    assert len(reader) == 232
+    chunks = [reader.read(50) for _ in range(5)]
+    assert b"".join(chunks) == volume.slab(0, 3).tobytes() + b"\0"
+    assert reader.read() == b""
+
+    copied = pickle.loads(pickle.dumps(reader))
+    copied.seek(0)
+    assert copied.read() == b"".join(chunks)
+
+
+def test_add_pixel_data_multiframe_memory(tmp_path):
+    """Memory use when writing should depend on slab size, not volume size"""
+    volume = NoiseVolume(64, 256, 256, seed="a seed")  # 8 MB
+    ds = add_pixel_data_multiframe(CTDatasetFactory(), volume, slab_size=4)
+    tracemalloc.start()
+    try:
+        export(ds, path=tmp_path / "volume.dcm")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < volume.slices * volume.slice_nbytes / 4
+    assert (
+        tmp_path / "volume.dcm"
+    ).stat().st_size > volume.slices * volume.slice_nbytes
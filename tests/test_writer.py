@@ -0,0 +1,78 @@
+import datetime
+from io import BytesIO
+
+import numpy as np
+import pytest
+from pydicom import dcmread
+
+from dicomgenerator.export import export
+from dicomgenerator.templates import CTDatasetFactory
+from dicomgenerator.writer import CompiledTemplate, CompiledTemplateError
+
+
+@pytest.fixture
+def a_ct_dataset():
+    return CTDatasetFactory()
+
+
+def test_compiled_template_same_as_export(a_ct_dataset, tmp_path):
+    """Without new values, output should be exactly what export() writes"""
+    export(a_ct_dataset, tmp_path / "exported")
+    template = CompiledTemplate.compile(a_ct_dataset)
+    assert template.encode() == (tmp_path / "exported").read_bytes()
+
+
+def test_compiled_template_values(a_ct_dataset, tmp_path):
+    template = CompiledTemplate.compile(a_ct_dataset)
+    pixels = np.arange(25 * 34, dtype=np.int16).reshape(25, 34)
+    template.write(
+        tmp_path / "written",
+        SOPInstanceUID="1.2.345",  # odd length, needs padding
+        PatientName="Test^Name",
+        InstanceNumber=7,
+        PixelData=pixels,
+    )
+    ds = dcmread(tmp_path / "written")
+    assert ds.SOPInstanceUID == "1.2.345"
+    assert ds.file_meta.MediaStorageSOPInstanceUID == "1.2.345"
+    assert ds.PatientName == "Test^Name"
+    assert ds.InstanceNumber == 7
+    assert np.array_equal(ds.pixel_array, pixels)
+    assert ds.StudyDescription == a_ct_dataset.StudyDescription
+
+
+def test_compiled_template_odd_pixel_data(a_ct_dataset):
+    template = CompiledTemplate.compile(a_ct_dataset, variable=["PixelData"])
+    ds = dcmread(BytesIO(template.encode(PixelData=b"\x01\x02\x03")))
+    assert ds.PixelData == b"\x01\x02\x03\x00"
+
+
+def test_compiled_template_dates(a_ct_dataset, tmp_path):
+    """Dates and times should be written like pydicom writes them"""
+    values = {
+        "StudyDate": datetime.date(2020, 1, 2),
+        "StudyTime": datetime.time(13, 14, 15, 500),
+        "AcquisitionDateTime": datetime.datetime(2020, 1, 2, 13, 14, 15),
+    }
+    template = CompiledTemplate.compile(a_ct_dataset, variable=values)
+    for keyword, value in values.items():
+        setattr(a_ct_dataset, keyword, value)
+    export(a_ct_dataset, tmp_path / "exported")
+
+    assert template.encode(**values) == (tmp_path / "exported").read_bytes()
+    ds = dcmread(BytesIO(template.encode(**values)))
+    assert ds.StudyDate == "20200102"
+    assert ds.StudyTime == "131415.000500"
+
+
+def test_compiled_template_exceptions(a_ct_dataset):
+    with pytest.raises(ValueError):
+        CompiledTemplate.compile(a_ct_dataset, variable=["NotAKeyword"])
+
+    template = CompiledTemplate.compile(a_ct_dataset, variable=["PatientID"])
+    with pytest.raises(CompiledTemplateError):
+        template.encode(PatientName="Not^Variable")
+
+    template = CompiledTemplate.compile(a_ct_dataset, variable=["StudyDescription"])
+    with pytest.raises(ValueError, match="StudyDescription"):
+        template.encode(StudyDescription="a" * 70000)